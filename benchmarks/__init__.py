@@ -0,0 +1 @@
+"""Benchmarks for the pipeline_core hot paths (run with ``python -m benchmarks``)."""
@@ -0,0 +1,5 @@
+import sys
+
+from .run_benchmarks import main
+
+sys.exit(main())
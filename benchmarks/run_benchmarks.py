@@ -0,0 +1,204 @@
+"""Time the pipeline hot paths over synthetic workbooks and record the results as JSON.
+
+    python -m benchmarks --sheets 10 100 1000 --months 18 60 --out bench_results.json
+
+Each case (parse, parse_long, compile, forecast, risk_bands, funnel, format_tables) is
+timed over --repeat runs and then run once more under tracemalloc for its
+peak memory.
+With --compare, cases slower than the baseline file by more than
+--tolerance fail the run with exit code 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from pipeline_core import (
+    MEASURES,
+    SCENARIO_PRESETS,
+    calculate_forecast,
+    calculate_pipeline_funnel,
+    calculate_reserve_distribution,
+    compile_pipeline,
+    format_funnel_summary,
+    format_monthly_breakdown,
+    parse_excel_pipeline,
+    parse_long_pipeline,
+)
+
+from .workbook_generator import generate_workbook, month_labels
+
+DEFAULT_SHEETS = (10, 100, 1000, 5000)
+DEFAULT_MONTHS = (18, 36, 60)
+
+# Forecast inputs matching the app defaults
+FORECAST_SETTINGS = {
+    'unrestricted_start': 100000,
+    'total_funds_start': 100000,
+    'base_staff': 45000,
+    'base_backoffice': 10500,
+    'reserve_deposits': [],
+    'cost_changes': [],
+    'special_projects_costs': [],
+    'threshold': 143000
+}
+
+def measure(fn, repeat):
+    """Run `fn` `repeat` times for timings, then once under tracemalloc for peak memory"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    
+    return {
+        'min_s': min(timings),
+        'median_s': statistics.median(timings),
+        'peak_mib': peak / 2 ** 20
+    }
+
+def write_long_pipeline(compiled, path):
+    """Write a compiled pipeline as a long-format CSV (one row per opportunity and month)"""
+    opportunities, months = compiled['values'].shape[:2]
+    clusters = np.array(list(compiled['clusters']) + [None], dtype=object)
+    table = pd.DataFrame({
+        'opportunity': np.repeat(compiled['names'], months),
+        'cluster': np.repeat(clusters[compiled['cluster_codes']], months),
+        'month': np.tile(np.asarray(compiled['months'], dtype=object), opportunities)
+    })
+    for i, column in enumerate(MEASURES):
+        table[column] = compiled['values'][:, :, i].ravel()
+    table.to_csv(path, index=False)
+
+def benchmark_workbook(path, month_list, repeat):
+    """Benchmark every case on one workbook; returns {case: measurement}"""
+    probabilities = SCENARIO_PRESETS['realistic']
+    pipeline_data = parse_excel_pipeline(path)
+    compiled = compile_pipeline(pipeline_data, month_list)
+    active_opportunities = {name: True for name in compiled['names']}
+    long_path = path.with_suffix('.csv')
+    write_long_pipeline(compiled, long_path)
+    
+    def forecast():
+        return calculate_forecast(
+            compiled, probabilities,
+            FORECAST_SETTINGS['unrestricted_start'], FORECAST_SETTINGS['total_funds_start'],
+            FORECAST_SETTINGS['base_staff'], FORECAST_SETTINGS['base_backoffice'],
+            FORECAST_SETTINGS['reserve_deposits'], FORECAST_SETTINGS['cost_changes'],
+            active_opportunities, FORECAST_SETTINGS['special_projects_costs']
+        )
+    
+    def risk_bands():
+        return calculate_reserve_distribution(
+            compiled, probabilities,
+            FORECAST_SETTINGS['unrestricted_start'], FORECAST_SETTINGS['total_funds_start'],
+            FORECAST_SETTINGS['reserve_deposits'], FORECAST_SETTINGS['cost_changes'],
+            active_opportunities, FORECAST_SETTINGS['special_projects_costs'], FORECAST_SETTINGS['threshold']
+        )
+    
+    def funnel():
+        return calculate_pipeline_funnel(compiled, probabilities, active_opportunities, len(month_list))
+    
+    forecast_df = forecast()
+    funnel_df = funnel()
+    
+    def format_tables():
+        format_monthly_breakdown(forecast_df, True)
+        format_funnel_summary(funnel_df)
+    
+    return {
+        'parse': measure(lambda: parse_excel_pipeline(path), repeat),
+        'parse_long': measure(lambda: compile_pipeline(parse_long_pipeline(long_path), month_list), repeat),
+        'compile': measure(lambda: compile_pipeline(pipeline_data, month_list), repeat),
+        'forecast': measure(forecast, repeat),
+        'risk_bands': measure(risk_bands, repeat),
+        'funnel': measure(funnel, repeat),
+        'format_tables': measure(format_tables, repeat)
+    }
+
+def find_regressions(results, baseline, tolerance):
+    """Cases whose best time exceeds the baseline's by more than `tolerance` times"""
+    reference = {(r['case'], r['sheets'], r['months']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        base = reference.get((result['case'], result['sheets'], result['months']))
+        if base is not None and result['min_s'] > base['min_s'] * tolerance:
+            regressions.append((result, base))
+    return regressions
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.split('\n')[0])
+    parser.add_argument('--sheets', type=int, nargs='+', default=list(DEFAULT_SHEETS), help="Opportunity sheets per workbook")
+    parser.add_argument('--months', type=int, nargs='+', default=list(DEFAULT_MONTHS), help="Months per workbook")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per case (default: 3)")
+    parser.add_argument('--out', default='bench_results.json', help="Results file (default: bench_results.json)")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'pipeline_benchmarks'),
+                        help="Where generated workbooks are kept between runs")
+    parser.add_argument('--compare', help="Baseline results file to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=1.5, help="Allowed slowdown vs the baseline (default: 1.5x)")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    workdir = Path(args.workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    
+    results = []
+    for months in args.months:
+        for sheets in args.sheets:
+            path = workdir / f"pipeline_{sheets}x{months}.xlsx"
+            # Generated workbooks are deterministic, so reuse any left from a previous run
+            if path.exists():
+                month_list = month_labels('May_2026', months)
+            else:
+                month_list = generate_workbook(path, sheets, months)
+    
+            for case, measurement in benchmark_workbook(path, month_list, args.repeat).items():
+                results.append({'case': case, 'sheets': sheets, 'months': months, **measurement})
+                print(f"{case:>14} {sheets:>6} sheets x {months:>2} months: "
+                      f"{measurement['min_s'] * 1000:10.2f} ms  peak {measurement['peak_mib']:8.2f} MiB")
+    
+    report = {
+        'metadata': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.out}")
+    
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for result, base in regressions:
+            print(f"REGRESSION {result['case']} {result['sheets']}x{result['months']}: "
+                  f"{result['min_s'] * 1000:.2f} ms vs baseline {base['min_s'] * 1000:.2f} ms", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
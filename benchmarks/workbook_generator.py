@@ -0,0 +1,58 @@
+"""Synthetic pipeline workbooks in the layout parse_excel_pipeline expects.
+
+Each sheet is one opportunity: A1 name, A2 cluster, row 3 month headers from
+column B, and rows 4-6 income, staff and expenses.
+"""
+
+import random
+
+from openpyxl import Workbook
+
+from pipeline_core.months import generate_month_list
+from pipeline_core.presets import SCENARIO_PRESETS
+
+CLUSTERS = list(SCENARIO_PRESETS['realistic'])
+
+def month_labels(start_month, months):
+    """`months` consecutive labels like May_2026 starting at `start_month`"""
+    return generate_month_list(start_month, months)
+
+def generate_workbook(path, sheets, months, start_month='May_2026', seed=0):
+    """Write a synthetic workbook with `sheets` opportunities over `months` months; returns the month labels.
+    
+    Opportunities start at a random month within the horizon and run for a
+    random length, with some blank and text-formatted cells as in real
+    exports. Uses openpyxl's write-only mode so large workbooks stay cheap to
+    produce.
+    """
+    rng = random.Random(seed)
+    labels = month_labels(start_month, months)
+    
+    workbook = Workbook(write_only=True)
+    for i in range(sheets):
+        sheet = workbook.create_sheet(title=f"Opp{i + 1}")
+        first = rng.randrange(months)
+        last = min(months, first + rng.randint(3, 24))
+        
+        income, staff, expenses = [], [], []
+        for m in range(months):
+            if first <= m < last:
+                value = rng.randint(1000, 40000)
+                staff_value = round(value * rng.uniform(0.3, 0.7))
+                income.append(value if rng.random() > 0.1 else str(value))
+                staff.append(staff_value)
+                expenses.append(round(value * rng.uniform(0.05, 0.2)))
+            else:
+                income.append(None)
+                staff.append(0)
+                expenses.append(None)
+        
+        sheet.append([f"Opportunity {i + 1}"])
+        sheet.append([rng.choice(CLUSTERS)])
+        sheet.append(['Month'] + labels)
+        sheet.append(['Income'] + income)
+        sheet.append(['Staff'] + staff)
+        sheet.append(['Expenses'] + expenses)
+    
+    workbook.save(path)
+    return labels
@@ -0,0 +1,129 @@
+"""Headless forecasting core for the financial pipeline model.
+
+Everything here is importable without Streamlit; the app in
+pipeline_model.py and the batch command line (``python -m pipeline_core``)
+are both thin layers over it.
+"""
+
+from .analysis import (
+    SLIPPAGE_CHUNK_PATTERNS,
+    SLIPPAGE_MAX_PATTERNS,
+    calculate_scenarios,
+    calculate_sensitivity,
+    calculate_slippage,
+    cluster_probability_matrix,
+    goal_seek,
+    pipeline_change_effects,
+    slippage_patterns,
+)
+from .cache import (
+    PARSE_CACHE_MAX_COMPILED,
+    PARSE_CACHE_MAX_ENTRIES,
+    cached_parse_pipeline,
+    cached_pipeline_changes,
+    new_parse_cache,
+    parse_cache_stats,
+)
+from .diagnostics import finish_stopwatch, lap, new_stopwatch, pipeline_memory_bytes, stopwatch_summary
+from .distribution import calculate_reserve_distribution, reserve_effects
+from .engine import (
+    DEFAULT_BASE_BACKOFFICE,
+    DEFAULT_BASE_STAFF,
+    FORECAST_COLUMNS,
+    MEASURES,
+    build_active_mask,
+    build_cluster_aggregates,
+    build_cost_schedules,
+    calculate_forecast,
+    calculate_risk_metrics,
+    cluster_probability_vector,
+    cluster_weighted_totals,
+    compile_long_pipeline,
+    compile_pipeline,
+    cost_schedule_key,
+    ensure_compiled,
+    forecast_arrays,
+    forecast_frame,
+    opportunity_weights,
+    patch_compiled_pipeline,
+    reserve_risk_metrics,
+    scatter_monthly_values,
+    update_cluster_aggregates,
+    weighted_monthly_totals,
+)
+from .export import (
+    EXPORT_FORMATS,
+    export_bytes,
+    export_filename,
+    export_tables,
+    iter_chunks,
+    opportunity_contributions,
+    write_csv,
+    write_parquet,
+    write_xlsx,
+)
+from .funnel import FUNNEL_STAGES, build_funnel_cube, calculate_pipeline_funnel, funnel_from_cube
+from .ingest import (
+    LONG_COLUMNS,
+    PIPELINE_FORMATS,
+    parse_excel_incremental,
+    parse_excel_pipeline,
+    parse_long_pipeline,
+    parse_pipeline,
+    pipeline_format,
+    pipeline_months,
+    sheet_changes,
+    sheet_fingerprint,
+    workbook_sheet_signatures,
+)
+from .months import (
+    DEFAULT_HORIZON,
+    HORIZON_OPTIONS,
+    START_MONTH_OPTIONS,
+    generate_month_list,
+    get_month_index,
+    get_month_label,
+    month_index_map,
+    month_ordinal,
+    ordinal_label,
+)
+from .presets import SCENARIO_PRESETS
+from .simulation import (
+    SIMULATION_BACKENDS,
+    SIMULATION_BATCH_TRIALS,
+    SIMULATION_CHUNK_TRIALS,
+    SIMULATION_CONFIDENCE_Z,
+    SIMULATION_DEFENSIVE_SHARE,
+    SIMULATION_DESIGN_TRIALS,
+    SIMULATION_IMPORTANCE_MONTHS,
+    SIMULATION_PERCENTILES,
+    SIMULATION_SAMPLING,
+    importance_probabilities,
+    run_simulation,
+    sampling_groups,
+    simulate_forecast,
+    simulate_reserve_paths,
+    summarize_reserve_paths,
+)
+from .store import (
+    DEFAULT_STORE_PATH,
+    STORE_CACHE_MAX_ENTRIES,
+    close_pipeline_store,
+    delete_snapshot,
+    list_snapshots,
+    load_snapshot,
+    open_pipeline_store,
+    save_snapshot,
+    snapshot_as_of,
+)
+from .tables import (
+    AMOUNT_COLUMNS,
+    COST_CHANGE_COLUMNS,
+    amounts_from_table,
+    cost_changes_from_table,
+    filter_opportunity_table,
+    format_currency,
+    format_funnel_summary,
+    format_monthly_breakdown,
+    opportunity_table,
+)
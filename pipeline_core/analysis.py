@@ -0,0 +1,438 @@
+"""Batched scenario, sensitivity and goal-seek analysis over the forecast engine."""
+
+import numpy as np
+import pandas as pd
+
+from .engine import (
+    DEFAULT_BASE_BACKOFFICE, DEFAULT_BASE_STAFF, build_active_mask, build_cluster_aggregates,
+    build_cost_schedules, cluster_probability_vector, cluster_weighted_totals, ensure_compiled,
+    forecast_arrays, opportunity_weights, reserve_risk_metrics
+)
+from .months import get_month_index, month_index_map
+
+# Slippage patterns evaluated per engine call, and the most one grid may hold
+SLIPPAGE_CHUNK_PATTERNS = 8192
+SLIPPAGE_MAX_PATTERNS = 250000
+
+def cluster_probability_matrix(compiled, probability_sets):
+    """Stack of cluster probability vectors (see cluster_probability_vector), one row per probabilities dict"""
+    return np.stack([cluster_probability_vector(compiled, probs) for probs in probability_sets])
+
+def calculate_sensitivity(pipeline_data, probabilities, unrestricted_start, total_funds_start,
+                          reserve_deposits, cost_changes, active_opportunities, special_projects_costs,
+                          threshold, probability_delta=10, cost_delta_pct=10, aggregates=None,
+                          month_list=None, schedules=None,
+                          base_staff=DEFAULT_BASE_STAFF, base_backoffice=DEFAULT_BASE_BACKOFFICE):
+    """Tornado-style sensitivity of the risk metrics to each input, in one batched engine call.
+    
+    Every cluster probability is moved by -/+ `probability_delta` percentage
+    points (clipped to 0-100), and the fixed staff and back office schedules
+    by -/+ `cost_delta_pct` percent. All variants are stacked along a
+    scenario axis and evaluated together. Returns a dict with the 'base'
+    metrics and a 'table' DataFrame sorted by the swing in minimum reserves.
+    
+    Pass `schedules` (see build_cost_schedules) to use compiled cost arrays;
+    otherwise they are built from `base_staff` and `base_backoffice`.
+    """
+    compiled = ensure_compiled(pipeline_data, month_list)
+    if schedules is None:
+        schedules = build_cost_schedules(compiled['months'], cost_changes, reserve_deposits, special_projects_costs,
+                                         base_staff, base_backoffice)
+    if aggregates is None:
+        aggregates = build_cluster_aggregates(compiled, build_active_mask(compiled, active_opportunities))
+    restricted_funds = total_funds_start - unrestricted_start
+    
+    # Scenario 0 is the base case, then a (low, high) pair per parameter
+    parameters = []
+    probability_sets = [probabilities]
+    staff_factors = [1.0]
+    backoffice_factors = [1.0]
+    
+    for cluster, value in probabilities.items():
+        low = max(0, value - probability_delta)
+        high = min(100, value + probability_delta)
+        parameters.append((cluster, f"{low - value:+g} pts", f"{high - value:+g} pts"))
+        probability_sets += [{**probabilities, cluster: low}, {**probabilities, cluster: high}]
+        staff_factors += [1.0, 1.0]
+        backoffice_factors += [1.0, 1.0]
+    
+    cost_factor = cost_delta_pct / 100
+    for name, factors in (('Fixed staff costs', staff_factors), ('Fixed back office costs', backoffice_factors)):
+        parameters.append((name, f"{-cost_delta_pct:+g}%", f"{cost_delta_pct:+g}%"))
+        probability_sets += [probabilities, probabilities]
+        staff_factors += [1.0, 1.0]
+        backoffice_factors += [1.0, 1.0]
+        factors[-2:] = [1 - cost_factor, 1 + cost_factor]
+    
+    # (scenarios, clusters) probabilities -> (scenarios, months, measures) totals
+    weighted = cluster_weighted_totals(aggregates, cluster_probability_matrix(compiled, probability_sets))
+    
+    batch_schedules = dict(schedules)
+    batch_schedules['fixed_staff'] = np.outer(staff_factors, schedules['fixed_staff'])
+    batch_schedules['fixed_backoffice'] = np.outer(backoffice_factors, schedules['fixed_backoffice'])
+    
+    unrestricted = forecast_arrays(weighted, unrestricted_start, restricted_funds, **batch_schedules)['unrestrictedReserves']
+    metrics = reserve_risk_metrics(unrestricted, unrestricted_start, threshold)
+    
+    base_min = metrics['min_unrestricted'][0]
+    base_below = metrics['months_below'][0]
+    rows = []
+    for i, (name, low_change, high_change) in enumerate(parameters):
+        low, high = 1 + 2 * i, 2 + 2 * i
+        rows.append({
+            'parameter': name,
+            'low_change': low_change,
+            'high_change': high_change,
+            'min_unrestricted_low': metrics['min_unrestricted'][low],
+            'min_unrestricted_high': metrics['min_unrestricted'][high],
+            'months_below_low': int(metrics['months_below'][low]),
+            'months_below_high': int(metrics['months_below'][high]),
+            'swing': abs(metrics['min_unrestricted'][high] - metrics['min_unrestricted'][low])
+        })
+    
+    table = pd.DataFrame(rows).sort_values('swing', ascending=False, ignore_index=True)
+    return {
+        'base': {'min_unrestricted': float(base_min), 'months_below': int(base_below)},
+        'table': table
+    }
+
+def calculate_scenarios(pipeline_data, scenarios, unrestricted_start, total_funds_start,
+                        reserve_deposits, cost_changes, active_opportunities, special_projects_costs,
+                        threshold, aggregates=None, month_list=None, schedules=None,
+                        base_staff=DEFAULT_BASE_STAFF, base_backoffice=DEFAULT_BASE_BACKOFFICE):
+    """Evaluate several probability scenarios together along a scenario axis.
+    
+    `scenarios` maps a scenario name to a probabilities dict. Returns a dict
+    with 'reserves' (unrestricted reserves per month, one column per
+    scenario) and 'metrics' (min unrestricted, months below threshold and
+    first breach per scenario) DataFrames. All scenarios share one set of
+    `schedules` (see build_cost_schedules), built here from `base_staff`
+    and `base_backoffice` if not given.
+    """
+    compiled = ensure_compiled(pipeline_data, month_list)
+    if schedules is None:
+        schedules = build_cost_schedules(compiled['months'], cost_changes, reserve_deposits, special_projects_costs,
+                                         base_staff, base_backoffice)
+    names = list(scenarios)
+    labels = ['Current'] + list(compiled['months'])
+    
+    reserves = pd.DataFrame({'month': np.arange(len(labels)), 'monthLabel': labels})
+    if not names:
+        return {
+            'reserves': reserves,
+            'metrics': pd.DataFrame(columns=['scenario', 'min_unrestricted', 'months_below', 'first_breach'])
+        }
+    
+    if aggregates is None:
+        aggregates = build_cluster_aggregates(compiled, build_active_mask(compiled, active_opportunities))
+    unrestricted = forecast_arrays(
+        cluster_weighted_totals(aggregates, cluster_probability_matrix(compiled, scenarios.values())),
+        unrestricted_start,
+        total_funds_start - unrestricted_start, **schedules
+    )['unrestrictedReserves']
+    metrics = reserve_risk_metrics(unrestricted, unrestricted_start, threshold)
+    
+    for i, name in enumerate(names):
+        reserves[name] = np.concatenate(([unrestricted_start], unrestricted[i]))
+    
+    return {
+        'reserves': reserves,
+        'metrics': pd.DataFrame({
+            'scenario': names,
+            'min_unrestricted': metrics['min_unrestricted'],
+            'months_below': metrics['months_below'],
+            'first_breach': [labels[i] if i >= 0 else None for i in metrics['first_breach']]
+        })
+    }
+
+def slippage_patterns(clusters, delays):
+    """Every combination of per-cluster delays, shape (patterns, clusters).
+    
+    `delays` maps a cluster name to the delays (whole months) to try for it;
+    clusters it does not mention are never delayed. Raises ValueError if the
+    grid exceeds SLIPPAGE_MAX_PATTERNS.
+    """
+    options = [sorted({int(k) for k in delays.get(cluster, [0])}) or [0] for cluster in clusters]
+    if any(k < 0 for option in options for k in option):
+        raise ValueError("Slippage delays must be zero or more months")
+    count = int(np.prod([len(option) for option in options], dtype=np.int64))
+    if count > SLIPPAGE_MAX_PATTERNS:
+        raise ValueError(f"{count:,} slippage patterns exceed the limit of {SLIPPAGE_MAX_PATTERNS:,}")
+    if not options:
+        return np.zeros((1, 0), dtype=np.intp)
+    grids = np.meshgrid(*options, indexing='ij')
+    return np.stack([grid.ravel() for grid in grids], axis=-1).astype(np.intp)
+
+def calculate_slippage(pipeline_data, probabilities, delays, unrestricted_start, total_funds_start,
+                       reserve_deposits, cost_changes, active_opportunities, special_projects_costs,
+                       threshold, aggregates=None, month_list=None, schedules=None,
+                       base_staff=DEFAULT_BASE_STAFF, base_backoffice=DEFAULT_BASE_BACKOFFICE):
+    """Risk metrics for every combination of per-cluster income timing delays.
+    
+    A cluster delayed by k months has its weighted income, staff and expenses
+    moved k months later; amounts pushed past the horizon drop out. `delays`
+    maps clusters to the delays to try (see slippage_patterns). Each delay is
+    a shifted view of the zero-padded per-cluster month axis, so the whole
+    grid is evaluated in batched engine calls of SLIPPAGE_CHUNK_PATTERNS
+    patterns without copying the month data per pattern.
+    
+    Returns a dict with 'clusters' (the delay columns) and a 'table'
+    DataFrame with one delay column per cluster plus the minimum unrestricted
+    reserves, months below threshold, first breach and whether the pattern
+    breaches, sorted worst first.
+    """
+    compiled = ensure_compiled(pipeline_data, month_list)
+    if schedules is None:
+        schedules = build_cost_schedules(compiled['months'], cost_changes, reserve_deposits, special_projects_costs,
+                                         base_staff, base_backoffice)
+    if aggregates is None:
+        aggregates = build_cluster_aggregates(compiled, build_active_mask(compiled, active_opportunities))
+    labels = ['Current'] + list(compiled['months'])
+    months = len(compiled['months'])
+    
+    clusters = list(compiled['clusters'])
+    patterns = slippage_patterns(clusters, delays)
+    max_delay = int(patterns.max()) if patterns.size else 0
+    
+    # Probability-weighted sums per cluster, padded with max_delay empty months in front;
+    # window j of the padded month axis is the cluster delayed by max_delay - j months
+    weighted_sums = aggregates['sums'][:-1] * cluster_probability_vector(compiled, probabilities)[:-1, None, None]
+    padded = np.concatenate((np.zeros((len(clusters), max_delay, weighted_sums.shape[-1])), weighted_sums), axis=1)
+    shifted = np.moveaxis(np.lib.stride_tricks.sliding_window_view(padded, months, axis=1), -1, -2)
+    
+    # Opportunities with no cluster carry zero probability, so the unknown row adds nothing
+    min_unrestricted = np.empty(len(patterns))
+    months_below = np.empty(len(patterns), dtype=np.intp)
+    first_breach = np.empty(len(patterns), dtype=np.intp)
+    for start in range(0, len(patterns), SLIPPAGE_CHUNK_PATTERNS):
+        chunk = patterns[start:start + SLIPPAGE_CHUNK_PATTERNS]
+        weighted = np.zeros((len(chunk), months, weighted_sums.shape[-1]))
+        for c in range(len(clusters)):
+            weighted += shifted[c, max_delay - chunk[:, c]]
+        unrestricted = forecast_arrays(weighted, unrestricted_start, total_funds_start - unrestricted_start,
+                                       **schedules)['unrestrictedReserves']
+        metrics = reserve_risk_metrics(unrestricted, unrestricted_start, threshold)
+        min_unrestricted[start:start + len(chunk)] = metrics['min_unrestricted']
+        months_below[start:start + len(chunk)] = metrics['months_below']
+        first_breach[start:start + len(chunk)] = metrics['first_breach']
+    
+    table = pd.DataFrame(patterns, columns=clusters)
+    table['min_unrestricted'] = min_unrestricted
+    table['months_below'] = months_below
+    table['first_breach'] = [labels[i] if i >= 0 else None for i in first_breach]
+    table['breaches'] = first_breach >= 0
+    table = table.sort_values(['min_unrestricted', 'months_below'], ascending=[True, False], kind='stable',
+                              ignore_index=True)
+    
+    return {'clusters': clusters, 'table': table}
+
+def _stays_above(unrestricted, threshold):
+    """True where a reserve path (..., months) never drops below threshold after month 0"""
+    return (unrestricted >= threshold).all(axis=-1)
+
+def _bisect_threshold(is_safe, lo, hi, tolerance):
+    """Monotone bisection: `is_safe(hi)` must hold; returns the safe end of the final bracket and the evaluation count.
+    
+    `lo` and `hi` may be given in either order; the search converges on the
+    boundary value closest to `lo` that is still safe.
+    """
+    evaluations = 0
+    while abs(hi - lo) > tolerance:
+        mid = (lo + hi) / 2
+        evaluations += 1
+        if is_safe(mid):
+            hi = mid
+        else:
+            lo = mid
+    return hi, evaluations
+
+def goal_seek(pipeline_data, probabilities, unrestricted_start, total_funds_start,
+              reserve_deposits, cost_changes, active_opportunities, special_projects_costs,
+              threshold, target, cluster=None, month=None, tolerance=1.0, aggregates=None,
+              month_list=None, schedules=None,
+              base_staff=DEFAULT_BASE_STAFF, base_backoffice=DEFAULT_BASE_BACKOFFICE):
+    """Find the smallest change to one input that keeps unrestricted reserves at or above threshold.
+    
+    `target` is one of:
+    - 'probability': the probability (whole %) of `cluster`; every value 0-100
+      is evaluated in one batched call and the closest safe one is chosen
+    - 'staff': a fixed staff level applied from `month` as an extra cost
+      change; bisection finds the highest safe level
+    - 'deposit': a reserve deposit in `month`; bisection finds the smallest
+      safe amount
+    
+    Months 1..N are checked; the current position cannot be changed. Returns
+    a dict with 'feasible', 'current', 'value', 'change', 'evaluations' and
+    'min_unrestricted' (at the solution, or at the best value tried).
+    `schedules` (see build_cost_schedules) must be compiled from the same
+    `cost_changes`; it is built here from `base_staff` and `base_backoffice`
+    if not given.
+    """
+    compiled = ensure_compiled(pipeline_data, month_list)
+    month_labels = compiled['months']
+    if schedules is None:
+        schedules = build_cost_schedules(month_labels, cost_changes, reserve_deposits, special_projects_costs,
+                                         base_staff, base_backoffice)
+    if aggregates is None:
+        aggregates = build_cluster_aggregates(compiled, build_active_mask(compiled, active_opportunities))
+    restricted_funds = total_funds_start - unrestricted_start
+    
+    def reserves(weighted, **overrides):
+        return forecast_arrays(weighted, unrestricted_start, restricted_funds,
+                               **{**schedules, **overrides})['unrestrictedReserves']
+    
+    if target == 'probability':
+        current = probabilities.get(cluster, 0)
+        candidates = np.arange(101)
+        cluster_probs = cluster_probability_matrix(
+            compiled, [{**probabilities, cluster: int(value)} for value in candidates]
+        )
+        paths = reserves(cluster_weighted_totals(aggregates, cluster_probs))
+        safe = _stays_above(paths, threshold)
+        evaluations = len(candidates)
+        
+        if safe.any():
+            # Closest safe value, preferring an increase on ties
+            distance = np.abs(candidates - current) * 2 + (candidates < current)
+            best = int(np.argmin(np.where(safe, distance, np.inf)))
+        else:
+            best = int(np.argmax(paths.min(axis=-1)))
+        value = int(candidates[best])
+        min_unrestricted = float(paths[best].min())
+        feasible = bool(safe[best])
+    
+    elif target in ('staff', 'deposit'):
+        month_idx = get_month_index(month, month_labels) - 1
+        if month_idx < 0:
+            raise ValueError(f"Month not in the forecast horizon: {month}")
+        weighted = cluster_weighted_totals(aggregates, cluster_probability_vector(compiled, probabilities))
+        
+        if target == 'staff':
+            current = float(schedules['fixed_staff'][month_idx])
+            
+            # The new level holds from `month` until the next listed cost change
+            month_index = month_index_map(month_labels)
+            end = min((month_index[c['month']] - 1 for c in cost_changes
+                       if month_index.get(c['month'], 0) - 1 > month_idx), default=len(month_labels))
+            
+            def path_at(level):
+                fixed_staff = schedules['fixed_staff'].copy()
+                fixed_staff[month_idx:end] = level
+                return reserves(weighted, fixed_staff=fixed_staff)
+            
+            # Reserves fall as the staff level rises, so search down from the current level
+            bound = 0.0
+        else:
+            current = 0.0
+            
+            def path_at(amount):
+                extra = np.zeros(len(month_labels))
+                extra[month_idx] = amount
+                return reserves(weighted, deposits=schedules['deposits'] + extra)
+            
+            # A deposit lifts every later month one-for-one, which bounds the amount needed
+            shortfall = threshold - reserves(weighted)[month_idx:]
+            bound = max(0.0, float(shortfall.max())) + tolerance
+        
+        def is_safe(value):
+            return bool(_stays_above(path_at(value), threshold))
+        
+        evaluations = 2
+        if is_safe(current):
+            value, feasible = current, True
+        elif not is_safe(bound):
+            value, feasible = bound, False
+        else:
+            value, steps = _bisect_threshold(is_safe, current, bound, tolerance)
+            evaluations += steps
+            feasible = True
+        min_unrestricted = float(path_at(value).min())
+    
+    else:
+        raise ValueError(f"Unknown goal seek target: {target}")
+    
+    return {
+        'feasible': feasible,
+        'current': current,
+        'value': value,
+        'change': value - current,
+        'evaluations': evaluations,
+        'min_unrestricted': min_unrestricted
+    }
+
+def pipeline_change_effects(previous_pipeline, pipeline_data, changes, probabilities, unrestricted_start,
+                            total_funds_start, reserve_deposits, cost_changes, active_opportunities,
+                            special_projects_costs, threshold, aggregates=None, month_list=None, schedules=None,
+                            base_staff=DEFAULT_BASE_STAFF, base_backoffice=DEFAULT_BASE_BACKOFFICE):
+    """Per-opportunity effect on the reserve forecast of the sheets that changed between two uploads.
+    
+    `changes` is the 'changes' dict of parse_excel_incremental for the
+    upload `pipeline_data` against `previous_pipeline`; both are compiled
+    over the same months. Each added, removed or changed opportunity is
+    reverted on its own (weighted by `probabilities`, with removed
+    opportunities counted as active unless excluded by name), and all the
+    reverts are evaluated in one batched engine call. Returns a dict with a
+    'summary' of the combined effect and a 'table' DataFrame sorted by the
+    size of each opportunity's effect on the final month's reserves.
+    """
+    compiled = ensure_compiled(pipeline_data, month_list)
+    previous = ensure_compiled(previous_pipeline, compiled['months'])
+    if schedules is None:
+        schedules = build_cost_schedules(compiled['months'], cost_changes, reserve_deposits, special_projects_costs,
+                                         base_staff, base_backoffice)
+    active_mask = build_active_mask(compiled, active_opportunities)
+    if aggregates is None:
+        aggregates = build_cluster_aggregates(compiled, active_mask)
+    previous_mask = build_active_mask(previous, dict(zip(compiled['names'], active_mask)), default=True)
+    
+    # One row per differing sheet with its position in each upload (-1 where absent)
+    positions = {name: i for i, name in enumerate(changes['sheet_names'])}
+    previous_positions = {name: i for i, name in enumerate(changes['previous_sheet_names'])}
+    rows = ([(name, 'added', -1, positions[name]) for name in changes['added']]
+            + [(name, 'removed', previous_positions[name], -1) for name in changes['removed']]
+            + [(name, 'changed', previous_positions[name], positions[name]) for name in changes['changed']])
+    old = np.array([row[2] for row in rows], dtype=np.intp)
+    new = np.array([row[3] for row in rows], dtype=np.intp)
+    
+    # Weighted (opportunities, months, measures) difference each change makes
+    weights = opportunity_weights(compiled, probabilities, active_mask)
+    previous_weights = opportunity_weights(previous, probabilities, previous_mask)
+    deltas = np.zeros((len(rows),) + compiled['values'].shape[1:])
+    deltas[new >= 0] += compiled['values'][new[new >= 0]] * weights[new[new >= 0], None, None]
+    deltas[old >= 0] -= previous['values'][old[old >= 0]] * previous_weights[old[old >= 0], None, None]
+    
+    # Scenario 0 is the new upload, 1 reverts every change, then one revert per change
+    weighted = cluster_weighted_totals(aggregates, cluster_probability_vector(compiled, probabilities))
+    stacked = np.concatenate((weighted[None], (weighted - deltas.sum(axis=0))[None], weighted - deltas))
+    unrestricted = forecast_arrays(stacked, unrestricted_start, total_funds_start - unrestricted_start,
+                                   **schedules)['unrestrictedReserves']
+    metrics = reserve_risk_metrics(unrestricted, unrestricted_start, threshold)
+    end_effects = unrestricted[0, -1] - unrestricted[:, -1]
+    min_effects = metrics['min_unrestricted'][0] - metrics['min_unrestricted']
+    
+    previous_clusters = np.array(list(previous['clusters']) + [None], dtype=object)
+    clusters = np.array(list(compiled['clusters']) + [None], dtype=object)
+    table = pd.DataFrame({
+        'sheet': [row[0] for row in rows],
+        'opportunity': [compiled['names'][j] if j >= 0 else previous['names'][i] for _, _, i, j in rows],
+        'cluster': [clusters[compiled['cluster_codes'][j]] if j >= 0 else previous_clusters[previous['cluster_codes'][i]]
+                    for _, _, i, j in rows],
+        'change': [row[1] for row in rows],
+        'contribution_change': (deltas[..., 0] - deltas[..., 1] - deltas[..., 2]).sum(axis=-1),
+        'end_reserves_effect': end_effects[2:],
+        'min_reserves_effect': min_effects[2:]
+    })
+    table = table.reindex(table['end_reserves_effect'].abs().sort_values(ascending=False).index).reset_index(drop=True)
+    
+    return {
+        'summary': {
+            'added': len(changes['added']),
+            'removed': len(changes['removed']),
+            'changed': len(changes['changed']),
+            'reparsed': changes['reparsed'],
+            'end_reserves_effect': float(end_effects[1]),
+            'min_reserves_effect': float(min_effects[1]),
+            'months_below_change': int(metrics['months_below'][0] - metrics['months_below'][1])
+        },
+        'table': table
+    }
@@ -0,0 +1,206 @@
+"""Batch forecasting of pipeline workbooks from the command line.
+
+Forecasts every workbook in a directory (one per cost centre) in parallel
+and writes the monthly forecasts and risk metrics to CSV, Parquet or XLSX.
+Long-format CSV or Parquet pipeline files are forecast alongside workbooks::
+
+    python -m pipeline_core pipelines/ --out results/ --start-month May_2026
+
+Lists that have no command-line flag (cost changes, deposits, special
+projects, probability overrides, inactive opportunities) come from a JSON
+settings file passed with --config, using the keys of DEFAULT_SETTINGS.
+"""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .engine import calculate_forecast, calculate_risk_metrics, compile_pipeline
+from .export import write_xlsx
+from .ingest import PIPELINE_FORMATS, parse_pipeline, pipeline_format
+from .months import HORIZON_OPTIONS, START_MONTH_OPTIONS, generate_month_list
+from .presets import SCENARIO_PRESETS
+
+# Settings used for every workbook unless overridden by --config or flags
+DEFAULT_SETTINGS = {
+    'start_month': 'May_2026',
+    'horizon': 18,
+    'scenario': 'realistic',
+    'probabilities': {},
+    'unrestricted_reserves': 100000,
+    'total_funds': 100000,
+    'base_staff': 45000,
+    'base_backoffice': 10500,
+    'threshold': 143000,
+    'cost_changes': [],
+    'reserve_deposits': [],
+    'special_projects_costs': [],
+    'inactive_opportunities': []
+}
+
+OUTPUT_FORMATS = ('csv', 'parquet', 'xlsx')
+
+def load_settings(config_path=None, overrides=None):
+    """Merge DEFAULT_SETTINGS, an optional JSON settings file and command-line overrides"""
+    settings = dict(DEFAULT_SETTINGS)
+    if config_path is not None:
+        with open(config_path) as f:
+            config = json.load(f)
+        unknown = set(config) - set(DEFAULT_SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown settings in {config_path}: {', '.join(sorted(unknown))}")
+        settings.update(config)
+    settings.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    
+    if settings['scenario'] not in SCENARIO_PRESETS:
+        raise ValueError(f"Unknown scenario: {settings['scenario']}")
+    if not isinstance(settings['horizon'], int) or settings['horizon'] < 1:
+        raise ValueError(f"Horizon must be a positive number of months: {settings['horizon']}")
+    return settings
+
+def forecast_workbook(path, settings):
+    """Parse and forecast one workbook or long-format file; returns (forecast DataFrame, risk metrics dict)"""
+    pipeline_data = parse_pipeline(path, pipeline_format(path))
+    compiled = compile_pipeline(pipeline_data, generate_month_list(settings['start_month'], settings['horizon']))
+    
+    probabilities = {**SCENARIO_PRESETS[settings['scenario']], **settings['probabilities']}
+    active_opportunities = ~np.isin(compiled['names'], list(settings['inactive_opportunities']))
+    
+    forecast_df = calculate_forecast(
+        compiled,
+        probabilities,
+        settings['unrestricted_reserves'],
+        settings['total_funds'],
+        settings['base_staff'],
+        settings['base_backoffice'],
+        settings['reserve_deposits'],
+        settings['cost_changes'],
+        active_opportunities,
+        settings['special_projects_costs']
+    )
+    metrics = calculate_risk_metrics(forecast_df, settings['threshold'])
+    metrics['opportunities'] = len(compiled['names'])
+    return forecast_df, metrics
+
+def _forecast_task(task):
+    """Process-pool worker: never raises, so one bad workbook does not stop the batch"""
+    path, settings = task
+    try:
+        forecast_df, metrics = forecast_workbook(path, settings)
+        metrics['error'] = None
+    except Exception as e:
+        forecast_df, metrics = None, {'error': f"{type(e).__name__}: {e}"}
+    return path, forecast_df, metrics
+
+def find_workbooks(inputs):
+    """Expand files and directories into a sorted list of pipeline files, skipping Excel lock files"""
+    workbooks = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            candidates = sorted(p for p in path.iterdir() if p.suffix.lower().lstrip('.') in PIPELINE_FORMATS)
+        else:
+            candidates = [path]
+        workbooks += [p for p in candidates if not p.name.startswith('~$')]
+    return workbooks
+
+def run_batch(workbooks, settings, workers=None):
+    """Forecast workbooks in parallel; returns (forecasts, risk metrics) DataFrames keyed by workbook"""
+    tasks = [(str(path), settings) for path in workbooks]
+    if workers == 1 or len(tasks) <= 1:
+        results = [_forecast_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_forecast_task, tasks))
+    
+    forecasts = []
+    metrics_rows = []
+    for path, forecast_df, metrics in results:
+        workbook = Path(path).stem
+        if forecast_df is not None:
+            forecasts.append(forecast_df.assign(workbook=workbook))
+        metrics_rows.append({'workbook': workbook, **metrics})
+    
+    metrics_df = pd.DataFrame(metrics_rows)
+    metrics_df = metrics_df[[c for c in metrics_df.columns if c != 'error'] + ['error']]
+    
+    forecasts_df = pd.concat(forecasts, ignore_index=True) if forecasts else pd.DataFrame()
+    if not forecasts_df.empty:
+        forecasts_df = forecasts_df[['workbook'] + [c for c in forecasts_df.columns if c != 'workbook']]
+    return forecasts_df, metrics_df
+
+def write_table(df, path, output_format):
+    """Write a DataFrame as CSV, Parquet or a one-sheet workbook, adding the extension to `path`"""
+    path = Path(path).with_suffix(f".{output_format}")
+    if output_format == 'xlsx':
+        write_xlsx({path.stem: df}, path)
+    elif output_format == 'parquet':
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+    return path
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m pipeline_core',
+        description="Forecast a directory of pipeline workbooks without the Streamlit app."
+    )
+    parser.add_argument('inputs', nargs='+', help="Pipeline files or directories of them (.xlsx workbooks, long-format .csv or .parquet)")
+    parser.add_argument('--out', default='forecast_output', help="Output directory (default: forecast_output)")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='csv', help="Output file format")
+    parser.add_argument('--config', help="JSON settings file (keys as in DEFAULT_SETTINGS)")
+    parser.add_argument('--start-month', choices=START_MONTH_OPTIONS, help="First forecast month")
+    parser.add_argument('--horizon', type=int, choices=HORIZON_OPTIONS, help="Forecast horizon in months")
+    parser.add_argument('--scenario', choices=list(SCENARIO_PRESETS), help="Probability preset")
+    parser.add_argument('--unrestricted-reserves', type=float, help="Current unrestricted reserves (£)")
+    parser.add_argument('--total-funds', type=float, help="Current total funds (£)")
+    parser.add_argument('--base-staff', type=float, help="Base fixed staff costs (£/month)")
+    parser.add_argument('--base-backoffice', type=float, help="Base fixed back office costs (£/month)")
+    parser.add_argument('--threshold', type=float, help="Critical threshold for unrestricted reserves (£)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Worker processes (default: CPU count)")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    
+    try:
+        settings = load_settings(args.config, {
+            'start_month': args.start_month,
+            'horizon': args.horizon,
+            'scenario': args.scenario,
+            'unrestricted_reserves': args.unrestricted_reserves,
+            'total_funds': args.total_funds,
+            'base_staff': args.base_staff,
+            'base_backoffice': args.base_backoffice,
+            'threshold': args.threshold
+        })
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    
+    workbooks = find_workbooks(args.inputs)
+    if not workbooks:
+        parser.error("no pipeline files found")
+    
+    forecasts_df, metrics_df = run_batch(workbooks, settings, workers=args.workers)
+    
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        forecasts_path = write_table(forecasts_df, out_dir / 'forecasts', args.format)
+        metrics_path = write_table(metrics_df, out_dir / 'risk_metrics', args.format)
+    except ImportError as e:
+        print(f"Cannot write {args.format}: {e}", file=sys.stderr)
+        return 2
+    
+    failed = metrics_df[metrics_df['error'].notna()]
+    print(f"Forecast {len(workbooks) - len(failed)} of {len(workbooks)} workbooks -> {forecasts_path}, {metrics_path}")
+    for _, row in failed.iterrows():
+        print(f"  {row['workbook']}: {row['error']}", file=sys.stderr)
+    return 1 if len(failed) else 0
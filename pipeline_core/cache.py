@@ -0,0 +1,156 @@
+"""Content-hash LRU cache of parsed and compiled pipelines."""
+
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+from .engine import compile_pipeline, patch_compiled_pipeline
+from .ingest import parse_excel_incremental, parse_pipeline, sheet_changes
+
+# Maximum number of distinct uploads kept parsed in memory
+PARSE_CACHE_MAX_ENTRIES = 8
+
+# Month lists each upload stays compiled for (start month and horizon combinations)
+PARSE_CACHE_MAX_COMPILED = 3
+
+def new_parse_cache(max_entries=PARSE_CACHE_MAX_ENTRIES, max_compiled=PARSE_CACHE_MAX_COMPILED):
+    """Create an empty LRU cache of parsed pipelines keyed by upload content hash.
+    
+    Entries only depend on the uploaded content, so sessions share them.
+    Each keeps its compiled pipelines for the `max_compiled` most recently
+    used month lists. Differences between two uploads are kept per
+    (previous, current) pair.
+    """
+    return {
+        'entries': OrderedDict(),
+        'max_entries': max_entries,
+        'max_compiled': max_compiled,
+        'hits': 0,
+        'misses': 0,
+        'evictions': 0,
+        'changes': OrderedDict(),
+        'lock': threading.Lock()
+    }
+
+def _remember_changes(cache, pair, changes):
+    """Keep the differences between a pair of uploads, dropping the least recently used pairs"""
+    with cache['lock']:
+        cache['changes'][pair] = changes
+        cache['changes'].move_to_end(pair)
+        while len(cache['changes']) > cache['max_entries']:
+            cache['changes'].popitem(last=False)
+
+def _compiled(cache, entry, month_list):
+    """An entry's pipeline compiled over `month_list`, compiling it (outside the lock) if not kept"""
+    months = tuple(month_list)
+    with cache['lock']:
+        compiled = entry['compiled'].get(months)
+        if compiled is not None:
+            entry['compiled'].move_to_end(months)
+            return compiled
+    
+    compiled = compile_pipeline(entry['pipeline_data'], months)
+    with cache['lock']:
+        entry['compiled'][months] = compiled
+        entry['compiled'].move_to_end(months)
+        while len(entry['compiled']) > cache['max_compiled']:
+            entry['compiled'].popitem(last=False)
+    return compiled
+
+def _parse_entry(cache, file_bytes, file_format, key, previous_key):
+    """Parse an upload into a new cache entry, incrementally against the previous upload's workbook if cached"""
+    if file_format != 'xlsx':
+        return {'pipeline_data': parse_pipeline(io.BytesIO(file_bytes), file_format), 'compiled': OrderedDict()}
+    
+    with cache['lock']:
+        previous = cache['entries'].get(previous_key) if previous_key is not None else None
+        previous_compiled = list(previous['compiled'].items()) if previous is not None else []
+    previous_sheets = previous.get('sheets') if previous is not None else None
+    previous_shared = previous.get('shared') if previous is not None else None
+    
+    parsed = parse_excel_incremental(io.BytesIO(file_bytes), previous_sheets, previous_shared)
+    entry = {'pipeline_data': parsed['pipeline_data'], 'sheets': parsed['sheets'], 'shared': parsed['shared'],
+             'compiled': OrderedDict()}
+    if previous_sheets is not None:
+        _remember_changes(cache, (previous_key, key), parsed['changes'])
+        # Reuse the unchanged rows of every month list the previous upload was compiled for
+        for months, compiled in previous_compiled:
+            entry['compiled'][months] = patch_compiled_pipeline(
+                compiled, entry['pipeline_data'], parsed['changes']['previous_positions']
+            )
+    return entry
+
+def cached_parse_pipeline(cache, file_bytes, month_list, file_format='xlsx', previous_key=None):
+    """Parse an uploaded workbook or long-format file, reusing an earlier parse of identical bytes.
+    
+    Returns (content_hash, pipeline_data, compiled_pipeline). The compiled
+    pipeline is also cached for the most recent month lists, so changing the
+    start month only recompiles. Cached objects are shared and must not be mutated.
+    
+    Pass the content hash of the upload a workbook replaces as `previous_key`:
+    if that upload is still cached, only the sheets that changed are read
+    and compiled, and the differences are kept for cached_pipeline_changes.
+    Identical bytes already parsed (by any session) are reused as they are.
+    """
+    key = hashlib.sha256(file_bytes).hexdigest()
+    
+    with cache['lock']:
+        entry = cache['entries'].get(key)
+        if entry is not None:
+            cache['entries'].move_to_end(key)
+            cache['hits'] += 1
+    
+    if entry is None:
+        # Parse outside the lock so other sessions are not blocked
+        entry = _parse_entry(cache, file_bytes, file_format, key, previous_key)
+        with cache['lock']:
+            cache['misses'] += 1
+            cache['entries'][key] = entry
+            cache['entries'].move_to_end(key)
+            while len(cache['entries']) > cache['max_entries']:
+                cache['entries'].popitem(last=False)
+                cache['evictions'] += 1
+    
+    return key, entry['pipeline_data'], _compiled(cache, entry, month_list)
+
+def cached_pipeline_changes(cache, key, month_list, previous_key):
+    """Sheet changes between a cached workbook upload and the one it replaced, or None.
+    
+    `previous_key` is the content hash of the upload `key` replaced in the
+    same session. Returns the changes (see sheet_changes) plus
+    'previous_key' and 'previous_compiled' (the replaced upload compiled
+    over `month_list`). Changes found while parsing are reused; otherwise
+    they are worked out from both uploads' parsed sheets, with no sheet
+    re-read. None if there is no previous upload, either is not a cached
+    workbook, or the two are identical.
+    """
+    if previous_key is None or previous_key == key:
+        return None
+    pair = (previous_key, key)
+    with cache['lock']:
+        entry = cache['entries'].get(key)
+        previous = cache['entries'].get(previous_key)
+        changes = cache['changes'].get(pair)
+        if changes is not None:
+            cache['changes'].move_to_end(pair)
+    if entry is None or previous is None or 'sheets' not in entry or 'sheets' not in previous:
+        return None
+    if changes is None:
+        changes = sheet_changes(previous['sheets'], entry['sheets'])
+        _remember_changes(cache, pair, changes)
+    
+    return {**changes, 'previous_key': previous_key, 'previous_compiled': _compiled(cache, previous, month_list)}
+
+def parse_cache_stats(cache):
+    """Hit/miss counters and occupancy of a parse cache"""
+    with cache['lock']:
+        lookups = cache['hits'] + cache['misses']
+        return {
+            'hits': cache['hits'],
+            'misses': cache['misses'],
+            'evictions': cache['evictions'],
+            'entries': len(cache['entries']),
+            'max_entries': cache['max_entries'],
+            'hit_rate': cache['hits'] / lookups if lookups else 0.0
+        }
@@ -0,0 +1,38 @@
+"""Lightweight phase timing for profiling reruns.
+
+A stopwatch attributes the wall-clock time between successive `lap` calls
+to named phases. A disabled stopwatch makes `lap` return immediately, so
+instrumented code costs nothing when diagnostics are off.
+"""
+
+import time
+
+import numpy as np
+
+def new_stopwatch(enabled=True):
+    """Start a stopwatch for one run"""
+    now = time.perf_counter()
+    return {'enabled': enabled, 'started': now, 'last': now, 'phases': {}, 'finished': False}
+
+def lap(stopwatch, phase):
+    """Attribute the time since the previous lap (or the start) to `phase`"""
+    if not stopwatch['enabled']:
+        return
+    now = time.perf_counter()
+    stopwatch['phases'][phase] = stopwatch['phases'].get(phase, 0.0) + now - stopwatch['last']
+    stopwatch['last'] = now
+
+def finish_stopwatch(stopwatch):
+    """Mark the run as over, so that code running later times itself on a new stopwatch"""
+    stopwatch['finished'] = True
+
+def stopwatch_summary(stopwatch):
+    """Per-phase seconds plus the total since the stopwatch started"""
+    return {**stopwatch['phases'], 'total': stopwatch['last'] - stopwatch['started']}
+
+def pipeline_memory_bytes(pipeline_data, compiled=None):
+    """Approximate memory held by a parsed pipeline and its compiled arrays"""
+    total = int(pipeline_data.memory_usage(deep=True).sum())
+    if compiled is not None:
+        total += sum(value.nbytes for value in compiled.values() if isinstance(value, np.ndarray))
+    return total
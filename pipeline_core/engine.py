@@ -0,0 +1,400 @@
+"""Compiled pipeline representation and the vectorized forecast engine."""
+
+import numpy as np
+import pandas as pd
+
+from .months import month_index_map
+
+# Measures held per opportunity and month in the compiled pipeline
+MEASURES = ('income', 'staff', 'expenses')
+
+# Base monthly fixed costs used when none are given
+DEFAULT_BASE_STAFF = 45000
+DEFAULT_BASE_BACKOFFICE = 10500
+
+# Forecast output columns in their established order
+FORECAST_COLUMNS = [
+    'unrestrictedReserves', 'unrestrictedAfterSpecial', 'restrictedFunds', 'totalFunds',
+    'totalIncome', 'projectStaffCosts', 'projectExpenses', 'projectContribution',
+    'fixedStaffCosts', 'staffRecovery', 'unrecoveredStaffCosts', 'fixedBackOfficeCosts',
+    'costsFromContribution', 'netPosition', 'reserveDeposit', 'specialProjectsCost'
+]
+
+def compile_pipeline(pipeline_data, month_list):
+    """Compile the parsed pipeline into dense arrays for the forecast engine.
+    
+    Returns a dict with the opportunity names, the cluster names and a
+    per-opportunity cluster code (-1 where the cluster is missing), the month
+    labels, and a float array of shape (opportunities, months, measures).
+    Long-format data (from parse_long_pipeline) goes to compile_long_pipeline.
+    """
+    month_list = list(month_list)
+    
+    if 'month' in pipeline_data.columns:
+        return compile_long_pipeline(pipeline_data, month_list)
+    
+    if pipeline_data.empty:
+        return {
+            'names': np.array([], dtype=object),
+            'clusters': [],
+            'cluster_codes': np.array([], dtype=np.intp),
+            'months': month_list,
+            'values': np.zeros((0, len(month_list), len(MEASURES)))
+        }
+    
+    # Month-major column order so a reshape gives (opportunities, months, measures)
+    columns = [f"{month}_{measure}" for month in month_list for measure in MEASURES]
+    values = (pipeline_data.reindex(columns=columns)
+              .apply(pd.to_numeric, errors='coerce')
+              .fillna(0)
+              .to_numpy(dtype=float)
+              .reshape(len(pipeline_data), len(month_list), len(MEASURES)))
+    
+    cluster_codes, clusters = pd.factorize(pipeline_data['cluster'])
+    
+    return {
+        'names': pipeline_data['opportunity_name'].to_numpy(dtype=object),
+        'clusters': list(clusters),
+        'cluster_codes': cluster_codes.astype(np.intp),
+        'months': month_list,
+        'values': values
+    }
+
+def patch_compiled_pipeline(previous, pipeline_data, previous_positions):
+    """Compile a re-parsed workbook pipeline by reusing rows of an earlier compiled one.
+    
+    `previous_positions` gives, for each row of `pipeline_data`, the row of
+    `previous` it is unchanged from, or -1 for rows to compile afresh. The
+    result equals compile_pipeline(pipeline_data, previous['months']); the
+    earlier arrays, which caches may share, are left untouched.
+    """
+    month_list = previous['months']
+    reuse = previous_positions >= 0
+    fresh = np.flatnonzero(~reuse)
+    
+    values = np.empty((len(pipeline_data), len(month_list), len(MEASURES)))
+    values[reuse] = previous['values'][previous_positions[reuse]]
+    if len(fresh):
+        values[fresh] = compile_pipeline(pipeline_data.iloc[fresh], month_list)['values']
+    
+    cluster_codes, clusters = pd.factorize(pipeline_data['cluster'])
+    
+    return {
+        'names': pipeline_data['opportunity_name'].to_numpy(dtype=object),
+        'clusters': list(clusters),
+        'cluster_codes': cluster_codes.astype(np.intp),
+        'months': list(month_list),
+        'values': values
+    }
+
+def compile_long_pipeline(long_data, month_list):
+    """Compile a long-format pipeline (one row per opportunity and month) into dense arrays.
+    
+    Opportunities keep the order they first appear in, each takes the first
+    cluster given for it ("Unknown" if none), and rows for the same
+    opportunity and month are summed. Rows without an opportunity or for
+    months outside `month_list` are ignored.
+    """
+    month_list = list(month_list)
+    
+    # Opportunity and month codes in one pass each; -1 marks a missing name or unlisted month
+    opportunity_codes, names = pd.factorize(long_data['opportunity'])
+    month_codes = pd.Categorical(long_data['month'], categories=month_list).codes
+    
+    clusters_by_opportunity = (long_data['cluster']
+                               .groupby(opportunity_codes).first()
+                               .reindex(range(len(names)))
+                               .fillna('Unknown'))
+    cluster_codes, clusters = pd.factorize(clusters_by_opportunity)
+    
+    amounts = long_data[list(MEASURES)].apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=float)
+    
+    return {
+        'names': np.asarray(names, dtype=object),
+        'clusters': list(clusters),
+        'cluster_codes': cluster_codes.astype(np.intp),
+        'months': month_list,
+        'values': scatter_monthly_values(opportunity_codes, month_codes, amounts, len(names), len(month_list))
+    }
+
+def scatter_monthly_values(opportunity_codes, month_codes, amounts, opportunities, months):
+    """Sum rows of (measures,) amounts into an (opportunities, months, measures) array.
+    
+    Rows with a negative opportunity or month code are dropped; rows for the
+    same cell are added together.
+    """
+    keep = (opportunity_codes >= 0) & (month_codes >= 0)
+    cells = opportunity_codes[keep] * months + month_codes[keep]
+    values = np.zeros((opportunities, months, len(MEASURES)))
+    for i in range(len(MEASURES)):
+        values[:, :, i] = np.bincount(cells, weights=amounts[keep, i], minlength=opportunities * months
+                                      ).reshape(opportunities, months)
+    return values
+
+def ensure_compiled(pipeline_data, month_list=None):
+    """Return a compiled pipeline, compiling a parsed DataFrame over `month_list` if needed"""
+    if isinstance(pipeline_data, dict):
+        return pipeline_data
+    if month_list is None:
+        raise ValueError("month_list is required when passing a parsed pipeline DataFrame")
+    return compile_pipeline(pipeline_data, month_list)
+
+def build_active_mask(compiled, active_opportunities, default=False):
+    """Boolean vector of opportunities that are toggled on.
+    
+    `active_opportunities` is either a boolean mask already aligned with the
+    compiled pipeline, returned as is, or a {name: bool} dict in which names
+    it does not mention count as `default`.
+    """
+    if isinstance(active_opportunities, np.ndarray):
+        if active_opportunities.shape != (len(compiled['names']),):
+            raise ValueError(f"Active mask has shape {active_opportunities.shape}, "
+                             f"expected ({len(compiled['names'])},)")
+        return active_opportunities.astype(bool, copy=False)
+    return np.fromiter(
+        (bool(active_opportunities.get(name, default)) for name in compiled['names']),
+        dtype=bool,
+        count=len(compiled['names'])
+    )
+
+def cluster_probability_vector(compiled, probabilities):
+    """Probability (0-1) for each cluster in the compiled pipeline, plus a trailing 0 for unknown clusters"""
+    probs = [probabilities.get(cluster, 0) / 100 for cluster in compiled['clusters']]
+    return np.array(probs + [0.0], dtype=float)
+
+def opportunity_weights(compiled, probabilities, active_mask):
+    """Per-opportunity probability weight, zero for inactive opportunities"""
+    # Code -1 (missing cluster) indexes the trailing zero probability
+    return cluster_probability_vector(compiled, probabilities)[compiled['cluster_codes']] * active_mask
+
+def weighted_monthly_totals(compiled, weights):
+    """Weighted sum over opportunities; weights (..., opportunities) -> (..., months, measures)"""
+    return np.tensordot(weights, compiled['values'], axes=([-1], [0]))
+
+def build_cluster_aggregates(compiled, active_mask):
+    """Per-cluster monthly sums of income/staff/expenses over active opportunities.
+    
+    `sums` has shape (clusters + 1, months, measures); the last row collects
+    opportunities with no cluster, lining up with cluster_probability_vector.
+    The forecast is linear in the cluster probabilities, so these sums are
+    all it needs from opportunity-level data.
+    """
+    sums = np.zeros((len(compiled['clusters']) + 1,) + compiled['values'].shape[1:])
+    np.add.at(sums, compiled['cluster_codes'][active_mask], compiled['values'][active_mask])
+    return {'mask': active_mask.copy(), 'sums': sums}
+
+def update_cluster_aggregates(aggregates, compiled, active_mask):
+    """Apply opportunity toggles to the aggregates in place; returns how many opportunities changed"""
+    changed = np.flatnonzero(aggregates['mask'] != active_mask)
+    if len(changed) == 0:
+        return 0
+    
+    if len(changed) * 4 > len(active_mask):
+        # Bulk changes: a rebuild costs about the same and drops accumulated rounding
+        aggregates.update(build_cluster_aggregates(compiled, active_mask))
+    else:
+        sign = np.where(active_mask[changed], 1.0, -1.0)
+        np.add.at(aggregates['sums'], compiled['cluster_codes'][changed],
+                  compiled['values'][changed] * sign[:, None, None])
+        aggregates['mask'][changed] = active_mask[changed]
+    return len(changed)
+
+def cluster_weighted_totals(aggregates, cluster_probs):
+    """Weighted monthly totals from cluster aggregates; cluster_probs (..., clusters + 1) -> (..., months, measures)"""
+    return np.tensordot(cluster_probs, aggregates['sums'], axes=([-1], [0]))
+
+def forecast_arrays(weighted, unrestricted_start, restricted_funds, fixed_staff, fixed_backoffice,
+                    deposits, special_costs):
+    """Core forecast arithmetic on monthly arrays.
+    
+    `weighted` has shape (..., months, measures); the cost, deposit and special
+    schedules broadcast against (..., months). Leading dimensions let callers
+    evaluate many scenarios in one call.
+    """
+    total_income = weighted[..., 0]
+    total_project_staff = weighted[..., 1]
+    total_project_expenses = weighted[..., 2]
+    
+    # Calculate contribution
+    project_contribution = total_income - total_project_staff - total_project_expenses
+    
+    # Staff cost recovery: project staff costs offset the fixed salary bill
+    staff_recovery = total_project_staff
+    unrecovered_staff_costs = np.maximum(0, fixed_staff - staff_recovery)
+    
+    # Use contribution to cover unrecovered staff costs first, then back office
+    net_position = project_contribution - unrecovered_staff_costs - fixed_backoffice
+    costs_to_cover = unrecovered_staff_costs + fixed_backoffice
+    
+    # Reserves carry forward month to month
+    unrestricted = unrestricted_start + np.cumsum(net_position + deposits, axis=-1)
+    
+    return {
+        'totalIncome': total_income,
+        'projectStaffCosts': total_project_staff,
+        'projectExpenses': total_project_expenses,
+        'projectContribution': project_contribution,
+        'fixedStaffCosts': np.broadcast_to(fixed_staff, net_position.shape),
+        'staffRecovery': staff_recovery,
+        'unrecoveredStaffCosts': unrecovered_staff_costs,
+        'fixedBackOfficeCosts': np.broadcast_to(fixed_backoffice, net_position.shape),
+        'costsFromContribution': costs_to_cover,
+        'netPosition': net_position,
+        'reserveDeposit': np.broadcast_to(deposits, net_position.shape),
+        'specialProjectsCost': np.broadcast_to(special_costs, net_position.shape),
+        'unrestrictedReserves': unrestricted,
+        'unrestrictedAfterSpecial': unrestricted - special_costs,
+        'restrictedFunds': np.full(net_position.shape, float(restricted_funds)),
+        'totalFunds': unrestricted + restricted_funds
+    }
+
+def forecast_frame(result, month_labels, unrestricted_start, total_funds_start, restricted_funds):
+    """Build the forecast DataFrame (month 0 = current position) from a single-scenario result"""
+    months = len(month_labels)
+    
+    # Month 0 (Current) only carries the balance columns
+    current = {
+        'unrestrictedReserves': unrestricted_start,
+        'unrestrictedAfterSpecial': unrestricted_start,
+        'restrictedFunds': restricted_funds,
+        'totalFunds': total_funds_start
+    }
+    
+    columns = {
+        'month': np.arange(months + 1),
+        'monthLabel': ['Current'] + list(month_labels)
+    }
+    for key in FORECAST_COLUMNS:
+        columns[key] = np.concatenate(([current.get(key, np.nan)], result[key]))
+    
+    return pd.DataFrame(columns)
+
+def build_cost_schedules(month_labels, cost_changes, reserve_deposits, special_projects_costs,
+                         base_staff=DEFAULT_BASE_STAFF, base_backoffice=DEFAULT_BASE_BACKOFFICE):
+    """Monthly fixed cost, deposit and special project arrays, keyed by forecast_arrays argument.
+    
+    Fixed costs start at the base values and each cost change is
+    forward-filled from its month. Entries are placed through a precomputed
+    label->index lookup, so building the schedules is linear in the horizon
+    plus the number of entries. The arrays are read-only, so one set can be
+    compiled per rerun and shared by the forecast, scenarios, sensitivity,
+    goal seek and simulation.
+    """
+    month_index = month_index_map(month_labels)
+    months = len(month_index)
+    
+    fixed_staff = np.full(months, float(base_staff))
+    fixed_backoffice = np.full(months, float(base_backoffice))
+    
+    # Later changes overwrite earlier ones from their month onwards; ties keep input order
+    indexed_changes = sorted(((month_index.get(change['month'], 0), change) for change in cost_changes),
+                             key=lambda x: x[0])
+    for change_idx, change in indexed_changes:
+        if change_idx > 0:
+            fixed_staff[change_idx - 1:] = change['staff']
+            fixed_backoffice[change_idx - 1:] = change['backoffice']
+    
+    # Only the first special projects entry for a month applies
+    special_costs = np.zeros(months)
+    special_set = np.zeros(months, dtype=bool)
+    for sp in special_projects_costs:
+        idx = month_index.get(sp['month'], 0)
+        if idx > 0 and not special_set[idx - 1]:
+            special_costs[idx - 1] = sp['amount']
+            special_set[idx - 1] = True
+    
+    deposits = np.zeros(months)
+    for d in reserve_deposits:
+        idx = month_index.get(d['month'], 0)
+        if idx > 0 and d['amount'] > 0:
+            deposits[idx - 1] += d['amount']
+    
+    schedules = {
+        'fixed_staff': fixed_staff,
+        'fixed_backoffice': fixed_backoffice,
+        'deposits': deposits,
+        'special_costs': special_costs
+    }
+    for schedule in schedules.values():
+        schedule.setflags(write=False)
+    return schedules
+
+def cost_schedule_key(month_labels, cost_changes, reserve_deposits, special_projects_costs,
+                      base_staff=DEFAULT_BASE_STAFF, base_backoffice=DEFAULT_BASE_BACKOFFICE):
+    """Hashable key of the build_cost_schedules inputs, for caching compiled schedules"""
+    return (
+        tuple(month_labels), base_staff, base_backoffice,
+        tuple((c['month'], c['staff'], c['backoffice']) for c in cost_changes),
+        tuple((d['month'], d['amount']) for d in reserve_deposits),
+        tuple((sp['month'], sp['amount']) for sp in special_projects_costs)
+    )
+
+def calculate_forecast(pipeline_data, probabilities, unrestricted_start, total_funds_start, 
+                      base_staff, base_backoffice, reserve_deposits, cost_changes, active_opportunities,
+                      special_projects_costs, aggregates=None, month_list=None, schedules=None):
+    """Calculate the monthly financial forecast with staff cost recovery.
+    
+    `pipeline_data` is a compiled pipeline, or a parsed DataFrame together
+    with the `month_list` to forecast over; the horizon is the length of
+    that month list. Pass `aggregates` (see build_cluster_aggregates) to
+    reuse per-cluster sums kept in step with `active_opportunities`, and
+    `schedules` (see build_cost_schedules) to reuse compiled cost, deposit
+    and special project arrays; otherwise both are built here.
+    """
+    compiled = ensure_compiled(pipeline_data, month_list)
+    month_labels = compiled['months']
+    
+    # Calculate static restricted funds
+    restricted_funds = total_funds_start - unrestricted_start
+    
+    if schedules is None:
+        schedules = build_cost_schedules(month_labels, cost_changes, reserve_deposits, special_projects_costs,
+                                         base_staff, base_backoffice)
+    
+    # Probability-weighted pipeline totals, shape (months, measures)
+    if aggregates is None:
+        aggregates = build_cluster_aggregates(compiled, build_active_mask(compiled, active_opportunities))
+    weighted = cluster_weighted_totals(aggregates, cluster_probability_vector(compiled, probabilities))
+    
+    result = forecast_arrays(weighted, unrestricted_start, restricted_funds, **schedules)
+    
+    return forecast_frame(result, month_labels, unrestricted_start, total_funds_start, restricted_funds)
+
+def reserve_risk_metrics(unrestricted, unrestricted_start, threshold):
+    """Risk metrics over reserve paths of shape (..., months), counting month 0 (Current) as the dashboard does.
+    
+    Returns arrays of the minimum unrestricted reserves, the number of months
+    below threshold and the first breach month index (0 = Current, -1 = none).
+    """
+    start = np.broadcast_to(np.float64(unrestricted_start), unrestricted.shape[:-1] + (1,))
+    full = np.concatenate((start, unrestricted), axis=-1)
+    below = full < threshold
+    return {
+        'min_unrestricted': full.min(axis=-1),
+        'months_below': below.sum(axis=-1),
+        'first_breach': np.where(below.any(axis=-1), below.argmax(axis=-1), -1)
+    }
+
+def calculate_risk_metrics(forecast_df, threshold):
+    """Dashboard risk metrics for a forecast DataFrame from calculate_forecast"""
+    unrestricted = forecast_df['unrestrictedReserves']
+    min_unrestricted = unrestricted.min()
+    months_below_threshold = int((unrestricted < threshold).sum())
+    first_breach = forecast_df[unrestricted < threshold]['monthLabel'].iloc[0] if months_below_threshold > 0 else None
+    
+    # Staff recovery averages exclude month 0
+    forecast_months = forecast_df[forecast_df['month'] > 0]
+    avg_staff_recovery = forecast_months['staffRecovery'].mean()
+    avg_fixed_staff = forecast_months['fixedStaffCosts'].mean()
+    avg_staff_recovery_pct = (avg_staff_recovery / avg_fixed_staff * 100) if avg_fixed_staff > 0 else 0
+    
+    return {
+        'min_unrestricted': min_unrestricted,
+        'months_below_threshold': months_below_threshold,
+        'first_breach': first_breach,
+        'min_total_funds': forecast_df['totalFunds'].min(),
+        'max_total_funds': forecast_df['totalFunds'].max(),
+        'is_at_risk': bool(min_unrestricted < threshold),
+        'avg_staff_recovery': avg_staff_recovery,
+        'avg_staff_recovery_pct': avg_staff_recovery_pct
+    }
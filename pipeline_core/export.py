@@ -0,0 +1,150 @@
+"""Streaming export of forecast, funnel, contribution and scenario tables.
+
+Tables are written chunk by chunk: XLSX through openpyxl's write-only
+workbook, CSV through a text stream and Parquet through a ParquetWriter
+(one row group per chunk). A table can be a DataFrame or an iterable of
+DataFrame chunks, so batched scenario or simulation output can be exported
+as it is produced without holding a workbook in memory.
+"""
+
+import io
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from .engine import MEASURES, build_active_mask, opportunity_weights
+
+EXPORT_FORMATS = ('xlsx', 'csv', 'parquet')
+
+# Rows per chunk when a whole DataFrame is exported
+EXPORT_CHUNK_ROWS = 10000
+
+# Excel's row limit; longer tables continue on further sheets
+EXCEL_MAX_ROWS = 1048576
+
+def opportunity_contributions(compiled, probabilities, active_opportunities):
+    """Probability-weighted income, staff, expenses and contribution per opportunity and month (long format)"""
+    weights = opportunity_weights(compiled, probabilities, build_active_mask(compiled, active_opportunities))
+    weighted = compiled['values'] * weights[:, None, None]
+    opportunities, months = weighted.shape[:2]
+    clusters = np.array(list(compiled['clusters']) + [None], dtype=object)
+    
+    table = pd.DataFrame({
+        'opportunity': np.repeat(compiled['names'], months),
+        'cluster': np.repeat(clusters[compiled['cluster_codes']], months),
+        'month': np.tile(np.arange(1, months + 1), opportunities),
+        'monthLabel': np.tile(np.asarray(compiled['months'], dtype=object), opportunities),
+        'weight': np.repeat(weights, months)
+    })
+    for i, measure in enumerate(MEASURES):
+        table[measure] = weighted[:, :, i].ravel()
+    table['contribution'] = table['income'] - table['staff'] - table['expenses']
+    return table
+
+def iter_chunks(table, chunk_rows=EXPORT_CHUNK_ROWS):
+    """DataFrame chunks of a table given as a DataFrame or as an iterable of DataFrames"""
+    if isinstance(table, pd.DataFrame):
+        for start in range(0, max(len(table), 1), chunk_rows):
+            yield table.iloc[start:start + chunk_rows]
+    else:
+        yield from table
+
+def _excel_rows(chunk):
+    """Rows of a chunk as Python values, with missing values as empty cells"""
+    values = chunk.astype(object).where(chunk.notna(), None)
+    return values.itertuples(index=False, name=None)
+
+def write_xlsx(tables, target):
+    """Write {sheet name: table} to one workbook at `target` (path or binary file), one sheet per table"""
+    workbook = Workbook(write_only=True)
+    for name, table in tables.items():
+        sheet, header, rows, part = None, None, 0, 1
+        for chunk in iter_chunks(table):
+            if header is None:
+                header = [str(c) for c in chunk.columns]
+            for row in _excel_rows(chunk):
+                if sheet is None or rows == EXCEL_MAX_ROWS:
+                    # Sheet names are limited to 31 characters
+                    title = name if part == 1 else f"{name} ({part})"
+                    sheet = workbook.create_sheet(title=title[:31])
+                    sheet.append(header)
+                    rows, part = 1, part + 1
+                sheet.append(row)
+                rows += 1
+        if sheet is None:
+            sheet = workbook.create_sheet(title=name[:31])
+            if header is not None:
+                sheet.append(header)
+    workbook.save(target)
+
+def write_csv(table, target):
+    """Write a table as CSV to a text file object"""
+    for i, chunk in enumerate(iter_chunks(table)):
+        chunk.to_csv(target, index=False, header=i == 0)
+
+def write_parquet(table, target):
+    """Write a table as Parquet to a binary file object, one row group per chunk.
+    
+    The file's schema is settled by the first chunks in which every column
+    has a type: chunks where a column is all missing are held back until
+    then, so a column that only fills in later is not fixed as null.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    writer, pending = None, []
+    try:
+        for chunk in iter_chunks(table):
+            batch = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                pending.append(batch)
+                if any(pa.types.is_null(field.type) for field in batch.schema):
+                    continue
+                # The newest schema first, so its pandas metadata describes the typed columns
+                writer = pq.ParquetWriter(target, pa.unify_schemas([b.schema for b in reversed(pending)]))
+                batches, pending = pending, []
+            else:
+                batches = [batch]
+            for batch in batches:
+                writer.write_table(batch.cast(writer.schema))
+        if pending:
+            writer = pq.ParquetWriter(target, pa.unify_schemas([b.schema for b in reversed(pending)]))
+            for batch in pending:
+                writer.write_table(batch.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+def export_tables(tables, output_format, target):
+    """Export {name: table} to `target` (path or binary file).
+    
+    XLSX gives one workbook with a sheet per table. CSV and Parquet give a
+    ZIP archive with one file per table, each streamed into the archive.
+    """
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {output_format}")
+    if output_format == 'xlsx':
+        write_xlsx(tables, target)
+        return
+    
+    with zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, table in tables.items():
+            with archive.open(f"{name}.{output_format}", 'w') as member:
+                if output_format == 'csv':
+                    with io.TextIOWrapper(member, encoding='utf-8', newline='') as text:
+                        write_csv(table, text)
+                else:
+                    write_parquet(table, member)
+
+def export_bytes(tables, output_format):
+    """export_tables into memory, for download buttons; returns the file contents"""
+    buffer = io.BytesIO()
+    export_tables(tables, output_format, buffer)
+    return buffer.getvalue()
+
+def export_filename(stem, output_format):
+    """Download file name for an export: the workbook itself for XLSX, otherwise a ZIP archive"""
+    return str(Path(stem).with_suffix('.xlsx' if output_format == 'xlsx' else f".{output_format}.zip"))
@@ -0,0 +1,69 @@
+"""Pipeline funnel totals from a prefix-sum cluster x month cube."""
+
+import numpy as np
+import pandas as pd
+
+from .engine import build_active_mask, build_cluster_aggregates, ensure_compiled
+
+# Funnel stages and the clusters each one includes (Secured income is excluded)
+FUNNEL_STAGES = {
+    'All Opportunities': ['Ideas at development stage', 'Medium likelihood projects in development', 
+                         'High likelihood projects in development', 'Proposals out for decision',
+                         'Negotiating', 'Contracting'],
+    'Identified Income': ['Medium likelihood projects in development', 'High likelihood projects in development',
+                         'Proposals out for decision', 'Negotiating', 'Contracting'],
+    'Proposals': ['Proposals out for decision', 'Negotiating', 'Contracting'],
+    'Negotiating': ['Negotiating', 'Contracting'],
+    'Contracting': ['Contracting']
+}
+
+def build_funnel_cube(compiled, aggregates):
+    """Cluster x month income cube for active opportunities, with prefix sums along the month axis.
+    
+    `prefix[:, n]` is the income of each cluster over the first n months, so
+    the total for any window [start, end) is `prefix[:, end] - prefix[:, start]`.
+    """
+    clusters = compiled['clusters']
+    
+    # Income sums, dropping the trailing no-cluster row
+    cube = aggregates['sums'][:len(clusters), :, 0]
+    
+    prefix = np.zeros((len(clusters), cube.shape[1] + 1))
+    np.cumsum(cube, axis=1, out=prefix[:, 1:])
+    
+    # Stage -> cluster membership matrix
+    membership = np.array(
+        [[cluster in included for cluster in clusters] for included in FUNNEL_STAGES.values()],
+        dtype=float
+    ).reshape(len(FUNNEL_STAGES), len(clusters))
+    
+    return {
+        'clusters': clusters,
+        'months': compiled['months'],
+        'prefix': prefix,
+        'membership': membership
+    }
+
+def funnel_from_cube(cube, probabilities, start, end):
+    """Funnel totals for the month window [start, end) from a prefix-sum cube"""
+    months = len(cube['months'])
+    start = min(max(start, 0), months)
+    end = min(max(end, start), months)
+    
+    window = cube['prefix'][:, end] - cube['prefix'][:, start]
+    cluster_probs = np.array([probabilities.get(c, 0) / 100 for c in cube['clusters']], dtype=float)
+    
+    return pd.DataFrame({
+        'stage': list(FUNNEL_STAGES),
+        'total_value': cube['membership'] @ window,
+        'weighted_value': cube['membership'] @ (window * cluster_probs)
+    })
+
+def calculate_pipeline_funnel(pipeline_data, probabilities, active_opportunities, months_filter, aggregates=None,
+                              month_list=None):
+    """Calculate pipeline funnel values for visualization over the next `months_filter` months"""
+    compiled = ensure_compiled(pipeline_data, month_list)
+    if aggregates is None:
+        aggregates = build_cluster_aggregates(compiled, build_active_mask(compiled, active_opportunities))
+    cube = build_funnel_cube(compiled, aggregates)
+    return funnel_from_cube(cube, probabilities, 0, months_filter)
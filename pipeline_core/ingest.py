@@ -0,0 +1,316 @@
+"""Pipeline ingestion from Excel workbooks and long-format CSV/Parquet files."""
+
+import hashlib
+import zipfile
+from pathlib import Path
+from xml.etree import ElementTree
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+from .engine import MEASURES
+from .months import month_ordinal
+
+PIPELINE_FORMATS = ('xlsx', 'csv', 'parquet')
+
+# Columns of a long-format file: one row per opportunity and month
+LONG_COLUMNS = ('opportunity', 'cluster', 'month', 'income', 'staff', 'expenses')
+
+# XML namespaces of the .xlsx workbook part and its relationships
+_XLSX_NAMESPACES = {
+    'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'rel': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+    'pkg': 'http://schemas.openxmlformats.org/package/2006/relationships'
+}
+
+# Workbook parts shared by every sheet that affect the values read from its cells
+_SHARED_PARTS = ('sharedStrings', 'styles')
+
+def _cell_text(value):
+    """Text of a header cell, or None when the cell is blank"""
+    if value is None:
+        return None
+    text = str(value).strip()
+    if text == '' or text.lower() == 'nan':
+        return None
+    return text
+
+def _cell_number(value):
+    """Numeric value of a data cell, treating blanks and non-numeric text as 0"""
+    if value is None or isinstance(value, bool):
+        return 0
+    if isinstance(value, (int, float)):
+        return float(value) if value == value else 0  # NaN check
+    text = str(value).strip()
+    if text == '':
+        return 0
+    try:
+        return float(text)
+    except ValueError:
+        return 0
+
+def _sheet_rows(worksheet):
+    """Rows 1-6 of a worksheet as tuples of cell values, padded to six rows"""
+    # Read-only sheets trust the stored <dimension>, which some tools leave stale; read the cells as they are
+    worksheet.reset_dimensions()
+    rows = list(worksheet.iter_rows(min_row=1, max_row=6, values_only=True))
+    return rows + [()] * (6 - len(rows))
+
+def _sheet_opportunity(sheet_name, rows):
+    """Opportunity dict (name, cluster and {month}_{measure} values) from a sheet's rows 1-6"""
+    # Extract opportunity name (A1) and cluster (A2)
+    opportunity_name = _cell_text(rows[0][0] if rows[0] else None) or f"Opportunity_{sheet_name}"
+    cluster = _cell_text(rows[1][0] if rows[1] else None) or "Unknown"
+    
+    # Month headers are in row 3, income/staff/expenses in rows 4-6, all from column B
+    months = rows[2][1:]
+    income_values = rows[3][1:]
+    staff_values = rows[4][1:]
+    expenses_values = rows[5][1:]
+    
+    # Create opportunity dictionary
+    opp_data = {
+        'opportunity_name': opportunity_name,
+        'cluster': cluster
+    }
+    
+    # Add monthly data
+    for i, month in enumerate(months):
+        month_str = _cell_text(month)
+        if month_str is None:
+            continue
+        
+        # Remove leading apostrophe if present (Excel text formatting)
+        month_str = month_str.lstrip("'")
+        
+        opp_data[f"{month_str}_income"] = _cell_number(income_values[i]) if i < len(income_values) else 0
+        opp_data[f"{month_str}_staff"] = _cell_number(staff_values[i]) if i < len(staff_values) else 0
+        opp_data[f"{month_str}_expenses"] = _cell_number(expenses_values[i]) if i < len(expenses_values) else 0
+    
+    return opp_data
+
+def parse_excel_pipeline(excel_file):
+    """Parse multi-sheet Excel file with opportunities.
+    
+    The workbook is opened once in read-only (streaming) mode and only rows
+    1-6 of each sheet are read, so cost scales with the number of sheets
+    rather than their full size.
+    """
+    all_opportunities = []
+    
+    workbook = load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        for sheet_name in workbook.sheetnames:
+            all_opportunities.append(_sheet_opportunity(sheet_name, _sheet_rows(workbook[sheet_name])))
+    finally:
+        workbook.close()
+    
+    return pd.DataFrame(all_opportunities)
+
+def sheet_fingerprint(opportunity):
+    """Content hash of a sheet's parsed opportunity, independent of how the cells were stored"""
+    items = sorted((key, value if isinstance(value, str) else float(value)) for key, value in opportunity.items())
+    return hashlib.sha1(repr(items).encode()).hexdigest()
+
+def workbook_sheet_signatures(excel_file):
+    """Sheet and shared-part signatures in workbook order, read from the .xlsx zip directory alone.
+    
+    Returns ({sheet name: signature}, {shared part: signature}). A signature
+    is the CRC and size of the part's XML, so an equal sheet signature means
+    an equal sheet part, without opening a single worksheet. A sheet whose
+    part cannot be found gets None, which never counts as unchanged. The
+    shared parts are the shared strings and styles, which give the cells
+    their text and date types.
+    """
+    with zipfile.ZipFile(excel_file) as archive:
+        parts = {info.filename: (info.CRC, info.file_size) for info in archive.infolist()}
+        workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+        relationships = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    
+    # Targets are relative to xl/ unless absolute within the package
+    targets = {}
+    shared = {}
+    for rel in relationships.findall('pkg:Relationship', _XLSX_NAMESPACES):
+        target = rel.get('Target', '')
+        path = target.lstrip('/') if target.startswith('/') else f"xl/{target}"
+        targets[rel.get('Id')] = path
+        kind = rel.get('Type', '').rsplit('/', 1)[-1]
+        if kind in _SHARED_PARTS:
+            shared[kind] = (path, parts.get(path))
+    
+    signatures = {}
+    for sheet in workbook.findall('main:sheets/main:sheet', _XLSX_NAMESPACES):
+        signatures[sheet.get('name')] = parts.get(targets.get(sheet.get(f"{{{_XLSX_NAMESPACES['rel']}}}id")))
+    return signatures, shared
+
+def _shared_values(excel_file, shared):
+    """What the shared parts mean for cell values: the shared strings and each cell style's number format"""
+    tag = f"{{{_XLSX_NAMESPACES['main']}}}"
+    values = {kind: [] for kind in _SHARED_PARTS}
+    with zipfile.ZipFile(excel_file) as archive:
+        if shared.get('sharedStrings', (None, None))[1] is not None:
+            with archive.open(shared['sharedStrings'][0]) as part:
+                for _, element in ElementTree.iterparse(part):
+                    if element.tag == f"{tag}si":
+                        # Plain or rich text; phonetic runs are not part of the value
+                        runs = (element.findall('main:t', _XLSX_NAMESPACES)
+                                + element.findall('main:r/main:t', _XLSX_NAMESPACES))
+                        values['sharedStrings'].append(''.join(run.text or '' for run in runs))
+                        element.clear()
+        if shared.get('styles', (None, None))[1] is not None:
+            styles = ElementTree.fromstring(archive.read(shared['styles'][0]))
+            formats = {fmt.get('numFmtId'): fmt.get('formatCode')
+                       for fmt in styles.findall('main:numFmts/main:numFmt', _XLSX_NAMESPACES)}
+            values['styles'] = [
+                formats.get(xf.get('numFmtId', '0'), xf.get('numFmtId', '0'))
+                for xf in styles.findall('main:cellXfs/main:xf', _XLSX_NAMESPACES)
+            ]
+    return values
+
+def parse_excel_incremental(excel_file, previous_sheets=None, previous_shared=None):
+    """Parse a workbook, re-reading only sheets that differ from an earlier parse of it.
+    
+    `previous_sheets` and `previous_shared` are the `sheets` and `shared`
+    dicts returned for the earlier upload. Sheets whose zip signature is
+    unchanged reuse their parsed opportunity, unless an edit to the shared
+    strings or styles changed what existing cells mean (rather than only
+    adding strings or styles), in which case every sheet is read. Sheets
+    read are compared by the fingerprint of their parsed values. Returns a
+    dict with the parsed 'pipeline_data', the 'sheets' and 'shared' to pass
+    next time, and the 'changes' (see sheet_changes) against the earlier
+    upload.
+    """
+    previous_sheets = previous_sheets or {}
+    signatures, shared_parts = workbook_sheet_signatures(excel_file)
+    
+    # Shared parts are only read when they changed; appending strings or styles leaves old cells as they were
+    if previous_shared is not None and previous_shared['parts'] == shared_parts:
+        shared = previous_shared
+        reusable = True
+    else:
+        shared = {'parts': shared_parts, 'values': _shared_values(excel_file, shared_parts)}
+        reusable = previous_shared is not None and all(
+            shared['values'][kind][:len(previous_shared['values'][kind])] == previous_shared['values'][kind]
+            for kind in _SHARED_PARTS
+        )
+    
+    to_read = [name for name, signature in signatures.items()
+               if not reusable or signature is None or name not in previous_sheets
+               or previous_sheets[name]['signature'] != signature]
+    sheets = {}
+    if to_read:
+        workbook = load_workbook(excel_file, read_only=True, data_only=True)
+        try:
+            for sheet_name in to_read:
+                opportunity = _sheet_opportunity(sheet_name, _sheet_rows(workbook[sheet_name]))
+                sheets[sheet_name] = {
+                    'signature': signatures[sheet_name],
+                    'fingerprint': sheet_fingerprint(opportunity),
+                    'opportunity': opportunity
+                }
+        finally:
+            workbook.close()
+    
+    # Keep workbook order; unchanged sheets carry over from the earlier parse
+    sheets = {name: sheets.get(name) or previous_sheets[name] for name in signatures}
+    return {
+        'pipeline_data': pd.DataFrame([sheet['opportunity'] for sheet in sheets.values()]),
+        'sheets': sheets,
+        'shared': shared,
+        'changes': sheet_changes(previous_sheets, sheets, reparsed=len(to_read))
+    }
+
+def sheet_changes(previous_sheets, sheets, reparsed=0):
+    """Differences between two parses of a workbook, by sheet name and fingerprint.
+    
+    Takes the `sheets` dicts of parse_excel_incremental and returns sheet
+    names 'added', 'removed' and 'changed', the number of sheets
+    'reparsed' (as given), the 'sheet_names' of both parses in workbook
+    order and 'previous_positions' (for each opportunity, its row in the
+    earlier parse if unchanged, else -1).
+    """
+    previous_order = {name: position for position, name in enumerate(previous_sheets)}
+    
+    added, changed, previous_positions = [], [], []
+    for name, sheet in sheets.items():
+        previous = previous_sheets.get(name)
+        if previous is None:
+            added.append(name)
+            previous_positions.append(-1)
+        elif previous['fingerprint'] != sheet['fingerprint']:
+            changed.append(name)
+            previous_positions.append(-1)
+        else:
+            previous_positions.append(previous_order[name])
+    
+    return {
+        'added': added,
+        'removed': [name for name in previous_sheets if name not in sheets],
+        'changed': changed,
+        'reparsed': reparsed,
+        'sheet_names': list(sheets),
+        'previous_sheet_names': list(previous_sheets),
+        'previous_positions': np.array(previous_positions, dtype=np.intp)
+    }
+
+def pipeline_format(filename):
+    """Input format of a pipeline file from its extension ('xlsx', 'csv' or 'parquet')"""
+    suffix = Path(str(filename)).suffix.lower().lstrip('.')
+    if suffix not in PIPELINE_FORMATS:
+        raise ValueError(f"Unsupported pipeline file type: {filename}")
+    return suffix
+
+def _clean_text_column(column, strip_apostrophe=False):
+    """Text column cleaned like workbook header cells, with blanks as None.
+    
+    Only the distinct values are cleaned, so a long file costs one pass per
+    opportunity rather than per row.
+    """
+    codes, uniques = pd.factorize(column)
+    cleaned = [_cell_text(value) for value in uniques]
+    if strip_apostrophe:
+        # Remove leading apostrophe if present (Excel text formatting)
+        cleaned = [text.lstrip("'") if text is not None else None for text in cleaned]
+    # Code -1 (missing value) indexes the trailing None
+    return np.array(cleaned + [None], dtype=object)[codes]
+
+def parse_long_pipeline(source, file_format='csv'):
+    """Read a long-format pipeline file (path or binary file) into a DataFrame of LONG_COLUMNS.
+    
+    Each row holds one opportunity's income, staff and expenses for one
+    month. The file is read in one vectorized pass and compile_pipeline
+    turns the result into the same arrays as a parsed workbook. Header names
+    are matched case-insensitively; text cells are cleaned as in workbooks.
+    """
+    if file_format == 'parquet':
+        data = pd.read_parquet(source)
+    elif file_format == 'csv':
+        data = pd.read_csv(source, dtype={'opportunity': object, 'cluster': object, 'month': object})
+    else:
+        raise ValueError(f"Unsupported long-format file type: {file_format}")
+    
+    data.columns = [str(c).strip().lower() for c in data.columns]
+    missing = [c for c in LONG_COLUMNS if c not in data.columns]
+    if missing:
+        raise ValueError(f"Long-format pipeline is missing columns: {', '.join(missing)}")
+    data = data[list(LONG_COLUMNS)].copy()
+    
+    for column in ('opportunity', 'cluster', 'month'):
+        data[column] = _clean_text_column(data[column], strip_apostrophe=column == 'month')
+    return data
+
+def parse_pipeline(source, file_format='xlsx'):
+    """Parse a pipeline workbook or long-format file, by format"""
+    if file_format == 'xlsx':
+        return parse_excel_pipeline(source)
+    return parse_long_pipeline(source, file_format)
+
+def pipeline_months(pipeline_data):
+    """Month labels present in a parsed pipeline (workbook or long format), in calendar order"""
+    if 'month' in pipeline_data.columns:
+        labels = pipeline_data['month'].dropna().unique()
+    else:
+        labels = {column.rsplit('_', 1)[0] for column in pipeline_data.columns
+                  if column.rsplit('_', 1)[-1] in MEASURES}
+    return sorted((label for label in labels if month_ordinal(label) is not None), key=month_ordinal)
@@ -0,0 +1,66 @@
+"""Month labels for the forecast horizon.
+
+Labels like 'May_2026' are converted to integer month ordinals
+(year * 12 + month) so month arithmetic and lookups never scan a list.
+"""
+
+# Available start months for the picker
+_MONTH_NAMES = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+_MONTH_NUMBERS = {name: i for i, name in enumerate(_MONTH_NAMES)}
+
+START_MONTH_OPTIONS = [
+    'Jan_2026', 'Feb_2026', 'Mar_2026', 'Apr_2026', 'May_2026', 'Jun_2026',
+    'Jul_2026', 'Aug_2026', 'Sep_2026', 'Oct_2026', 'Nov_2026', 'Dec_2026',
+    'Jan_2027', 'Feb_2027', 'Mar_2027', 'Apr_2027', 'May_2027', 'Jun_2027',
+    'Jul_2027', 'Aug_2027', 'Sep_2027', 'Oct_2027', 'Nov_2027', 'Dec_2027'
+]
+
+# Forecast horizons in months; 36 and 60 cover multi-year grant planning
+DEFAULT_HORIZON = 18
+HORIZON_OPTIONS = (18, 36, 60)
+
+def month_ordinal(month_label):
+    """Integer ordinal (year * 12 + month) of a label like Jan_2026, or None if it is not a month label"""
+    month_name, _, year = month_label.partition('_')
+    if month_name not in _MONTH_NUMBERS or not year.isdigit():
+        return None
+    return int(year) * 12 + _MONTH_NUMBERS[month_name]
+
+def ordinal_label(ordinal):
+    """Label like Jan_2026 for a month ordinal"""
+    year, month = divmod(ordinal, 12)
+    return f"{_MONTH_NAMES[month]}_{year}"
+
+def generate_month_list(start_month_str, horizon=DEFAULT_HORIZON):
+    """Generate a `horizon`-month list starting from the given month e.g. 'May_2026'"""
+    start = month_ordinal(start_month_str)
+    if start is None:
+        raise ValueError(f"Not a month label: {start_month_str}")
+    return [ordinal_label(start + i) for i in range(horizon)]
+
+def month_index_map(month_list):
+    """Precomputed {label: index (1-based)} for repeated lookups in `month_list`"""
+    return {label: i + 1 for i, label in enumerate(month_list)}
+
+def get_month_label(month_index, month_list):
+    """Convert month index (1-based) to its label in `month_list`"""
+    if 1 <= month_index <= len(month_list):
+        return month_list[month_index - 1]
+    return f"Month_{month_index}"
+
+def get_month_index(month_label, month_list):
+    """Convert month label like Jan_2026 to its index (1-based) in `month_list`, or 0 if absent.
+    
+    Month lists are consecutive, so the index is the ordinal distance from
+    the first month; the label at that position is checked before returning.
+    """
+    if not month_list:
+        return 0
+    ordinal = month_ordinal(month_label)
+    first = month_ordinal(month_list[0])
+    if ordinal is None or first is None:
+        return 0
+    index = ordinal - first + 1
+    if 1 <= index <= len(month_list) and month_list[index - 1] == month_label:
+        return index
+    return 0
@@ -0,0 +1,32 @@
+"""Cluster probability presets."""
+
+# Probability presets (%) per cluster for the Quick Scenarios
+SCENARIO_PRESETS = {
+    'conservative': {
+        'Secured income': 100,
+        'Contracting': 100,
+        'Negotiating': 90,
+        'Proposals out for decision': 45,
+        'High likelihood projects in development': 30,
+        'Medium likelihood projects in development': 15,
+        'Ideas at development stage': 5
+    },
+    'realistic': {
+        'Secured income': 100,
+        'Contracting': 100,
+        'Negotiating': 90,
+        'Proposals out for decision': 65,
+        'High likelihood projects in development': 50,
+        'Medium likelihood projects in development': 30,
+        'Ideas at development stage': 15
+    },
+    'optimistic': {
+        'Secured income': 100,
+        'Contracting': 100,
+        'Negotiating': 90,
+        'Proposals out for decision': 85,
+        'High likelihood projects in development': 70,
+        'Medium likelihood projects in development': 45,
+        'Ideas at development stage': 25
+    }
+}
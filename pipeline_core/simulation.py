@@ -0,0 +1,491 @@
+"""Monte Carlo simulation of unrestricted reserves."""
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from .engine import (
+    DEFAULT_BASE_BACKOFFICE, DEFAULT_BASE_STAFF, build_active_mask, build_cost_schedules, ensure_compiled,
+    forecast_arrays, opportunity_weights, weighted_monthly_totals
+)
+
+# Percentiles reported by the Monte Carlo simulation
+SIMULATION_PERCENTILES = (5, 50, 95)
+
+# Ways of drawing the uniforms behind each opportunity's win/loss (see simulate_reserve_paths)
+SIMULATION_SAMPLING = ('random', 'antithetic', 'latin_hypercube', 'importance')
+
+# Trials drawn per batch
+SIMULATION_BATCH_TRIALS = 2000
+
+# Trials per Latin hypercube design; designs are independent, which gives their standard errors
+SIMULATION_DESIGN_TRIALS = 500
+
+# Share of importance-sampled trials still drawn from the original probabilities,
+# which bounds each trial's likelihood ratio by 1 / share
+SIMULATION_DEFENSIVE_SHARE = 0.2
+
+# Most months whose breaches importance sampling aims at, one tilted proposal each
+SIMULATION_IMPORTANCE_MONTHS = 4
+
+# Normal quantile of the reported confidence intervals (95%)
+SIMULATION_CONFIDENCE_Z = 1.96
+
+def _uniforms(rng, rows, columns, sampling):
+    """Uniform draws (rows, columns) for one batch under a sampling scheme.
+    
+    'antithetic' pairs each row u with 1 - u, so a pair's wins and losses
+    mirror each other. 'latin_hypercube' takes the rows in designs of
+    SIMULATION_DESIGN_TRIALS: each design splits [0, 1) into one stratum per
+    row in every column and puts exactly one draw in each, in random order.
+    """
+    if sampling == 'antithetic':
+        half = rng.random(((rows + 1) // 2, columns))
+        return np.stack((half, 1 - half), axis=1).reshape(-1, columns)[:rows]
+    if sampling == 'latin_hypercube':
+        designs = []
+        for start in range(0, rows, SIMULATION_DESIGN_TRIALS):
+            size = min(SIMULATION_DESIGN_TRIALS, rows - start)
+            strata = rng.permuted(np.broadcast_to(np.arange(size, dtype=float)[:, None], (size, columns)), axis=0)
+            designs.append((strata + rng.random((size, columns))) / size)
+        return np.concatenate(designs)
+    return rng.random((rows, columns))
+
+def simulate_reserve_paths(compiled, win_probabilities, schedules, unrestricted_start, restricted_funds,
+                           trials, rng, batch_size=SIMULATION_BATCH_TRIALS, stop_event=None, sampling='random',
+                           sampling_probabilities=None):
+    """Sample win/loss per opportunity and return simulated unrestricted reserves, shape (trials, months).
+    
+    Each opportunity is won independently with its probability in
+    `win_probabilities` (zero for inactive opportunities); a won opportunity
+    contributes its full income, staff and expenses. `sampling` picks how
+    the uniforms are drawn (see _uniforms).
+    
+    With `sampling_probabilities` (proposals, opportunities), as from
+    importance_probabilities, each trial draws its wins from one proposal
+    picked at random, or from `win_probabilities` for a
+    SIMULATION_DEFENSIVE_SHARE of trials, and carries its likelihood ratio
+    back to `win_probabilities` under that mixture.
+    
+    Returns (paths, likelihood_ratios), the ratios being None without
+    `sampling_probabilities`, or None if `stop_event` is set before all
+    batches are done.
+    """
+    n_opps, n_months, n_measures = compiled['values'].shape
+    flat_values = compiled['values'].reshape(n_opps, n_months * n_measures)
+    paths = np.empty((trials, n_months))
+    
+    likelihood_ratios = None
+    if sampling_probabilities is not None:
+        # log(q/p) for a win and log((1-q)/(1-p)) for a loss per proposal; zero where an outcome cannot happen
+        q = np.atleast_2d(np.asarray(sampling_probabilities, dtype=float))
+        p = np.broadcast_to(np.asarray(win_probabilities, dtype=float), q.shape)
+        win_log = np.log(np.where(q > 0, q, 1.0) / np.where(q > 0, p, 1.0))
+        loss_log = np.log(np.where(q < 1, 1 - q, 1.0) / np.where(q < 1, 1 - p, 1.0))
+        components = np.concatenate((p[:1], q))
+        component_shares = np.append(SIMULATION_DEFENSIVE_SHARE,
+                                     np.full(len(q), (1 - SIMULATION_DEFENSIVE_SHARE) / len(q)))
+        likelihood_ratios = np.empty(trials)
+    
+    for start in range(0, trials, batch_size):
+        if stop_event is not None and stop_event.is_set():
+            return None
+        stop = min(start + batch_size, trials)
+        if likelihood_ratios is None:
+            draw_probabilities = win_probabilities
+        else:
+            draw_probabilities = components[rng.choice(len(components), stop - start, p=component_shares)]
+        wins = (_uniforms(rng, stop - start, n_opps, sampling) < draw_probabilities).astype(float)
+        weighted = (wins @ flat_values).reshape(stop - start, n_months, n_measures)
+        paths[start:stop] = forecast_arrays(
+            weighted, unrestricted_start, restricted_funds, **schedules
+        )['unrestrictedReserves']
+        if likelihood_ratios is not None:
+            # p(wins) over the mixture's chance of them, sum of share * q(wins)
+            with np.errstate(over='ignore'):
+                q_over_p = np.exp(wins @ (win_log - loss_log).T + loss_log.sum(axis=1))
+            likelihood_ratios[start:stop] = 1 / (component_shares[0] + q_over_p @ component_shares[1:])
+    
+    return paths, likelihood_ratios
+
+def _tilt(p, effects, base, threshold, iterations):
+    """Probabilities tilted against `effects` so that base + q @ effects sits at the threshold"""
+    def tilted(t):
+        return p / (p + (1 - p) * np.exp(np.minimum(t * effects, 700)))
+    
+    def expected(t):
+        return base + tilted(t) @ effects
+    
+    # Bracket the tilt by doubling from the scale of the largest effect, then bisect
+    lo, hi = 0.0, 1.0 / np.abs(effects).max()
+    while expected(hi) > threshold:
+        lo, hi = hi, hi * 2
+    for _ in range(iterations):
+        mid = (lo + hi) / 2
+        if expected(mid) > threshold:
+            lo = mid
+        else:
+            hi = mid
+    return tilted(hi)
+
+def importance_probabilities(compiled, win_probabilities, schedules, unrestricted_start, restricted_funds,
+                             threshold, months=SIMULATION_IMPORTANCE_MONTHS, iterations=60):
+    """Win probabilities tilted towards the breach region, for importance sampling.
+    
+    Reserves are approximated as linear in the wins: the reserves with
+    nothing won plus each won opportunity's effect on its own. For each of
+    the `months` months most likely to breach under a normal approximation
+    (among those that can), each probability p is tilted exponentially
+    against the opportunity's effect a on that month:
+    q = p / (p + (1 - p) e^(ta)), so certain and impossible wins stay so.
+    The tilt t >= 0 puts the approximate expected reserves under q at the
+    threshold in that month.
+    
+    Returns an array (proposals, opportunities), with no proposals when a
+    breach is already expected or cannot happen.
+    """
+    p = np.asarray(win_probabilities, dtype=float)
+    values = compiled['values']
+    no_proposals = np.empty((0, len(p)))
+    if unrestricted_start < threshold or len(p) == 0:
+        return no_proposals
+    
+    # Reserves with nothing won, and each opportunity's effect on them when won alone
+    nothing_won = forecast_arrays(np.zeros(values.shape[1:]), unrestricted_start, restricted_funds,
+                                  **schedules)['unrestrictedReserves']
+    effects = forecast_arrays(values, unrestricted_start, restricted_funds,
+                              **schedules)['unrestrictedReserves'] - nothing_won
+    
+    mean = nothing_won + p @ effects
+    if (mean <= threshold).any():
+        return no_proposals
+    std = np.sqrt((p * (1 - p)) @ effects ** 2)
+    
+    # Lowest reserves the approximation allows: every uncertain loss-making win, no uncertain gains
+    uncertain = (p > 0) & (p < 1)
+    lowest = nothing_won + effects[p == 1].sum(axis=0) + np.minimum(effects[uncertain], 0).sum(axis=0)
+    candidates = np.flatnonzero(lowest < threshold)
+    candidates = candidates[np.argsort((mean[candidates] - threshold) / std[candidates])][:months]
+    
+    return np.array([
+        _tilt(p, effects[:, month], nothing_won[month], threshold, iterations) for month in candidates
+    ]).reshape(-1, len(p))
+
+# Trials per independently seeded chunk; fixed so results do not depend on the worker count
+SIMULATION_CHUNK_TRIALS = 5000
+
+# Worker pools run_simulation can spread chunks over
+SIMULATION_BACKENDS = ('threads', 'processes')
+
+# Inputs shared by every chunk in a process-pool worker, set once by _init_simulation_process
+_process_inputs = {}
+
+def _init_simulation_process(values, win_probabilities, schedules, unrestricted_start, restricted_funds,
+                             sampling, sampling_probabilities):
+    """Process-pool initializer: receive the arrays once per worker rather than once per chunk"""
+    _process_inputs.update(
+        compiled={'values': values},
+        win_probabilities=win_probabilities,
+        schedules=schedules,
+        unrestricted_start=unrestricted_start,
+        restricted_funds=restricted_funds,
+        sampling=sampling,
+        sampling_probabilities=sampling_probabilities
+    )
+
+def _simulation_process_chunk(trials, seed):
+    """One chunk of simulate_reserve_paths in a process-pool worker"""
+    inputs = _process_inputs
+    return simulate_reserve_paths(
+        inputs['compiled'], inputs['win_probabilities'], inputs['schedules'], inputs['unrestricted_start'],
+        inputs['restricted_funds'], trials, np.random.default_rng(seed), sampling=inputs['sampling'],
+        sampling_probabilities=inputs['sampling_probabilities']
+    )
+
+def run_simulation(compiled, win_probabilities, schedules, unrestricted_start, restricted_funds,
+                   trials, seed=None, workers=1, time_limit=None, cancel_event=None, sampling='random',
+                   sampling_probabilities=None, backend='threads'):
+    """Run a simulation split into fixed-size chunks across a pool of workers.
+    
+    Chunk i always draws from the i-th child of `SeedSequence(seed)`, so a
+    given seed gives bit-identical paths whatever the worker count or
+    backend. With backend 'threads' the workers share the compiled arrays
+    and only run in parallel while NumPy releases the GIL (the sampling and
+    the matrix product); the per-batch forecast arithmetic on small arrays
+    holds it, so the speedup flattens for short horizons. With 'processes'
+    each worker gets the arrays once, when it starts, and chunks run fully
+    in parallel at the cost of starting the processes, which pays off for
+    large runs. The run stops early when `cancel_event` is set or
+    `time_limit` seconds pass, keeping the completed leading chunks; chunks
+    already running in a process finish in the background and are dropped.
+    `sampling` and `sampling_probabilities` are passed on to
+    simulate_reserve_paths.
+    
+    Returns (paths, likelihood_ratios, status) where the ratios are None
+    unless `sampling_probabilities` is given and status has
+    'requested_trials', 'completed_trials', 'cancelled' and 'timed_out'.
+    """
+    if backend not in SIMULATION_BACKENDS:
+        raise ValueError(f"Unknown simulation backend: {backend}")
+    chunk_sizes = [min(SIMULATION_CHUNK_TRIALS, trials - start)
+                   for start in range(0, trials, SIMULATION_CHUNK_TRIALS)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    stop_event = cancel_event if cancel_event is not None else threading.Event()
+    deadline = time.monotonic() + time_limit if time_limit is not None else None
+    
+    def run_chunk(i):
+        return simulate_reserve_paths(
+            compiled, win_probabilities, schedules, unrestricted_start, restricted_funds,
+            chunk_sizes[i], np.random.default_rng(seeds[i]), stop_event=stop_event, sampling=sampling,
+            sampling_probabilities=sampling_probabilities
+        )
+    
+    if backend == 'processes':
+        executor = ProcessPoolExecutor(
+            max_workers=max(1, min(workers, len(chunk_sizes))),
+            initializer=_init_simulation_process,
+            initargs=(compiled['values'], win_probabilities, schedules, unrestricted_start, restricted_funds,
+                      sampling, sampling_probabilities)
+        )
+        futures = {executor.submit(_simulation_process_chunk, size, chunk_seed): i
+                   for i, (size, chunk_seed) in enumerate(zip(chunk_sizes, seeds))}
+    else:
+        executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        futures = {executor.submit(run_chunk, i): i for i in range(len(chunk_sizes))}
+    
+    results = [None] * len(chunk_sizes)
+    timed_out = False
+    try:
+        pending = set(futures)
+        while pending and not stop_event.is_set():
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if not future.cancelled():
+                    results[futures[future]] = future.result()
+            if pending and deadline is not None and time.monotonic() >= deadline:
+                timed_out = True
+                stop_event.set()
+    finally:
+        # Threads see the stop event and return at once; processes are left to finish their chunk
+        executor.shutdown(wait=backend == 'threads', cancel_futures=True)
+    
+    # Keep only the leading run of completed chunks so partial results stay reproducible
+    completed = []
+    for chunk in results:
+        if chunk is None:
+            break
+        completed.append(chunk)
+    n_months = compiled['values'].shape[1]
+    paths = np.concatenate([chunk[0] for chunk in completed]) if completed else np.empty((0, n_months))
+    likelihood_ratios = None
+    if sampling_probabilities is not None:
+        likelihood_ratios = np.concatenate([chunk[1] for chunk in completed]) if completed else np.empty(0)
+    
+    status = {
+        'requested_trials': trials,
+        'completed_trials': len(paths),
+        'cancelled': stop_event.is_set() and not timed_out and len(paths) < trials,
+        'timed_out': timed_out and len(paths) < trials
+    }
+    return paths, likelihood_ratios, status
+
+def sampling_groups(trials, sampling):
+    """Group ids of independent sets of trials, for standard errors; None when every trial is independent.
+    
+    Antithetic pairs and Latin hypercube designs are correlated inside but
+    independent of each other, so their estimates vary between groups rather
+    than between trials. Follows the chunk and batch layout of run_simulation.
+    """
+    if sampling == 'antithetic':
+        return np.arange(trials) // 2
+    if sampling != 'latin_hypercube':
+        return None
+    sizes = []
+    for chunk in range(0, trials, SIMULATION_CHUNK_TRIALS):
+        chunk_trials = min(SIMULATION_CHUNK_TRIALS, trials - chunk)
+        for batch in range(0, chunk_trials, SIMULATION_BATCH_TRIALS):
+            batch_trials = min(SIMULATION_BATCH_TRIALS, chunk_trials - batch)
+            sizes += [min(SIMULATION_DESIGN_TRIALS, batch_trials - design)
+                      for design in range(0, batch_trials, SIMULATION_DESIGN_TRIALS)]
+    return np.repeat(np.arange(len(sizes)), sizes)
+
+def _standard_error(values, groups=None):
+    """Standard error of the column means of per-trial `values` (trials, columns), from independent groups"""
+    if groups is None:
+        return values.std(axis=0) / np.sqrt(len(values))
+    # Groups are contiguous runs of trials
+    starts = np.flatnonzero(np.diff(groups, prepend=-1))
+    sizes = np.diff(np.append(starts, len(values)))
+    group_means = np.add.reduceat(values, starts, axis=0) / sizes[:, None]
+    if len(starts) < 2:
+        return np.full(values.shape[1:], np.nan)
+    return group_means.std(axis=0, ddof=1) / np.sqrt(len(starts))
+
+def _weighted_percentiles(values, weights, percentiles):
+    """Percentiles of each column of `values` (trials, columns) with per-trial weights"""
+    order = np.argsort(values, axis=0)
+    sorted_values = np.take_along_axis(values, order, axis=0)
+    cumulative = np.cumsum(weights[order], axis=0)
+    cumulative /= cumulative[-1]
+    columns = np.arange(values.shape[1])
+    return np.stack([
+        sorted_values[np.minimum((cumulative < pct / 100).sum(axis=0), len(values) - 1), columns]
+        for pct in percentiles
+    ])
+
+def summarize_reserve_paths(paths, month_labels, unrestricted_start, threshold, expected=None,
+                            likelihood_ratios=None, groups=None):
+    """Percentile bands, breach probabilities and first-breach distribution of simulated reserves.
+    
+    Month 0 (Current) is included so the bands line up with the forecast
+    DataFrame. If the expected-value reserve path (months 1..N) is given it
+    is added alongside the simulated mean and its standard error, as the
+    reference the simulation is checked against. Breach probabilities come
+    with 95% confidence intervals ('...Low' and '...High' columns).
+    
+    Importance-sampled paths are weighted by their `likelihood_ratios`;
+    `groups` (see sampling_groups) marks trials that are only independent
+    as groups, for the standard errors. Returns a dict with 'bands' and
+    'first_breach' DataFrames, 'breach_probability' (estimate, std_error,
+    low and high at the horizon) and 'effective_trials'.
+    """
+    trials = paths.shape[0]
+    full = np.concatenate((np.full((trials, 1), float(unrestricted_start)), paths), axis=1)
+    labels = ['Current'] + list(month_labels)
+    
+    bands = pd.DataFrame({'month': np.arange(len(labels)), 'monthLabel': labels})
+    if trials == 0:
+        for pct in SIMULATION_PERCENTILES:
+            bands[f'p{pct}'] = np.nan
+        bands['mean'] = np.nan
+        bands['meanStdError'] = np.nan
+        for column in ('breachProbability', 'cumulativeBreachProbability'):
+            bands[column] = np.nan
+            bands[f'{column}Low'] = np.nan
+            bands[f'{column}High'] = np.nan
+        if expected is not None:
+            bands['expected'] = np.concatenate(([unrestricted_start], expected))
+        first_breach = pd.DataFrame({
+            'month': np.arange(len(labels) + 1),
+            'monthLabel': labels + ['Never'],
+            'probability': np.nan
+        })
+        breach_probability = {'estimate': np.nan, 'std_error': np.nan, 'low': np.nan, 'high': np.nan}
+        return {'trials': 0, 'effective_trials': 0.0, 'bands': bands, 'first_breach': first_breach,
+                'breach_probability': breach_probability}
+    
+    if likelihood_ratios is None:
+        ratios = np.ones(trials)
+        percentiles = np.percentile(full, SIMULATION_PERCENTILES, axis=0)
+        effective_trials = float(trials)
+    else:
+        ratios = np.asarray(likelihood_ratios, dtype=float)
+        percentiles = _weighted_percentiles(full, ratios, SIMULATION_PERCENTILES)
+        effective_trials = float(ratios.sum() ** 2 / (ratios ** 2).sum())
+    breached = full < threshold
+    
+    for pct, values in zip(SIMULATION_PERCENTILES, percentiles):
+        bands[f'p{pct}'] = values
+    if likelihood_ratios is None:
+        bands['mean'] = full.mean(axis=0)
+        bands['meanStdError'] = _standard_error(full, groups)
+    else:
+        # Self-normalised: far steadier than the plain weighted mean away from the breach region
+        weights = ratios / ratios.sum()
+        bands['mean'] = weights @ full
+        bands['meanStdError'] = np.sqrt(weights ** 2 @ (full - bands['mean'].to_numpy()) ** 2)
+    if expected is not None:
+        bands['expected'] = np.concatenate(([unrestricted_start], expected))
+    
+    for column, events in (('breachProbability', breached),
+                           ('cumulativeBreachProbability', np.logical_or.accumulate(breached, axis=1))):
+        weighted = events * ratios[:, None]
+        estimate = weighted.mean(axis=0)
+        std_error = _standard_error(weighted, groups)
+        margin = SIMULATION_CONFIDENCE_Z * std_error
+        bands[column] = estimate
+        bands[f'{column}Low'] = np.clip(estimate - margin, 0, 1)
+        bands[f'{column}High'] = np.clip(estimate + margin, 0, 1)
+    
+    # First month below threshold per trial; len(labels) marks "never"
+    first = np.where(breached.any(axis=1), breached.argmax(axis=1), len(labels))
+    counts = np.bincount(first, weights=ratios, minlength=len(labels) + 1)
+    first_breach = pd.DataFrame({
+        'month': np.arange(len(labels) + 1),
+        'monthLabel': labels + ['Never'],
+        'probability': counts / trials
+    })
+    
+    # Chance of breaching at any point up to the horizon; the loop ends on the cumulative column
+    horizon = bands.iloc[-1]
+    breach_probability = {
+        'estimate': horizon['cumulativeBreachProbability'],
+        'std_error': std_error[-1],
+        'low': horizon['cumulativeBreachProbabilityLow'],
+        'high': horizon['cumulativeBreachProbabilityHigh']
+    }
+    return {'trials': trials, 'effective_trials': effective_trials, 'bands': bands, 'first_breach': first_breach,
+            'breach_probability': breach_probability}
+
+def simulate_forecast(pipeline_data, probabilities, unrestricted_start, total_funds_start,
+                      reserve_deposits, cost_changes, active_opportunities, special_projects_costs,
+                      threshold, trials=10000, seed=None, workers=1, time_limit=None, cancel_event=None,
+                      month_list=None, schedules=None, sampling='random', backend='threads',
+                      base_staff=DEFAULT_BASE_STAFF, base_backoffice=DEFAULT_BASE_BACKOFFICE):
+    """Monte Carlo counterpart to calculate_forecast for unrestricted reserves.
+    
+    The simulated mean matches the expected-value forecast except where
+    unrecovered staff costs are floored at zero, which makes the forecast
+    slightly optimistic relative to the simulation in those months. Pass
+    `schedules` (see build_cost_schedules) to reuse compiled cost arrays;
+    otherwise they are built from `base_staff` and `base_backoffice`.
+    
+    `sampling` is one of SIMULATION_SAMPLING: plain 'random' draws,
+    'antithetic' pairs, 'latin_hypercube' designs, or 'importance' sampling
+    from probabilities tilted towards breaching the threshold (see
+    importance_probabilities). All give unbiased estimates; the others
+    usually need far fewer trials than 'random' for the same confidence
+    interval, 'importance' above all when a breach is unlikely. `workers`
+    and `backend` ('threads' or 'processes') pick the pool run_simulation
+    spreads the chunks over.
+    """
+    if sampling not in SIMULATION_SAMPLING:
+        raise ValueError(f"Unknown sampling: {sampling}")
+    compiled = ensure_compiled(pipeline_data, month_list)
+    if schedules is None:
+        schedules = build_cost_schedules(compiled['months'], cost_changes, reserve_deposits, special_projects_costs,
+                                         base_staff, base_backoffice)
+    weights = opportunity_weights(compiled, probabilities, build_active_mask(compiled, active_opportunities))
+    restricted_funds = total_funds_start - unrestricted_start
+    
+    sampling_probabilities = None
+    if sampling == 'importance':
+        proposals = importance_probabilities(
+            compiled, weights, schedules, unrestricted_start, restricted_funds, threshold
+        )
+        # Nothing to aim at: plain sampling is already as good
+        if len(proposals):
+            sampling_probabilities = proposals
+    
+    paths, likelihood_ratios, status = run_simulation(
+        compiled, weights, schedules, unrestricted_start, restricted_funds, trials,
+        seed=seed, workers=workers, time_limit=time_limit, cancel_event=cancel_event,
+        sampling='random' if sampling == 'importance' else sampling,
+        sampling_probabilities=sampling_probabilities, backend=backend
+    )
+    
+    expected = forecast_arrays(
+        weighted_monthly_totals(compiled, weights), unrestricted_start, restricted_funds, **schedules
+    )['unrestrictedReserves']
+    
+    summary = summarize_reserve_paths(
+        paths, compiled['months'], unrestricted_start, threshold, expected,
+        likelihood_ratios=likelihood_ratios, groups=sampling_groups(len(paths), sampling)
+    )
+    summary['sampling'] = sampling
+    summary.update(status)
+    return summary
@@ -0,0 +1,263 @@
+"""Local SQLite store of parsed pipelines as versioned snapshots.
+
+Each saved upload becomes a snapshot: its opportunities and their monthly
+income, staff and expenses over every month in the file, in indexed tables.
+A snapshot is never changed after it is written, so loaded snapshots are
+kept compiled in memory per month list and reopening one (for example "the
+pipeline as of last month") needs no parsing at all.
+
+One connection per database file is shared by every session and guarded by
+a lock; the database runs in WAL mode so reads never wait for a save.
+"""
+
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, time, timezone
+
+import numpy as np
+import pandas as pd
+
+from .engine import MEASURES, compile_pipeline, scatter_monthly_values
+from .ingest import pipeline_months
+
+DEFAULT_STORE_PATH = 'pipeline_store.sqlite'
+
+# Loaded snapshots kept in memory per store
+STORE_CACHE_MAX_ENTRIES = 8
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    source TEXT,
+    content_hash TEXT,
+    opportunities INTEGER NOT NULL,
+    first_month TEXT,
+    last_month TEXT
+);
+CREATE INDEX IF NOT EXISTS snapshots_created_at ON snapshots (created_at);
+
+CREATE TABLE IF NOT EXISTS opportunities (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT,
+    cluster TEXT,
+    PRIMARY KEY (snapshot_id, position)
+);
+CREATE INDEX IF NOT EXISTS opportunities_name ON opportunities (name);
+CREATE INDEX IF NOT EXISTS opportunities_cluster ON opportunities (cluster);
+
+CREATE TABLE IF NOT EXISTS pipeline_values (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    income REAL NOT NULL,
+    staff REAL NOT NULL,
+    expenses REAL NOT NULL,
+    PRIMARY KEY (snapshot_id, position, month)
+);
+CREATE INDEX IF NOT EXISTS pipeline_values_month ON pipeline_values (snapshot_id, month);
+"""
+
+# Schema changes after the first release, applied in order once per database (tracked in PRAGMA user_version)
+_MIGRATIONS = (
+    # 1: unique content hashes. Older stores may hold duplicates, so only the newest keeps its hash
+    (
+        "DROP INDEX IF EXISTS snapshots_content_hash",
+        "UPDATE snapshots SET content_hash = NULL WHERE content_hash IS NOT NULL AND id NOT IN "
+        "(SELECT MAX(id) FROM snapshots WHERE content_hash IS NOT NULL GROUP BY content_hash)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS snapshots_unique_content_hash ON snapshots (content_hash)",
+    ),
+)
+
+def _migrate(connection):
+    """Apply the migrations a database has not had yet, in one write transaction"""
+    if connection.execute("PRAGMA user_version").fetchone()[0] >= len(_MIGRATIONS):
+        return
+    with connection:
+        # Check again under the write lock, in case another process migrated in between
+        connection.execute("BEGIN IMMEDIATE")
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        for number, statements in enumerate(_MIGRATIONS[version:], start=version + 1):
+            for statement in statements:
+                connection.execute(statement)
+            connection.execute(f"PRAGMA user_version = {number}")
+
+def open_pipeline_store(path=DEFAULT_STORE_PATH, max_entries=STORE_CACHE_MAX_ENTRIES):
+    """Open (creating if needed) a pipeline store; the returned store may be shared across threads"""
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA foreign_keys=ON")
+    connection.executescript(_SCHEMA)
+    _migrate(connection)
+    return {
+        'path': str(path),
+        'connection': connection,
+        'lock': threading.Lock(),
+        'loaded': OrderedDict(),
+        'max_entries': max_entries
+    }
+
+def close_pipeline_store(store):
+    """Close the store's connection and drop its loaded snapshots"""
+    with store['lock']:
+        store['connection'].close()
+        store['loaded'].clear()
+
+def _timestamp(moment):
+    """UTC ISO timestamp of a datetime, a date (its end) or an ISO string; naive times count as UTC"""
+    if isinstance(moment, str):
+        moment = datetime.fromisoformat(moment)
+    if not isinstance(moment, datetime):
+        moment = datetime.combine(moment, time.max)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).isoformat(timespec='seconds')
+
+def save_snapshot(store, pipeline_data, source=None, content_hash=None, created_at=None):
+    """Save a parsed pipeline (as from parse_excel_pipeline or parse_long_pipeline) as a new snapshot.
+    
+    Returns the snapshot id. Saving content whose hash is already stored
+    returns the existing snapshot instead of writing a duplicate, also when
+    several sessions or processes save the same content at once.
+    """
+    existing_sql = "SELECT id FROM snapshots WHERE content_hash = ?"
+    if content_hash is not None:
+        with store['lock']:
+            existing = store['connection'].execute(existing_sql, (content_hash,)).fetchone()
+        if existing is not None:
+            return existing[0]
+    
+    # Compile over the file's own months; the snapshot keeps every cell, zeros included
+    months = pipeline_months(pipeline_data)
+    compiled = compile_pipeline(pipeline_data, months)
+    opportunities = len(compiled['names'])
+    clusters = np.array(list(compiled['clusters']) + [None], dtype=object)
+    
+    opportunity_rows = zip(
+        range(opportunities),
+        (str(name) for name in compiled['names']),
+        clusters[compiled['cluster_codes']]
+    )
+    values = compiled['values'].reshape(-1, len(MEASURES))
+    value_rows = zip(
+        np.repeat(np.arange(opportunities), len(months)).tolist(),
+        np.tile(np.asarray(months, dtype=object), opportunities),
+        *(values[:, i].tolist() for i in range(len(MEASURES)))
+    )
+    
+    # One write transaction: the unique hash index decides between racing saves of the same content
+    with store['lock'], store['connection'] as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        cursor = connection.execute(
+            "INSERT INTO snapshots (created_at, source, content_hash, opportunities, first_month, last_month) "
+            "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (content_hash) DO NOTHING",
+            (_timestamp(created_at or datetime.now(timezone.utc)), source, content_hash, opportunities,
+             months[0] if months else None, months[-1] if months else None)
+        )
+        if cursor.rowcount == 0:
+            return connection.execute(existing_sql, (content_hash,)).fetchone()[0]
+        snapshot_id = cursor.lastrowid
+        connection.executemany(
+            "INSERT INTO opportunities (snapshot_id, position, name, cluster) VALUES (?, ?, ?, ?)",
+            ((snapshot_id, *row) for row in opportunity_rows)
+        )
+        connection.executemany(
+            "INSERT INTO pipeline_values (snapshot_id, position, month, income, staff, expenses) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            ((snapshot_id, *row) for row in value_rows)
+        )
+    return snapshot_id
+
+def list_snapshots(store):
+    """All snapshots, newest first"""
+    with store['lock']:
+        return pd.read_sql_query(
+            "SELECT id, created_at, source, content_hash, opportunities, first_month, last_month "
+            "FROM snapshots ORDER BY created_at DESC, id DESC",
+            store['connection']
+        )
+
+def snapshot_as_of(store, moment):
+    """Id of the latest snapshot saved at or before `moment` (datetime, date or ISO string), or None"""
+    with store['lock']:
+        row = store['connection'].execute(
+            "SELECT id FROM snapshots WHERE created_at <= ? ORDER BY created_at DESC, id DESC LIMIT 1",
+            (_timestamp(moment),)
+        ).fetchone()
+    return row[0] if row is not None else None
+
+def delete_snapshot(store, snapshot_id):
+    """Remove a snapshot and its rows"""
+    with store['lock'], store['connection'] as connection:
+        connection.execute("DELETE FROM snapshots WHERE id = ?", (snapshot_id,))
+        store['loaded'].pop(snapshot_id, None)
+
+def _read_snapshot(store, snapshot_id):
+    """Snapshot header, opportunities (in position order) and values from the database"""
+    with store['lock']:
+        header = store['connection'].execute(
+            "SELECT content_hash FROM snapshots WHERE id = ?", (snapshot_id,)
+        ).fetchone()
+        if header is None:
+            raise ValueError(f"No pipeline snapshot {snapshot_id}")
+        opportunities = pd.read_sql_query(
+            "SELECT name, cluster FROM opportunities WHERE snapshot_id = ? ORDER BY position",
+            store['connection'], params=(snapshot_id,)
+        )
+        values = pd.read_sql_query(
+            "SELECT position, month, income, staff, expenses FROM pipeline_values WHERE snapshot_id = ?",
+            store['connection'], params=(snapshot_id,)
+        )
+    return header[0], opportunities, values
+
+def load_snapshot(store, snapshot_id, month_list):
+    """Compiled pipeline of a snapshot over `month_list`.
+    
+    Returns (content key, snapshot values, compiled pipeline) like
+    cached_parse_pipeline. The content key is the upload's hash when it was
+    saved with one. Loaded snapshots are kept in memory (least recently used
+    dropped first) and must not be mutated.
+    """
+    with store['lock']:
+        entry = store['loaded'].get(snapshot_id)
+        if entry is not None:
+            store['loaded'].move_to_end(snapshot_id)
+    
+    if entry is None:
+        content_hash, opportunities, values = _read_snapshot(store, snapshot_id)
+        cluster_codes, clusters = pd.factorize(opportunities['cluster'])
+        entry = {
+            'key': content_hash or f"snapshot-{snapshot_id}",
+            'names': opportunities['name'].to_numpy(dtype=object),
+            'clusters': list(clusters),
+            'cluster_codes': cluster_codes.astype(np.intp),
+            'values': values,
+            'compiled': {}
+        }
+        with store['lock']:
+            store['loaded'][snapshot_id] = entry
+            while len(store['loaded']) > store['max_entries']:
+                store['loaded'].popitem(last=False)
+    
+    months = tuple(month_list)
+    compiled = entry['compiled'].get(months)
+    if compiled is None:
+        values = entry['values']
+        compiled = {
+            'names': entry['names'],
+            'clusters': entry['clusters'],
+            'cluster_codes': entry['cluster_codes'],
+            'months': list(months),
+            'values': scatter_monthly_values(
+                values['position'].to_numpy(dtype=np.intp),
+                pd.Categorical(values['month'], categories=months).codes,
+                values[list(MEASURES)].to_numpy(dtype=float),
+                len(entry['names']),
+                len(months)
+            )
+        }
+        entry['compiled'][months] = compiled
+    
+    return entry['key'], entry['values'], compiled
@@ -0,0 +1,98 @@
+"""Display formatting of forecast and funnel tables, and the editable opportunity and schedule grids."""
+
+import numpy as np
+import pandas as pd
+
+# Monthly breakdown columns and their display names, in table order
+BREAKDOWN_COLUMNS = {
+    'monthLabel': 'Month',
+    'totalIncome': 'Income',
+    'projectStaffCosts': 'Project Staff',
+    'projectExpenses': 'Project Expenses',
+    'projectContribution': 'Contribution',
+    'staffRecovery': 'Staff Recovery',
+    'unrecoveredStaffCosts': 'Unrecovered Staff',
+    'fixedBackOfficeCosts': 'Back Office',
+    'costsFromContribution': 'Costs from Contrib.',
+    'netPosition': 'Net Position',
+    'reserveDeposit': 'Deposits',
+    'unrestrictedReserves': 'Unrestricted',
+    'specialProjectsCost': 'Special Projects',
+    'unrestrictedAfterSpecial': 'Unres. After Special',
+    'restrictedFunds': 'Restricted Funds',
+    'totalFunds': 'Total Funds'
+}
+
+# Columns only shown when special projects are enabled
+SPECIAL_PROJECT_COLUMNS = ('specialProjectsCost', 'unrestrictedAfterSpecial')
+
+# Columns of the editable cost change grid and the month/amount grids (deposits, special projects)
+COST_CHANGE_COLUMNS = ('month', 'staff', 'backoffice')
+AMOUNT_COLUMNS = ('month', 'amount')
+
+def format_currency(values):
+    """Format a numeric Series as whole pounds, e.g. £12,345"""
+    return values.map(lambda x: f"£{x:,.0f}")
+
+def format_monthly_breakdown(forecast_df, include_special_projects):
+    """Detailed monthly breakdown table (months 1..N) with currency-formatted columns"""
+    columns = [c for c in BREAKDOWN_COLUMNS
+               if include_special_projects or c not in SPECIAL_PROJECT_COLUMNS]
+    display_df = forecast_df.loc[forecast_df['month'] > 0, columns].copy()
+    
+    for col in columns[1:]:
+        display_df[col] = format_currency(display_df[col])
+    
+    display_df.columns = [BREAKDOWN_COLUMNS[c] for c in columns]
+    return display_df
+
+def format_funnel_summary(funnel_df):
+    """Pipeline funnel summary table with formatted values and conversion rate"""
+    funnel_display = funnel_df.copy()
+    funnel_display['Conversion Rate'] = (funnel_display['weighted_value'] / funnel_display['total_value'] * 100).map(lambda x: f"{x:.1f}%")
+    funnel_display['Total Value'] = format_currency(funnel_display['total_value'])
+    funnel_display['Weighted Value'] = format_currency(funnel_display['weighted_value'])
+    funnel_display = funnel_display[['stage', 'Total Value', 'Weighted Value', 'Conversion Rate']]
+    funnel_display.columns = ['Stage', 'Total Value', 'Weighted Value', 'Conversion Rate']
+    return funnel_display
+
+def cost_changes_from_table(table, month_list, base_staff, base_backoffice):
+    """Cost change entries from an edited grid, in row order.
+    
+    Rows whose month is blank or outside `month_list` are skipped, and blank
+    staff or back office cells keep the base cost.
+    """
+    rows = table[table['month'].isin(month_list)]
+    staff = pd.to_numeric(rows['staff'], errors='coerce').fillna(base_staff)
+    backoffice = pd.to_numeric(rows['backoffice'], errors='coerce').fillna(base_backoffice)
+    return [{'month': month, 'staff': float(s), 'backoffice': float(b)}
+            for month, s, b in zip(rows['month'], staff, backoffice)]
+
+def amounts_from_table(table, month_list):
+    """Month/amount entries (deposits, special projects) from an edited grid, keeping positive amounts only"""
+    rows = table[table['month'].isin(month_list)]
+    amounts = pd.to_numeric(rows['amount'], errors='coerce').fillna(0)
+    return [{'month': month, 'amount': float(amount)}
+            for month, amount in zip(rows['month'], amounts) if amount > 0]
+
+def opportunity_table(compiled, active_mask):
+    """One row per compiled opportunity (index = position in the compiled arrays) with its include flag and totals"""
+    clusters = np.array(list(compiled['clusters']) + [None], dtype=object)
+    totals = compiled['values'].sum(axis=1)
+    return pd.DataFrame({
+        'active': active_mask,
+        'opportunity': compiled['names'],
+        'cluster': clusters[compiled['cluster_codes']],
+        'income': totals[:, 0],
+        'staff': totals[:, 1],
+        'expenses': totals[:, 2]
+    })
+
+def filter_opportunity_table(table, search='', clusters=None):
+    """Rows whose name contains `search` (case-insensitive) and whose cluster is in `clusters` (all if empty)"""
+    keep = np.ones(len(table), dtype=bool)
+    if search:
+        keep &= table['opportunity'].str.contains(search, case=False, regex=False).to_numpy()
+    if clusters:
+        keep &= table['cluster'].isin(clusters).to_numpy()
+    return table[keep]
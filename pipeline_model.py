@@ -1,7 +1,62 @@
+import functools
+import os
+from collections import deque
+
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
-from datetime import datetime, timedelta
+
+from pipeline_core import (
+    DEFAULT_HORIZON,
+    DEFAULT_STORE_PATH,
+    EXPORT_FORMATS,
+    HORIZON_OPTIONS,
+    PIPELINE_FORMATS,
+    AMOUNT_COLUMNS,
+    COST_CHANGE_COLUMNS,
+    SCENARIO_PRESETS,
+    START_MONTH_OPTIONS,
+    amounts_from_table,
+    build_active_mask,
+    build_cluster_aggregates,
+    build_cost_schedules,
+    cached_parse_pipeline,
+    cached_pipeline_changes,
+    calculate_forecast,
+    calculate_pipeline_funnel,
+    calculate_reserve_distribution,
+    calculate_risk_metrics,
+    calculate_scenarios,
+    calculate_sensitivity,
+    calculate_slippage,
+    cost_changes_from_table,
+    cost_schedule_key,
+    export_bytes,
+    export_filename,
+    filter_opportunity_table,
+    finish_stopwatch,
+    format_funnel_summary,
+    format_monthly_breakdown,
+    generate_month_list,
+    goal_seek,
+    list_snapshots,
+    load_snapshot,
+    lap,
+    new_parse_cache,
+    new_stopwatch,
+    opportunity_contributions,
+    open_pipeline_store,
+    opportunity_table,
+    parse_cache_stats,
+    pipeline_change_effects,
+    pipeline_format,
+    pipeline_memory_bytes,
+    save_snapshot,
+    simulate_forecast,
+    snapshot_as_of,
+    stopwatch_summary,
+    update_cluster_aggregates,
+)
 
 # Password protection
 def check_password():
@@ -36,377 +91,960 @@ def check_password():
 if not check_password():
     st.stop()
 
+# Reruns kept for the diagnostics history chart
+DIAGNOSTICS_HISTORY = 50
+
 # Page configuration
 st.set_page_config(page_title="Financial Pipeline Modelling Tool", layout="wide")
 
+# Phase timings for this rerun; laps are no-ops unless diagnostics are switched on
+show_diagnostics = st.sidebar.checkbox("Performance diagnostics", value=False, help="Time each phase of the app and show the results in the sidebar")
+stopwatch = new_stopwatch(show_diagnostics)
+
+# Optional local store of uploads as versioned snapshots (path from PIPELINE_STORE_PATH)
+use_pipeline_store = st.sidebar.checkbox(
+    "Save pipelines locally",
+    value=False,
+    help="Keep every upload as a snapshot in a local SQLite database so earlier pipelines can be reopened without re-uploading"
+)
+
 # Initialize session state
 if 'probabilities' not in st.session_state:
-    st.session_state.probabilities = {
-        'Secured income': 100,
-        'Contracting': 100,
-        'Negotiating': 90,
-        'Proposals out for decision': 65,
-        'High likelihood projects in development': 50,
-        'Medium likelihood projects in development': 30,
-        'Ideas at development stage': 15
-    }
+    st.session_state.probabilities = dict(SCENARIO_PRESETS['realistic'])
 
 if 'scenario' not in st.session_state:
     st.session_state.scenario = 'realistic'
 
-if 'opportunity_toggles' not in st.session_state:
-    st.session_state.opportunity_toggles = {}
+if 'custom_scenarios' not in st.session_state:
+    st.session_state.custom_scenarios = {}
+
+# Rows of the cost change and deposit grids, and special project costs by month label
+if 'cost_change_rows' not in st.session_state:
+    st.session_state.cost_change_rows = pd.DataFrame({'month': pd.Series(dtype=object), 'staff': pd.Series(dtype=float),
+                                                      'backoffice': pd.Series(dtype=float)})
+
+if 'deposit_rows' not in st.session_state:
+    st.session_state.deposit_rows = pd.DataFrame({'month': pd.Series(dtype=object), 'amount': pd.Series(dtype=float)})
+
+if 'special_project_amounts' not in st.session_state:
+    st.session_state.special_project_amounts = {}
+
+if 'diagnostics_history' not in st.session_state:
+    st.session_state.diagnostics_history = deque(maxlen=DIAGNOSTICS_HISTORY)
+
+st.session_state.rerun_count = st.session_state.get('rerun_count', 0) + 1
 
 # Header
 st.title("Financial Pipeline Modelling Tool")
-st.markdown("*18-month scenario planning with staff cost recovery and reserve management*")
-
-# Scenario presets
-scenario_presets = {
-    'conservative': {
-        'Secured income': 100,
-        'Contracting': 100,
-        'Negotiating': 90,
-        'Proposals out for decision': 45,
-        'High likelihood projects in development': 30,
-        'Medium likelihood projects in development': 15,
-        'Ideas at development stage': 5
-    },
-    'realistic': {
-        'Secured income': 100,
-        'Contracting': 100,
-        'Negotiating': 90,
-        'Proposals out for decision': 65,
-        'High likelihood projects in development': 50,
-        'Medium likelihood projects in development': 30,
-        'Ideas at development stage': 15
-    },
-    'optimistic': {
-        'Secured income': 100,
-        'Contracting': 100,
-        'Negotiating': 90,
-        'Proposals out for decision': 85,
-        'High likelihood projects in development': 70,
-        'Medium likelihood projects in development': 45,
-        'Ideas at development stage': 25
-    }
+st.markdown(f"*Scenario planning over {HORIZON_OPTIONS[0]} to {HORIZON_OPTIONS[-1]} months with staff cost recovery and reserve management*")
+
+# Scenario presets (copied so slider edits never touch the shared defaults)
+scenario_presets = {name: dict(probs) for name, probs in SCENARIO_PRESETS.items()}
+
+# Worker threads and wall-clock cap (seconds) for simulations run from the app
+SIMULATION_WORKERS = min(4, os.cpu_count() or 1)
+SIMULATION_TIME_LIMIT = 10.0
+
+# Display names of the simulation sampling schemes
+SAMPLING_LABELS = {
+    'random': "Plain random",
+    'antithetic': "Antithetic pairs",
+    'latin_hypercube': "Latin hypercube",
+    'importance': "Importance (breach-focused)"
 }
 
-# Available start months for the picker
-_MONTH_NAMES = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-
-START_MONTH_OPTIONS = [
-    'Jan_2026', 'Feb_2026', 'Mar_2026', 'Apr_2026', 'May_2026', 'Jun_2026',
-    'Jul_2026', 'Aug_2026', 'Sep_2026', 'Oct_2026', 'Nov_2026', 'Dec_2026',
-    'Jan_2027', 'Feb_2027', 'Mar_2027', 'Apr_2027', 'May_2027', 'Jun_2027',
-    'Jul_2027', 'Aug_2027', 'Sep_2027', 'Oct_2027', 'Nov_2027', 'Dec_2027'
-]
-
-def generate_month_list(start_month_str):
-    """Generate 18-month list starting from the given month e.g. 'May_2026'"""
-    month_name, year = start_month_str.split('_')
-    year = int(year)
-    start_idx = _MONTH_NAMES.index(month_name)
-    months = []
-    for i in range(18):
-        m = (start_idx + i) % 12
-        y = year + (start_idx + i) // 12
-        months.append(f"{_MONTH_NAMES[m]}_{y}")
-    return months
-
-# Default month list — overridden by user selection at runtime
-MONTH_LIST = generate_month_list('Jan_2026')
-
-def parse_excel_pipeline(excel_file):
-    """Parse multi-sheet Excel file with opportunities"""
-    all_opportunities = []
-    
-    # Read all sheets
-    xl_file = pd.ExcelFile(excel_file)
-    
-    for sheet_name in xl_file.sheet_names:
-        # Read the sheet without any date parsing
-        df = pd.read_excel(excel_file, sheet_name=sheet_name, header=None, dtype=str)
-        
-        # Extract opportunity name (A1) and cluster (A2)
-        opportunity_name = df.iloc[0, 0] if len(df) > 0 else f"Opportunity_{sheet_name}"
-        cluster = df.iloc[1, 0] if len(df) > 1 else "Unknown"
+@st.cache_resource
+def get_parse_cache():
+    """Parse cache shared across reruns and sessions"""
+    return new_parse_cache()
+
+@st.cache_resource
+def get_pipeline_store(path):
+    """Pipeline store (one pooled connection) shared across reruns and sessions"""
+    return open_pipeline_store(path)
+
+# Figures are rebuilt only when the data they plot changes. cache_resource hands back the
+# cached figure itself: unpickling a Plotly figure (as cache_data would) costs more than
+# building it, and st.plotly_chart only reads the figure.
+FIGURE_CACHE_ENTRIES = 64
+
+@st.cache_resource(max_entries=FIGURE_CACHE_ENTRIES, show_spinner=False)
+def funnel_figure(funnel_df):
+    """Overlaid total and weighted value bars per funnel stage"""
+    fig_funnel = go.Figure()
+    
+    # Add bars for total value
+    fig_funnel.add_trace(go.Bar(
+        y=funnel_df['stage'],
+        x=funnel_df['total_value'],
+        name='Total Value',
+        orientation='h',
+        marker=dict(color='#93c5fd'),
+        text=funnel_df['total_value'].apply(lambda x: f'£{x:,.0f}'),
+        textposition='inside',
+        textfont=dict(size=12)
+    ))
+    
+    # Add bars for weighted value
+    fig_funnel.add_trace(go.Bar(
+        y=funnel_df['stage'],
+        x=funnel_df['weighted_value'],
+        name='Probability-Weighted Value',
+        orientation='h',
+        marker=dict(color='#2563eb'),
+        text=funnel_df['weighted_value'].apply(lambda x: f'£{x:,.0f}'),
+        textposition='inside',
+        textfont=dict(size=12, color='white')
+    ))
+    
+    fig_funnel.update_layout(
+        barmode='overlay',
+        height=350,
+        xaxis_title="Value (£)",
+        yaxis_title="Pipeline Stage",
+        xaxis=dict(tickformat='£,.0f'),
+        yaxis=dict(autorange='reversed'),  # Top to bottom
+        showlegend=True,
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        )
+    )
+    return fig_funnel
+
+@st.cache_resource(max_entries=FIGURE_CACHE_ENTRIES, show_spinner=False)
+def reserve_figure(forecast_df, threshold, show_special_projects):
+    """Unrestricted reserves and total funds over the forecast against the threshold"""
+    fig = go.Figure()
+    
+    # Add unrestricted reserves line
+    fig.add_trace(go.Scatter(
+        x=forecast_df['monthLabel'],
+        y=forecast_df['unrestrictedReserves'],
+        mode='lines+markers',
+        name='Unrestricted Reserves',
+        line=dict(color='#2563eb', width=3),
+        marker=dict(size=6)
+    ))
+    
+    # Add unrestricted after special projects line if enabled
+    if show_special_projects:
+        fig.add_trace(go.Scatter(
+            x=forecast_df['monthLabel'],
+            y=forecast_df['unrestrictedAfterSpecial'],
+            mode='lines+markers',
+            name='Unrestricted After Special Projects',
+            line=dict(color='#f59e0b', width=2, dash='dot'),
+            marker=dict(size=4)
+        ))
+    
+    # Add total funds line
+    fig.add_trace(go.Scatter(
+        x=forecast_df['monthLabel'],
+        y=forecast_df['totalFunds'],
+        mode='lines+markers',
+        name='Total Funds',
+        line=dict(color='#10b981', width=2, dash='dash'),
+        marker=dict(size=4)
+    ))
+    
+    # Add threshold line
+    fig.add_hline(
+        y=threshold,
+        line_dash="dash",
+        line_color="red",
+        annotation_text="Critical Threshold",
+        annotation_position="right"
+    )
+    
+    fig.update_layout(
+        height=400,
+        xaxis_title="Month",
+        yaxis_title="Amount (£)",
+        hovermode='x unified',
+        yaxis=dict(tickformat='£,.0f')
+    )
+    return fig
+
+@st.cache_resource(max_entries=FIGURE_CACHE_ENTRIES, show_spinner=False)
+def fan_figure(bands, threshold):
+    """Fan chart of simulated or analytic unrestricted reserves (P5-P95 band and median)"""
+    fig_fan = go.Figure()
+    fig_fan.add_trace(go.Scatter(
+        x=bands['monthLabel'],
+        y=bands['p95'],
+        mode='lines',
+        name='P95',
+        line=dict(color='#93c5fd', width=1)
+    ))
+    fig_fan.add_trace(go.Scatter(
+        x=bands['monthLabel'],
+        y=bands['p5'],
+        mode='lines',
+        name='P5',
+        fill='tonexty',
+        fillcolor='rgba(37, 99, 235, 0.2)',
+        line=dict(color='#93c5fd', width=1)
+    ))
+    fig_fan.add_trace(go.Scatter(
+        x=bands['monthLabel'],
+        y=bands['p50'],
+        mode='lines+markers',
+        name='P50',
+        line=dict(color='#2563eb', width=3),
+        marker=dict(size=6)
+    ))
+    fig_fan.add_hline(
+        y=threshold,
+        line_dash="dash",
+        line_color="red",
+        annotation_text="Critical Threshold",
+        annotation_position="right"
+    )
+    fig_fan.update_layout(
+        height=400,
+        xaxis_title="Month",
+        yaxis_title="Unrestricted Reserves (£)",
+        hovermode='x unified',
+        yaxis=dict(tickformat='£,.0f')
+    )
+    return fig_fan
+
+@st.cache_resource(max_entries=FIGURE_CACHE_ENTRIES, show_spinner=False)
+def breach_figure(bands):
+    """Per-month and, for simulated bands, cumulative probability of reserves below the threshold"""
+    fig_breach = go.Figure()
+    fig_breach.add_trace(go.Bar(
+        x=bands['monthLabel'],
+        y=bands['breachProbability'],
+        name='Below threshold in month',
+        marker_color='#f59e0b'
+    ))
+    # Analytic bands have no path-wise cumulative probability
+    if 'cumulativeBreachProbability' in bands:
+        fig_breach.add_trace(go.Scatter(
+            x=bands['monthLabel'],
+            y=bands['cumulativeBreachProbability'],
+            mode='lines+markers',
+            name='Breached by month',
+            line=dict(color='#ef4444', width=2),
+            # 95% confidence interval of the simulated estimate
+            error_y=dict(
+                type='data',
+                symmetric=False,
+                array=bands['cumulativeBreachProbabilityHigh'] - bands['cumulativeBreachProbability'],
+                arrayminus=bands['cumulativeBreachProbability'] - bands['cumulativeBreachProbabilityLow'],
+                thickness=1
+            )
+        ))
+    fig_breach.update_layout(
+        height=300,
+        xaxis_title="Month",
+        yaxis_title="Probability",
+        hovermode='x unified',
+        yaxis=dict(tickformat='.0%', range=[0, 1])
+    )
+    return fig_breach
+
+@st.cache_resource(max_entries=FIGURE_CACHE_ENTRIES, show_spinner=False)
+def scenario_figure(comparison_reserves, threshold):
+    """Unrestricted reserves per compared scenario (one column each after month/monthLabel)"""
+    fig_scenarios = go.Figure()
+    for name in comparison_reserves.columns[2:]:
+        fig_scenarios.add_trace(go.Scatter(
+            x=comparison_reserves['monthLabel'],
+            y=comparison_reserves[name],
+            mode='lines+markers',
+            name=name,
+            line=dict(width=3 if name == 'Current settings' else 2),
+            marker=dict(size=4)
+        ))
+    fig_scenarios.add_hline(
+        y=threshold,
+        line_dash="dash",
+        line_color="red",
+        annotation_text="Critical Threshold",
+        annotation_position="right"
+    )
+    fig_scenarios.update_layout(
+        height=400,
+        xaxis_title="Month",
+        yaxis_title="Unrestricted Reserves (£)",
+        hovermode='x unified',
+        yaxis=dict(tickformat='£,.0f')
+    )
+    return fig_scenarios
+
+@st.cache_resource(max_entries=FIGURE_CACHE_ENTRIES, show_spinner=False)
+def tornado_figures(sensitivity_df, base_min, base_below):
+    """Tornado charts of the change in min. unrestricted and in months below threshold"""
+    fig_tornado_min = go.Figure()
+    fig_tornado_min.add_trace(go.Bar(
+        y=sensitivity_df['parameter'],
+        x=sensitivity_df['min_unrestricted_low'] - base_min,
+        name='Decrease',
+        orientation='h',
+        marker_color='#ef4444',
+        customdata=sensitivity_df['low_change'],
+        hovertemplate='%{y} (%{customdata}): £%{x:,.0f}<extra></extra>'
+    ))
+    fig_tornado_min.add_trace(go.Bar(
+        y=sensitivity_df['parameter'],
+        x=sensitivity_df['min_unrestricted_high'] - base_min,
+        name='Increase',
+        orientation='h',
+        marker_color='#10b981',
+        customdata=sensitivity_df['high_change'],
+        hovertemplate='%{y} (%{customdata}): £%{x:,.0f}<extra></extra>'
+    ))
+    fig_tornado_min.update_layout(
+        barmode='overlay',
+        height=400,
+        title=f"Impact on Min. Unrestricted (base £{base_min:,.0f})",
+        xaxis_title="Change (£)",
+        xaxis=dict(tickformat='£,.0f'),
+        yaxis=dict(autorange='reversed'),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    
+    fig_tornado_below = go.Figure()
+    fig_tornado_below.add_trace(go.Bar(
+        y=sensitivity_df['parameter'],
+        x=sensitivity_df['months_below_low'] - base_below,
+        name='Decrease',
+        orientation='h',
+        marker_color='#ef4444',
+        customdata=sensitivity_df['low_change'],
+        hovertemplate='%{y} (%{customdata}): %{x:+d} months<extra></extra>'
+    ))
+    fig_tornado_below.add_trace(go.Bar(
+        y=sensitivity_df['parameter'],
+        x=sensitivity_df['months_below_high'] - base_below,
+        name='Increase',
+        orientation='h',
+        marker_color='#10b981',
+        customdata=sensitivity_df['high_change'],
+        hovertemplate='%{y} (%{customdata}): %{x:+d} months<extra></extra>'
+    ))
+    fig_tornado_below.update_layout(
+        barmode='overlay',
+        height=400,
+        title=f"Impact on Months Below Threshold (base {base_below})",
+        xaxis_title="Change (months)",
+        yaxis=dict(autorange='reversed', showticklabels=False),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return fig_tornado_min, fig_tornado_below
+
+@st.cache_resource(max_entries=FIGURE_CACHE_ENTRIES, show_spinner=False)
+def slippage_figure(slippage_df, delayed_clusters):
+    """Heatmap of the share of delay patterns breaching the threshold, per cluster and delay"""
+    delays = list(range(int(slippage_df[delayed_clusters].to_numpy().max()) + 1))
+    breach_share = [
+        [slippage_df.loc[slippage_df[cluster] == delay, 'breaches'].mean() * 100 for delay in delays]
+        for cluster in delayed_clusters
+    ]
+    fig_slippage = go.Figure(go.Heatmap(
+        z=breach_share,
+        x=[f"{delay} mo" for delay in delays],
+        y=delayed_clusters,
+        colorscale='Reds',
+        zmin=0,
+        zmax=100,
+        colorbar=dict(title="% breaching"),
+        hovertemplate="%{y}<br>Delayed %{x}: %{z:.0f}% of patterns breach<extra></extra>"
+    ))
+    fig_slippage.update_layout(
+        height=max(250, 60 * len(delayed_clusters) + 100),
+        xaxis_title="Delay",
+        yaxis=dict(autorange='reversed')
+    )
+    return fig_slippage
+
+@st.cache_resource(max_entries=FIGURE_CACHE_ENTRIES, show_spinner=False)
+def recovery_figure(forecast_df):
+    """Recovered and unrecovered staff costs per month, annotated where fixed staff costs change"""
+    fig2 = go.Figure()
+    
+    # Filter out month 0
+    recovery_df = forecast_df[forecast_df['month'] > 0].copy()
+    
+    fig2.add_trace(go.Bar(
+        x=recovery_df['monthLabel'],
+        y=recovery_df['staffRecovery'],
+        name='Recovered from Projects',
+        marker_color='#10b981'
+    ))
+    
+    fig2.add_trace(go.Bar(
+        x=recovery_df['monthLabel'],
+        y=recovery_df['unrecoveredStaffCosts'],
+        name='Unrecovered Staff Costs',
+        marker_color='#ef4444'
+    ))
+    
+    # Add annotations showing when fixed staff costs change
+    prev_staff_cost = None
+    annotations = []
+    for month_label, current_staff_cost in zip(recovery_df['monthLabel'], recovery_df['fixedStaffCosts'].astype(float)):
+        if prev_staff_cost is not None and current_staff_cost != prev_staff_cost:
+            annotations.append({
+                'x': month_label,
+                'y': current_staff_cost,
+                'text': f"Cost change to £{current_staff_cost:,.0f}",
+                'showarrow': True,
+                'arrowhead': 2,
+                'ax': 0,
+                'ay': -40,
+                'font': {'color': 'purple', 'size': 10}
+            })
+        prev_staff_cost = current_staff_cost
+    
+    fig2.update_layout(
+        barmode='stack',
+        height=350,
+        xaxis_title="Month",
+        yaxis_title="Amount (£)",
+        hovermode='x unified',
+        yaxis=dict(tickformat='£,.0f'),
+        annotations=annotations
+    )
+    return fig2
+
+def changes_section(compiled, probabilities, upload_changes, analysis_args, analysis_kwargs, stopwatch):
+    """What changed since the upload this one replaced, with each opportunity's effect on reserves"""
+    effects = pipeline_change_effects(upload_changes['previous_compiled'], compiled, upload_changes,
+                                      probabilities, *analysis_args, **analysis_kwargs)
+    summary = effects['summary']
+    lap(stopwatch, 'changes')
+    
+    with st.expander(
+        f"🔄 What changed since the previous upload: {summary['changed']} changed, "
+        f"{summary['added']} added, {summary['removed']} removed",
+        expanded=not effects['table'].empty
+    ):
+        st.caption(f"{summary['reparsed']} sheets re-read; the rest were reused from the previous upload")
+        change_col1, change_col2, change_col3 = st.columns(3)
+        with change_col1:
+            st.metric("Final Unrestricted Reserves", f"£{summary['end_reserves_effect']:+,.0f}")
+        with change_col2:
+            st.metric("Min. Unrestricted", f"£{summary['min_reserves_effect']:+,.0f}")
+        with change_col3:
+            st.metric("Months Below", f"{summary['months_below_change']:+d}")
         
-        # Month headers are in row 3 (index 2), starting from column B (index 1)
-        months = df.iloc[2, 1:].tolist()
+        if not effects['table'].empty:
+            changes_display = effects['table'].copy()
+            for column in ('contribution_change', 'end_reserves_effect', 'min_reserves_effect'):
+                changes_display[column] = changes_display[column].apply(lambda x: f"£{x:+,.0f}")
+            changes_display.columns = ['Sheet', 'Opportunity', 'Cluster', 'Change', 'Weighted Contribution',
+                                       'Final Reserves Effect', 'Min. Reserves Effect']
+            st.dataframe(changes_display, use_container_width=True, hide_index=True)
+
+# Result sections with their own widgets run as fragments: changing one of those widgets
+# reruns just that section against the forecast from the last full run. `analysis_args`
+# are the positional inputs shared by the analysis functions after the probabilities.
+
+def timed_fragment(section):
+    """Run `section` as a fragment, passing it the stopwatch to lap into as its last argument.
+    
+    In the full run that is the run's own stopwatch. A rerun of just the
+    fragment comes after the full run's stopwatch was finished, so the
+    section times itself on a new one, which is added to the diagnostics
+    history shown on the next full run.
+    """
+    @st.fragment
+    @functools.wraps(section)
+    def fragment(*args, stopwatch):
+        if not stopwatch['finished']:
+            section(*args, stopwatch)
+            return
+        fragment_stopwatch = new_stopwatch(stopwatch['enabled'])
+        section(*args, fragment_stopwatch)
+        if fragment_stopwatch['enabled']:
+            st.session_state.diagnostics_history.append(stopwatch_summary(fragment_stopwatch))
+    return fragment
+
+@timed_fragment
+def funnel_section(compiled, probabilities, active_mask, aggregates, stopwatch):
+    st.markdown("---")
+    st.subheader("Pipeline Funnel Analysis")
+    
+    # Funnel filter, offering periods up to the forecast horizon
+    funnel_month_options = [m for m in (6, 12, 18, 24, 36, 48, 60) if m <= len(compiled['months'])]
+    funnel_col1, funnel_col2 = st.columns([1, 3])
+    
+    with funnel_col1:
+        funnel_months = st.selectbox(
+            "Time Period",
+            options=funnel_month_options,
+            format_func=lambda x: f"Next {x} months",
+            index=len(funnel_month_options) - 1  # Default to the whole horizon
+        )
+    
+    with funnel_col2:
+        st.markdown("*Shows total pipeline value and probability-weighted value at each stage (excludes Secured income)*")
+    
+    # Calculate funnel data
+    funnel_df = calculate_pipeline_funnel(
+        compiled,
+        probabilities,
+        active_mask,
+        funnel_months,
+        aggregates=aggregates
+    )
+    lap(stopwatch, 'funnel')
+    
+    st.plotly_chart(funnel_figure(funnel_df), use_container_width=True)
+    
+    # Funnel summary table
+    st.markdown("**Pipeline Funnel Summary**")
+    funnel_display = format_funnel_summary(funnel_df)
+    
+    st.dataframe(
+        funnel_display,
+        use_container_width=True,
+        hide_index=True
+    )
+    lap(stopwatch, 'charts')
+
+@timed_fragment
+def reserve_section(compiled, probabilities, forecast_df, analysis_args, analysis_kwargs, show_special_projects,
+                    stopwatch):
+    threshold = analysis_args[-1]
+    st.markdown("---")
+    st.subheader(f"Reserve Levels Forecast ({len(compiled['months'])} Months)")
+    
+    sim_col1, sim_col2 = st.columns([1, 3])
+    with sim_col1:
+        risk_bands = st.radio(
+            "Risk bands",
+            options=['Off', 'Analytic', 'Monte Carlo'],
+            index=1,
+            horizontal=True,
+            help="Analytic bands are computed in closed form from the cluster probabilities on every change; "
+                 "Monte Carlo simulates the win/loss of each opportunity"
+        )
+    enable_simulation = risk_bands == 'Monte Carlo'
+    if enable_simulation:
+        with sim_col2:
+            trials_col, sampling_col, seed_col = st.columns([3, 2, 1])
+            with trials_col:
+                simulation_trials = st.select_slider(
+                    "Trials",
+                    options=[10000, 25000, 50000, 100000, 250000],
+                    value=10000
+                )
+            with sampling_col:
+                simulation_sampling = st.selectbox(
+                    "Sampling",
+                    options=list(SAMPLING_LABELS),
+                    format_func=SAMPLING_LABELS.get,
+                    help="Variance-reduced sampling gives tighter confidence intervals for the same trials. "
+                         "Importance sampling over-samples the wins and losses that lead to a breach and "
+                         "reweights them, so rare breaches are estimated far more precisely"
+                )
+            with seed_col:
+                simulation_seed = st.number_input(
+                    "Seed",
+                    value=42,
+                    step=1,
+                    format="%d",
+                    help="The same seed always gives the same simulated bands"
+                )
+    
+    fig = reserve_figure(forecast_df, threshold, show_special_projects)
+    lap(stopwatch, 'charts')
+    
+    # The latest risk bands go into the export; none when the bands are switched off
+    st.session_state.last_simulation = None
+    st.session_state.last_distribution = None
+    
+    if risk_bands == 'Off':
+        st.plotly_chart(fig, use_container_width=True)
+    elif risk_bands == 'Analytic':
+        distribution = calculate_reserve_distribution(compiled, probabilities, *analysis_args, **analysis_kwargs)
+        lap(stopwatch, 'risk bands')
+        st.session_state.last_distribution = distribution
+        bands = distribution['bands']
         
-        # Income is in row 4 (index 3)
-        income_values = df.iloc[3, 1:].tolist()
+        chart_col1, chart_col2 = st.columns(2)
+        with chart_col1:
+            st.markdown("**Expected-value forecast**")
+            st.plotly_chart(fig, use_container_width=True)
+        with chart_col2:
+            st.markdown("**Unrestricted reserves, analytic P5-P95**")
+            st.plotly_chart(fan_figure(bands, threshold), use_container_width=True)
         
-        # Staff is in row 5 (index 4)
-        staff_values = df.iloc[4, 1:].tolist()
+        breach_col1, breach_col2 = st.columns([3, 1])
+        with breach_col1:
+            st.plotly_chart(breach_figure(bands), use_container_width=True)
+        with breach_col2:
+            st.metric(
+                "Peak Monthly Breach Probability",
+                f"{distribution['peak_breach_probability']:.2%}",
+                delta=f"in {distribution['peak_breach_month']}",
+                delta_color="off",
+                help="Normal approximation; the chance of breaching at some point is at least this"
+            )
+            st.caption("Switch to Monte Carlo for the chance of breaching in any month and the first-breach month")
+    else:
+        simulation = simulate_forecast(
+            compiled,
+            probabilities,
+            *analysis_args,
+            trials=simulation_trials,
+            seed=int(simulation_seed),
+            workers=SIMULATION_WORKERS,
+            time_limit=SIMULATION_TIME_LIMIT,
+            schedules=analysis_kwargs['schedules'],
+            sampling=simulation_sampling
+        )
+        lap(stopwatch, 'simulation')
+        st.session_state.last_simulation = simulation
+        bands = simulation['bands']
         
-        # Expenses is in row 6 (index 5)
-        expenses_values = df.iloc[5, 1:].tolist()
+        if simulation['timed_out']:
+            st.warning(
+                f"Simulation stopped after {SIMULATION_TIME_LIMIT:.0f}s: showing "
+                f"{simulation['completed_trials']:,} of {simulation['requested_trials']:,} trials"
+            )
         
-        # Create opportunity dictionary
-        opp_data = {
-            'opportunity_name': opportunity_name,
-            'cluster': cluster
-        }
+        chart_col1, chart_col2 = st.columns(2)
+        with chart_col1:
+            st.markdown("**Expected-value forecast**")
+            st.plotly_chart(fig, use_container_width=True)
+        with chart_col2:
+            st.markdown(f"**Simulated unrestricted reserves ({simulation['trials']:,} trials)**")
+            st.plotly_chart(fan_figure(bands, threshold), use_container_width=True)
         
-        # Add monthly data
-        for i, month in enumerate(months):
-            if pd.notna(month) and str(month).strip() != '' and str(month).strip().lower() != 'nan':
-                # Remove leading apostrophe if present (Excel text formatting)
-                month_str = str(month).strip().lstrip("'")
-                
-                # Convert string values to float, handling NaN and empty strings
-                income = 0
-                staff = 0
-                expenses = 0
-                
-                if i < len(income_values) and pd.notna(income_values[i]) and str(income_values[i]).strip() != '':
-                    try:
-                        income = float(income_values[i])
-                    except ValueError:
-                        income = 0
-                
-                if i < len(staff_values) and pd.notna(staff_values[i]) and str(staff_values[i]).strip() != '':
-                    try:
-                        staff = float(staff_values[i])
-                    except ValueError:
-                        staff = 0
-                
-                if i < len(expenses_values) and pd.notna(expenses_values[i]) and str(expenses_values[i]).strip() != '':
-                    try:
-                        expenses = float(expenses_values[i])
-                    except ValueError:
-                        expenses = 0
-                
-                opp_data[f"{month_str}_income"] = income
-                opp_data[f"{month_str}_staff"] = staff
-                opp_data[f"{month_str}_expenses"] = expenses
+        first_breach_df = simulation['first_breach']
+        first_breach_display = first_breach_df[first_breach_df['probability'] > 0][['monthLabel', 'probability']].copy()
+        first_breach_display['probability'] = first_breach_display['probability'].apply(lambda x: f"{x:.1%}")
+        first_breach_display.columns = ['First Breach', 'Probability']
         
-        all_opportunities.append(opp_data)
-    
-    return pd.DataFrame(all_opportunities)
-
-def calculate_pipeline_funnel(pipeline_data, probabilities, active_opportunities, months_filter):
-    """Calculate pipeline funnel values for visualization"""
-    
-    # Determine which months to include based on filter
-    if months_filter == 6:
-        month_range = MONTH_LIST[:6]
-    elif months_filter == 12:
-        month_range = MONTH_LIST[:12]
-    else:  # 18 months
-        month_range = MONTH_LIST
-    
-    # Define funnel stages and their cluster mappings
-    funnel_stages = {
-        'All Opportunities': ['Ideas at development stage', 'Medium likelihood projects in development', 
-                             'High likelihood projects in development', 'Proposals out for decision',
-                             'Negotiating', 'Contracting'],
-        'Identified Income': ['Medium likelihood projects in development', 'High likelihood projects in development',
-                             'Proposals out for decision', 'Negotiating', 'Contracting'],
-        'Proposals': ['Proposals out for decision', 'Negotiating', 'Contracting'],
-        'Negotiating': ['Negotiating', 'Contracting'],
-        'Contracting': ['Contracting']
-    }
+        breach_col1, breach_col2 = st.columns([3, 1])
+        with breach_col1:
+            st.plotly_chart(breach_figure(bands), use_container_width=True)
+        with breach_col2:
+            breach_probability = simulation['breach_probability']
+            st.metric(
+                "Breach Probability",
+                f"{breach_probability['estimate']:.2%}",
+                delta=f"by {bands['monthLabel'].iloc[-1]}",
+                delta_color="off",
+                help="Share of simulated paths below the threshold in any month"
+            )
+            st.caption(f"95% CI {breach_probability['low']:.2%} – {breach_probability['high']:.2%}")
+            if simulation['sampling'] == 'importance':
+                st.caption(f"Effective sample size {simulation['effective_trials']:,.0f}")
+            st.dataframe(first_breach_display, use_container_width=True, hide_index=True)
+    
+    lap(stopwatch, 'charts')
+
+def comparison_scenarios(probabilities):
+    """Current settings, the presets and any saved scenarios, by display name"""
+    comparison_options = {'Current settings': dict(probabilities)}
+    comparison_options.update({name.capitalize(): probs for name, probs in scenario_presets.items()})
+    comparison_options.update(st.session_state.custom_scenarios)
+    return comparison_options
+
+@timed_fragment
+def scenario_section(compiled, probabilities, analysis_args, analysis_kwargs, stopwatch):
+    threshold = analysis_args[-1]
+    st.markdown("---")
+    st.subheader("Scenario Comparison")
     
-    funnel_data = []
+    comparison_options = comparison_scenarios(probabilities)
     
-    for stage_name, included_clusters in funnel_stages.items():
-        total_value = 0
-        weighted_value = 0
-        
-        for _, opp in pipeline_data.iterrows():
-            opp_name = opp['opportunity_name']
-            
-            # Skip if opportunity is toggled off
-            if opp_name not in active_opportunities or not active_opportunities[opp_name]:
-                continue
-            
-            cluster = opp.get('cluster', '')
-            
-            # Skip if cluster not in this stage
-            if cluster not in included_clusters:
-                continue
-            
-            probability = probabilities.get(cluster, 0) / 100
-            
-            # Sum income across selected months
-            for month_label in month_range:
-                income_col = f"{month_label}_income"
-                income = float(opp.get(income_col, 0)) if pd.notna(opp.get(income_col, 0)) else 0
-                total_value += income
-                weighted_value += income * probability
+    selected_scenarios = st.multiselect(
+        "Scenarios to compare",
+        options=list(comparison_options),
+        default=list(comparison_options)
+    )
+    
+    if selected_scenarios:
+        comparison = calculate_scenarios(
+            compiled,
+            {name: comparison_options[name] for name in selected_scenarios},
+            *analysis_args,
+            **analysis_kwargs
+        )
+        lap(stopwatch, 'scenarios')
         
-        funnel_data.append({
-            'stage': stage_name,
-            'total_value': total_value,
-            'weighted_value': weighted_value
+        scenario_col1, scenario_col2 = st.columns([3, 2])
+        with scenario_col1:
+            st.plotly_chart(scenario_figure(comparison['reserves'], threshold), use_container_width=True)
+        with scenario_col2:
+            comparison_display = comparison['metrics'].copy()
+            comparison_display['min_unrestricted'] = comparison_display['min_unrestricted'].apply(lambda x: f"£{x:,.0f}")
+            comparison_display['first_breach'] = comparison_display['first_breach'].fillna("None")
+            comparison_display.columns = ['Scenario', 'Min. Unrestricted', 'Months Below', 'First Breach']
+            st.dataframe(comparison_display, use_container_width=True, hide_index=True)
+    
+    lap(stopwatch, 'charts')
+
+@timed_fragment
+def slippage_section(compiled, probabilities, analysis_args, analysis_kwargs, stopwatch):
+    st.markdown("---")
+    st.subheader("Income Slippage")
+    st.caption("Delay each cluster's income, staff and expenses by up to the months given; "
+               "every combination of delays is evaluated")
+    
+    slip_col1, slip_col2 = st.columns([1, 2])
+    with slip_col1:
+        delay_table = pd.DataFrame({
+            'cluster': compiled['clusters'],
+            'max_delay': [0 if cluster == 'Secured income' else 3 for cluster in compiled['clusters']]
         })
+        edited_delays = st.data_editor(
+            delay_table,
+            column_config={
+                'cluster': "Cluster",
+                'max_delay': st.column_config.NumberColumn("Max delay (months)", min_value=0, max_value=12, step=1)
+            },
+            disabled=['cluster'],
+            hide_index=True,
+            use_container_width=True,
+            key=f"slippage_delays_{'|'.join(compiled['clusters'])}"
+        )
+    
+    delays = {row.cluster: range(int(row.max_delay or 0) + 1) for row in edited_delays.itertuples(index=False)}
+    delayed_clusters = [cluster for cluster, options in delays.items() if len(options) > 1]
+    try:
+        slippage = calculate_slippage(compiled, probabilities, delays, *analysis_args, **analysis_kwargs)
+    except ValueError as e:
+        with slip_col2:
+            st.warning(f"{e}; lower some maximum delays")
+        return
+    lap(stopwatch, 'slippage')
+    
+    slippage_df = slippage['table']
+    breaching = int(slippage_df['breaches'].sum())
+    with slip_col2:
+        slip_metric1, slip_metric2, slip_metric3 = st.columns(3)
+        with slip_metric1:
+            st.metric("Delay Patterns", f"{len(slippage_df):,}")
+        with slip_metric2:
+            st.metric("Breach Threshold", f"{breaching:,}", f"{breaching / len(slippage_df):.0%} of patterns",
+                      delta_color="off")
+        with slip_metric3:
+            st.metric("Worst Min. Unrestricted", f"£{slippage_df['min_unrestricted'].iloc[0]:,.0f}")
+        if delayed_clusters:
+            st.plotly_chart(slippage_figure(slippage_df, delayed_clusters), use_container_width=True)
+    
+    if delayed_clusters:
+        st.markdown("**Worst delay patterns**")
+        worst = slippage_df.head(20)[delayed_clusters + ['min_unrestricted', 'months_below', 'first_breach']].copy()
+        worst['min_unrestricted'] = worst['min_unrestricted'].apply(lambda x: f"£{x:,.0f}")
+        worst['first_breach'] = worst['first_breach'].fillna("None")
+        worst.columns = [f"{cluster} (mo)" for cluster in delayed_clusters] + ['Min. Unrestricted', 'Months Below', 'First Breach']
+        st.dataframe(worst, use_container_width=True, hide_index=True)
+    
+    lap(stopwatch, 'charts')
+
+@timed_fragment
+def sensitivity_section(compiled, probabilities, analysis_args, analysis_kwargs, stopwatch):
+    st.markdown("---")
+    st.subheader("Sensitivity Analysis")
+    
+    sens_col1, sens_col2, _ = st.columns([1, 1, 2])
+    with sens_col1:
+        sensitivity_prob_delta = st.number_input(
+            "Probability change (± pts)",
+            min_value=1,
+            max_value=50,
+            value=10,
+            step=1,
+            help="Each cluster probability is moved down and up by this many percentage points"
+        )
+    with sens_col2:
+        sensitivity_cost_delta = st.number_input(
+            "Fixed cost change (± %)",
+            min_value=1,
+            max_value=50,
+            value=10,
+            step=1,
+            help="Fixed staff and back office costs are moved down and up by this percentage"
+        )
+    
+    sensitivity = calculate_sensitivity(
+        compiled,
+        probabilities,
+        *analysis_args,
+        probability_delta=sensitivity_prob_delta,
+        cost_delta_pct=sensitivity_cost_delta,
+        **analysis_kwargs
+    )
+    lap(stopwatch, 'sensitivity')
+    
+    # Tornado charts show the change from the current settings
+    fig_tornado_min, fig_tornado_below = tornado_figures(
+        sensitivity['table'], sensitivity['base']['min_unrestricted'], sensitivity['base']['months_below']
+    )
+    
+    tornado_col1, tornado_col2 = st.columns([3, 2])
+    with tornado_col1:
+        st.plotly_chart(fig_tornado_min, use_container_width=True)
+    with tornado_col2:
+        st.plotly_chart(fig_tornado_below, use_container_width=True)
+    
+    lap(stopwatch, 'charts')
+
+@timed_fragment
+def goal_seek_section(compiled, probabilities, analysis_args, analysis_kwargs, stopwatch):
+    threshold = analysis_args[-1]
+    st.markdown("---")
+    st.subheader("Goal Seek: Stay Above the Critical Threshold")
+    
+    goal_targets = {
+        'probability': 'Cluster probability',
+        'staff': 'Fixed staff level from a month',
+        'deposit': 'Reserve deposit in a month'
+    }
+    
+    goal_col1, goal_col2, goal_col3 = st.columns([1, 1, 2])
+    with goal_col1:
+        goal_target = st.selectbox(
+            "Solve for",
+            options=list(goal_targets),
+            format_func=lambda x: goal_targets[x]
+        )
+    with goal_col2:
+        if goal_target == 'probability':
+            goal_cluster = st.selectbox("Cluster", options=list(probabilities))
+            goal_month = None
+        else:
+            goal_cluster = None
+            goal_month = st.selectbox("From month" if goal_target == 'staff' else "Deposit month", options=compiled['months'])
+    
+    goal = goal_seek(
+        compiled,
+        probabilities,
+        *analysis_args,
+        goal_target,
+        cluster=goal_cluster,
+        month=goal_month,
+        **analysis_kwargs
+    )
+    lap(stopwatch, 'goal_seek')
     
-    return pd.DataFrame(funnel_data)
+    with goal_col3:
+        if goal_target == 'probability':
+            value_text = f"{goal['value']}% ({goal['change']:+d} pts)"
+        elif goal_target == 'staff':
+            value_text = f"£{goal['value']:,.0f}/month from {goal_month} (£{goal['change']:+,.0f})"
+        else:
+            value_text = f"£{goal['value']:,.0f} in {goal_month}"
+        
+        if not goal['feasible']:
+            st.warning(
+                f"No value keeps reserves above £{threshold:,.0f} in every month. "
+                f"Best found: {value_text}, min. unrestricted £{goal['min_unrestricted']:,.0f}."
+            )
+        elif goal['change'] == 0:
+            st.success(f"Already above the threshold in every month with the current value ({value_text}).")
+        else:
+            st.success(
+                f"Minimal safe value: {value_text}, min. unrestricted £{goal['min_unrestricted']:,.0f}."
+            )
+        st.caption(f"{goal['evaluations']} forecast evaluations")
 
-def get_month_label(month_index):
-    """Convert month index (1-18) to label using the current dynamic MONTH_LIST"""
-    if 1 <= month_index <= len(MONTH_LIST):
-        return MONTH_LIST[month_index - 1]
-    return f"Month_{month_index}"
+# Export file types and their download MIME types
+EXPORT_MIME_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'application/zip',
+    'parquet': 'application/zip'
+}
 
-def get_month_index(month_label):
-    """Convert month label like Jan_2026 to index (1-18)"""
-    try:
-        return MONTH_LIST.index(month_label) + 1
-    except ValueError:
-        return 0
-
-def get_fixed_costs_for_month(month_label, cost_changes):
-    """Get the applicable fixed costs for a given month based on cost changes"""
-    month_idx = get_month_index(month_label)
-    
-    # Sort cost changes by month index
-    sorted_changes = sorted(cost_changes, key=lambda x: get_month_index(x['month']))
-    
-    # Find the most recent cost change that applies to this month
-    applicable_costs = {'staff': 45000, 'backoffice': 10500}  # defaults
-    
-    for change in sorted_changes:
-        change_idx = get_month_index(change['month'])
-        if change_idx > 0 and change_idx <= month_idx:
-            applicable_costs['staff'] = change['staff']
-            applicable_costs['backoffice'] = change['backoffice']
-    
-    return applicable_costs
-
-def calculate_forecast(pipeline_data, probabilities, unrestricted_start, total_funds_start, 
-                      base_staff, base_backoffice, reserve_deposits, cost_changes, active_opportunities,
-                      special_projects_costs):
-    """Calculate 18-month financial forecast with staff cost recovery"""
-    months = 18
-    forecast = []
-    
-    # Calculate static restricted funds
-    restricted_funds = total_funds_start - unrestricted_start
-    
-    # Month 0 (Current)
-    forecast.append({
-        'month': 0,
-        'monthLabel': 'Current',
-        'unrestrictedReserves': unrestricted_start,
-        'unrestrictedAfterSpecial': unrestricted_start,
-        'restrictedFunds': restricted_funds,
-        'totalFunds': total_funds_start
-    })
-    
-    # Months 1-18
-    for month in range(1, months + 1):
-        month_label = get_month_label(month)
-        
-        # Get applicable fixed costs for this month
-        fixed_costs = get_fixed_costs_for_month(month_label, cost_changes)
-        fixed_staff = fixed_costs['staff']
-        fixed_backoffice = fixed_costs['backoffice']
-        
-        # Get special projects cost for this month
-        special_cost = 0
-        for sp in special_projects_costs:
-            if sp['month'] == month_label:
-                special_cost = sp['amount']
-                break
-        
-        # Initialize monthly totals
-        total_income = 0
-        total_project_staff = 0
-        total_project_expenses = 0
-        
-        # Calculate weighted values from pipeline (only for active opportunities)
-        for _, opp in pipeline_data.iterrows():
-            opp_name = opp['opportunity_name']
-            
-            # Skip if opportunity is toggled off
-            if opp_name not in active_opportunities or not active_opportunities[opp_name]:
-                continue
-            
-            cluster = opp.get('cluster', '')
-            probability = probabilities.get(cluster, 0) / 100
-            
-            income_col = f"{month_label}_income"
-            staff_col = f"{month_label}_staff"
-            expenses_col = f"{month_label}_expenses"
-            
-            income = float(opp.get(income_col, 0)) if pd.notna(opp.get(income_col, 0)) else 0
-            staff = float(opp.get(staff_col, 0)) if pd.notna(opp.get(staff_col, 0)) else 0
-            expenses = float(opp.get(expenses_col, 0)) if pd.notna(opp.get(expenses_col, 0)) else 0
-            
-            total_income += income * probability
-            total_project_staff += staff * probability
-            total_project_expenses += expenses * probability
-        
-        # Calculate contribution
-        project_contribution = total_income - total_project_staff - total_project_expenses
-        
-        # Calculate staff cost recovery
-        staff_recovery = total_project_staff
-        unrecovered_staff_costs = max(0, fixed_staff - staff_recovery)
-        
-        # Use contribution to cover unrecovered staff costs first, then back office
-        remaining_after_staff = project_contribution - unrecovered_staff_costs
-        net_position = remaining_after_staff - fixed_backoffice
-        costs_to_cover = unrecovered_staff_costs + fixed_backoffice
-        
-        # Get previous month's reserves
-        prev_unrestricted = forecast[-1]['unrestrictedReserves']
-        
-        # Check for reserve deposits this month
-        deposit_this_month = 0
-        for deposit in reserve_deposits:
-            if deposit['month'] == month_label and deposit['amount'] > 0:
-                deposit_this_month += deposit['amount']
-        
-        # Apply simplified reserve rules
-        new_unrestricted = prev_unrestricted + net_position + deposit_this_month
-        
-        # Calculate unrestricted after special projects
-        new_unrestricted_after_special = new_unrestricted - special_cost
-        
-        # Total funds = unrestricted + static restricted funds
-        new_total_funds = new_unrestricted + restricted_funds
+@timed_fragment
+def export_section(compiled, probabilities, forecast_df, analysis_args, analysis_kwargs, stopwatch):
+    st.markdown("---")
+    st.subheader("Export")
+    
+    export_col1, export_col2, export_col3 = st.columns([1, 1, 2])
+    with export_col1:
+        export_format = st.selectbox(
+            "Format",
+            options=EXPORT_FORMATS,
+            format_func=lambda x: {'xlsx': "Excel workbook", 'csv': "CSV files (zip)", 'parquet': "Parquet files (zip)"}[x]
+        )
+    with export_col3:
+        st.markdown("*Forecast, funnel (whole horizon), per-opportunity weighted contributions, all scenarios "
+                    "and the analytic or Monte Carlo bands when shown, one sheet or file each*")
+    
+    # Tables are only built and written when asked for, in this fragment's own rerun
+    with export_col2:
+        if st.button("Prepare export", use_container_width=True):
+            active_mask = analysis_args[4]
+            comparison = calculate_scenarios(compiled, comparison_scenarios(probabilities), *analysis_args, **analysis_kwargs)
+            tables = {
+                'forecast': forecast_df,
+                'funnel': calculate_pipeline_funnel(compiled, probabilities, active_mask, len(compiled['months']),
+                                                    aggregates=analysis_kwargs['aggregates']),
+                'contributions': opportunity_contributions(compiled, probabilities, active_mask),
+                'scenario_reserves': comparison['reserves'],
+                'scenario_metrics': comparison['metrics']
+            }
+            simulation = st.session_state.get('last_simulation')
+            if simulation is not None:
+                tables['simulation_bands'] = simulation['bands']
+                tables['simulation_first_breach'] = simulation['first_breach']
+            distribution = st.session_state.get('last_distribution')
+            if distribution is not None:
+                tables['analytic_bands'] = distribution['bands']
+            st.session_state.prepared_export = {
+                'format': export_format,
+                'run': st.session_state.rerun_count,
+                'data': export_bytes(tables, export_format)
+            }
+            lap(stopwatch, 'export')
         
-        forecast.append({
-            'month': month,
-            'monthLabel': month_label,
-            'totalIncome': total_income,
-            'projectStaffCosts': total_project_staff,
-            'projectExpenses': total_project_expenses,
-            'projectContribution': project_contribution,
-            'fixedStaffCosts': fixed_staff,
-            'staffRecovery': staff_recovery,
-            'unrecoveredStaffCosts': unrecovered_staff_costs,
-            'fixedBackOfficeCosts': fixed_backoffice,
-            'costsFromContribution': costs_to_cover,
-            'netPosition': net_position,
-            'reserveDeposit': deposit_this_month,
-            'specialProjectsCost': special_cost,
-            'unrestrictedReserves': new_unrestricted,
-            'unrestrictedAfterSpecial': new_unrestricted_after_special,
-            'restrictedFunds': restricted_funds,
-            'totalFunds': new_total_funds
-        })
-    
-    return pd.DataFrame(forecast)
+        # Kept in the session so the button outlasts the rerun that clicking it starts; a full
+        # rerun since preparing means the inputs changed and the export is out of date
+        prepared = st.session_state.get('prepared_export')
+        if (prepared is not None and prepared['format'] == export_format
+                and prepared['run'] == st.session_state.rerun_count):
+            st.download_button(
+                "Download",
+                data=prepared['data'],
+                file_name=export_filename('pipeline_forecast', export_format),
+                mime=EXPORT_MIME_TYPES[export_format],
+                use_container_width=True
+            )
+
+# Every month a cost change or deposit can fall in, whatever the start month and horizon
+PLANNING_MONTHS = generate_month_list(START_MONTH_OPTIONS[0], len(START_MONTH_OPTIONS) - 1 + max(HORIZON_OPTIONS))
+
+def outside_horizon(table, month_list):
+    """Note grid rows kept for months outside the forecast, which are left out of it"""
+    outside = table['month'].notna() & ~table['month'].isin(month_list)
+    if outside.any():
+        st.caption(f"Rows ignored for months outside the forecast: {int(outside.sum())}")
 
 # Model start month selector
 st.markdown("---")
-_start_col, _ = st.columns([1, 2])
+_start_col, _horizon_col, _ = st.columns([1, 1, 1])
 with _start_col:
     _default_idx = START_MONTH_OPTIONS.index("May_2026") if "May_2026" in START_MONTH_OPTIONS else 0
     selected_start_month = st.selectbox(
         "📅 Model Start Month",
         options=START_MONTH_OPTIONS,
         index=_default_idx,
-        help="Data before this month is ignored. The 18-month forecast runs from this month forward."
+        help="Data before this month is ignored. The forecast runs from this month forward."
+    )
+with _horizon_col:
+    selected_horizon = st.selectbox(
+        "🗓️ Forecast Horizon",
+        options=HORIZON_OPTIONS,
+        index=HORIZON_OPTIONS.index(DEFAULT_HORIZON),
+        format_func=lambda x: f"{x} months",
+        help="Number of months forecast from the start month. Use 36 or 60 for multi-year grant planning."
     )
-# Rebuild MONTH_LIST from the selected start month
-MONTH_LIST = generate_month_list(selected_start_month)
+# Rebuild MONTH_LIST from the selected start month and horizon
+MONTH_LIST = generate_month_list(selected_start_month, selected_horizon)
 
 # Three-column layout
 col1, col2, col3 = st.columns(3)
@@ -454,75 +1092,53 @@ with col1:
     
     st.markdown(f"**Total Base Fixed Costs:** £{(base_fixed_staff_costs + base_fixed_backoffice_costs):,.0f}/month")
     
+    # Cost changes, deposits and special projects are edited as grids: one widget each, any
+    # number of rows, and whole schedules can be pasted from a spreadsheet. The grids' column
+    # config never changes (a new one would reset them), so months are offered from every start
+    # month and horizon, and rows outside the current forecast are kept but ignored.
+    month_column = st.column_config.SelectboxColumn("Month", options=PLANNING_MONTHS, required=True)
+    
     # Cost changes
-    with st.expander("💰 Fixed Cost Changes (up to 12)"):
+    with st.expander("💰 Fixed Cost Changes"):
         st.markdown("**Specify changes to fixed costs from specific months:**")
-        cost_changes = []
-        
-        for i in range(12):
-            col_month, col_staff, col_office = st.columns(3)
-            
-            with col_month:
-                change_month = st.selectbox(
-                    f"Month {i+1}",
-                    options=['None'] + MONTH_LIST,
-                    key=f"cost_month_{i}"
-                )
-            
-            if change_month != 'None':
-                with col_staff:
-                    new_staff = st.number_input(
-                        "Staff (£)",
-                        value=base_fixed_staff_costs,
-                        step=1000,
-                        format="%d",
-                        key=f"cost_staff_{i}"
-                    )
-                
-                with col_office:
-                    new_office = st.number_input(
-                        "Back Office (£)",
-                        value=base_fixed_backoffice_costs,
-                        step=1000,
-                        format="%d",
-                        key=f"cost_office_{i}"
-                    )
-                
-                cost_changes.append({
-                    'month': change_month,
-                    'staff': new_staff,
-                    'backoffice': new_office
-                })
+        cost_change_table = st.data_editor(
+            st.session_state.cost_change_rows,
+            column_config={
+                'month': month_column,
+                'staff': st.column_config.NumberColumn("Staff (£)", step=1000, format="%d",
+                                                       help="Blank keeps the base fixed staff costs"),
+                'backoffice': st.column_config.NumberColumn("Back Office (£)", step=1000, format="%d",
+                                                            help="Blank keeps the base fixed back office costs")
+            },
+            column_order=COST_CHANGE_COLUMNS,
+            num_rows="dynamic",
+            hide_index=True,
+            use_container_width=True,
+            key="cost_changes_table"
+        )
+        # Edited rows become the grid's data, so they outlive any rerun that resets the widget
+        st.session_state.cost_change_rows = cost_change_table.reset_index(drop=True)
+        cost_changes = cost_changes_from_table(cost_change_table, MONTH_LIST, base_fixed_staff_costs, base_fixed_backoffice_costs)
+        outside_horizon(cost_change_table, MONTH_LIST)
     
     # Reserve deposits
-    with st.expander("💵 Reserve Deposits (up to 4)"):
+    with st.expander("💵 Reserve Deposits"):
         st.markdown("**Add one-time deposits to unrestricted reserves:**")
-        reserve_deposits = []
-        
-        for i in range(4):
-            col_month, col_amount = st.columns(2)
-            
-            with col_month:
-                deposit_month = st.selectbox(
-                    f"Deposit {i+1} Month",
-                    options=['None'] + MONTH_LIST,
-                    key=f"deposit_month_{i}"
-                )
-            
-            if deposit_month != 'None':
-                with col_amount:
-                    deposit_amount = st.number_input(
-                        "Amount (£)",
-                        value=0,
-                        step=1000,
-                        format="%d",
-                        key=f"deposit_amount_{i}"
-                    )
-                
-                reserve_deposits.append({
-                    'month': deposit_month,
-                    'amount': deposit_amount
-                })
+        deposit_table = st.data_editor(
+            st.session_state.deposit_rows,
+            column_config={
+                'month': month_column,
+                'amount': st.column_config.NumberColumn("Amount (£)", min_value=0, step=1000, format="%d")
+            },
+            column_order=AMOUNT_COLUMNS,
+            num_rows="dynamic",
+            hide_index=True,
+            use_container_width=True,
+            key="reserve_deposits_table"
+        )
+        st.session_state.deposit_rows = deposit_table.reset_index(drop=True)
+        reserve_deposits = amounts_from_table(deposit_table, MONTH_LIST)
+        outside_horizon(deposit_table, MONTH_LIST)
     
     # Special projects costs
     st.markdown("---")
@@ -538,21 +1154,22 @@ with col1:
     if enable_special_projects:
         with st.expander("🔧 Special Projects Costs (monthly)"):
             st.markdown("**Specify additional monthly costs for special projects:**")
-            
-            for month_label in MONTH_LIST:
-                sp_cost = st.number_input(
-                    f"{month_label}",
-                    value=0,
-                    step=1000,
-                    format="%d",
-                    key=f"special_{month_label}"
-                )
-                
-                if sp_cost > 0:
-                    special_projects_costs.append({
-                        'month': month_label,
-                        'amount': sp_cost
-                    })
+            # One row per forecast month, indexed by month so that a new start month or horizon
+            # starts a fresh grid; amounts are kept per month label across such changes
+            amounts = st.session_state.special_project_amounts
+            special_table = st.data_editor(
+                pd.DataFrame({'amount': [amounts.get(month, 0.0) for month in MONTH_LIST]},
+                             index=pd.Index(MONTH_LIST, name='month')),
+                column_config={
+                    '_index': st.column_config.TextColumn("Month"),
+                    'amount': st.column_config.NumberColumn("Cost (£)", min_value=0, step=1000, format="%d")
+                },
+                num_rows="fixed",
+                use_container_width=True,
+                key="special_projects_table"
+            ).reset_index()
+            amounts.update(zip(special_table['month'], pd.to_numeric(special_table['amount'], errors='coerce').fillna(0.0)))
+            special_projects_costs = amounts_from_table(special_table, MONTH_LIST)
     
     st.markdown("---")
     
@@ -564,48 +1181,137 @@ with col1:
         help="Minimum unrestricted reserves"
     )
 
+lap(stopwatch, 'inputs')
+
 # Column 2: Pipeline Data Upload
 with col2:
     st.subheader("Pipeline Data Upload")
     
-    uploaded_file = st.file_uploader("Upload Pipeline Excel File (.xlsx)", type=['xlsx'])
-    
-    if uploaded_file is not None:
+    pipeline_store = None
+    pipeline_source = "Upload"
+    if use_pipeline_store:
+        pipeline_store = get_pipeline_store(os.environ.get('PIPELINE_STORE_PATH', DEFAULT_STORE_PATH))
+        pipeline_source = st.radio("Pipeline source", ["Upload", "Saved snapshot"], horizontal=True)
+    
+    uploaded_file = None
+    snapshot_id = None
+    upload_changes = None
+    if pipeline_source == "Upload":
+        uploaded_file = st.file_uploader(
+            "Upload Pipeline File (.xlsx, or long-format .csv / .parquet)",
+            type=list(PIPELINE_FORMATS)
+        )
+    else:
+        # Snapshots are immutable, so reopening one is a lookup of its compiled arrays
+        snapshots = list_snapshots(pipeline_store)
+        snapshot_date = st.date_input("Pipeline as of", help="Use the latest snapshot saved on or before this date (UTC)")
+        snapshot_id = snapshot_as_of(pipeline_store, snapshot_date)
+        with st.expander(f"Snapshot history ({len(snapshots)})"):
+            st.dataframe(snapshots.drop(columns='content_hash'), hide_index=True, use_container_width=True)
+    
+    if uploaded_file is not None or snapshot_id is not None:
         try:
-            pipeline_data = parse_excel_pipeline(uploaded_file)
-            st.success(f"✓ {len(pipeline_data)} opportunities loaded")
+            if snapshot_id is not None:
+                pipeline_key, pipeline_data, compiled_pipeline = load_snapshot(pipeline_store, snapshot_id, MONTH_LIST)
+                lap(stopwatch, 'parse')
+                snapshot = snapshots.set_index('id').loc[snapshot_id]
+                st.success(
+                    f"✓ {len(compiled_pipeline['names'])} opportunities loaded from snapshot #{snapshot_id} "
+                    f"({snapshot['source']}, saved {snapshot['created_at'][:16].replace('T', ' ')} UTC)"
+                )
+            else:
+                # A re-upload is parsed against the session's previous upload, re-reading only changed sheets
+                parse_cache = get_parse_cache()
+                upload_key = st.session_state.get('upload_key')
+                pipeline_key, pipeline_data, compiled_pipeline = cached_parse_pipeline(
+                    parse_cache, uploaded_file.getvalue(), MONTH_LIST, pipeline_format(uploaded_file.name),
+                    previous_key=upload_key
+                )
+                if pipeline_key != upload_key:
+                    st.session_state.replaced_upload_key = upload_key
+                    st.session_state.upload_key = pipeline_key
+                upload_changes = cached_pipeline_changes(
+                    parse_cache, pipeline_key, MONTH_LIST, st.session_state.get('replaced_upload_key')
+                )
+                lap(stopwatch, 'parse')
+                st.success(f"✓ {len(compiled_pipeline['names'])} opportunities loaded")
+                cache_stats = parse_cache_stats(parse_cache)
+                st.caption(
+                    f"Parse cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+                    f"({cache_stats['entries']} of {cache_stats['max_entries']} uploads held)"
+                )
+                
+                # Each distinct upload is saved once; identical content maps to its existing snapshot
+                if pipeline_store is not None:
+                    if st.session_state.get('saved_snapshot_key') != pipeline_key:
+                        st.session_state.saved_snapshot_id = save_snapshot(
+                            pipeline_store, pipeline_data, uploaded_file.name, pipeline_key
+                        )
+                        st.session_state.saved_snapshot_key = pipeline_key
+                    st.caption(f"Saved as snapshot #{st.session_state.saved_snapshot_id}")
             
-            # Initialize toggles for new opportunities
-            for _, opp in pipeline_data.iterrows():
-                opp_name = opp['opportunity_name']
-                if opp_name not in st.session_state.opportunity_toggles:
-                    st.session_state.opportunity_toggles[opp_name] = True
+            # Include flags live in a boolean mask aligned with the compiled arrays; a new upload
+            # keeps the flags of opportunities it shares (by name) with the previous one
+            if st.session_state.get('active_mask_key') != pipeline_key:
+                previous_flags = dict(zip(st.session_state.get('active_mask_names', []),
+                                          st.session_state.get('active_mask', [])))
+                st.session_state.active_mask = build_active_mask(compiled_pipeline, previous_flags, default=True)
+                st.session_state.active_mask_names = compiled_pipeline['names']
+                st.session_state.active_mask_key = pipeline_key
+            active_mask = st.session_state.active_mask
             
-            # Opportunity toggles
-            with st.expander("🎯 Toggle Opportunities"):
-                st.markdown("**Select which opportunities to include in the model:**")
-                for _, opp in pipeline_data.iterrows():
-                    opp_name = opp['opportunity_name']
-                    cluster = opp['cluster']
-                    
-                    st.session_state.opportunity_toggles[opp_name] = st.checkbox(
-                        f"{opp_name} ({cluster})",
-                        value=st.session_state.opportunity_toggles.get(opp_name, True),
-                        key=f"toggle_{opp_name}"
-                    )
+            # Searchable opportunity table with bulk include/exclude of the rows shown
+            with st.expander("🎯 Select Opportunities"):
+                search_col, cluster_col = st.columns(2)
+                with search_col:
+                    opportunity_search = st.text_input("Search", placeholder="Opportunity name")
+                with cluster_col:
+                    opportunity_clusters = st.multiselect("Clusters", options=list(compiled_pipeline['clusters']))
+                shown = filter_opportunity_table(
+                    opportunity_table(compiled_pipeline, active_mask), opportunity_search, opportunity_clusters
+                )
+                
+                bulk_col1, bulk_col2 = st.columns(2)
+                with bulk_col1:
+                    include_shown = st.button(f"Include {len(shown)} shown", use_container_width=True)
+                with bulk_col2:
+                    exclude_shown = st.button(f"Exclude {len(shown)} shown", use_container_width=True)
+                if include_shown or exclude_shown:
+                    active_mask[shown.index.to_numpy()] = include_shown
+                    shown = shown.assign(active=include_shown)
+                    st.session_state.opportunity_table_version = st.session_state.get('opportunity_table_version', 0) + 1
+                
+                # The editor key follows the filter and bulk edits so row edits never carry over to other rows
+                table_key = (f"opportunity_table_{pipeline_key[:12]}_{opportunity_search}_"
+                             f"{'|'.join(opportunity_clusters)}_{st.session_state.get('opportunity_table_version', 0)}")
+                edited_opportunities = st.data_editor(
+                    shown,
+                    column_config={
+                        'active': st.column_config.CheckboxColumn("Include"),
+                        'opportunity': "Opportunity",
+                        'cluster': "Cluster",
+                        'income': st.column_config.NumberColumn("Income (£)", format="%d"),
+                        'staff': st.column_config.NumberColumn("Staff (£)", format="%d"),
+                        'expenses': st.column_config.NumberColumn("Expenses (£)", format="%d")
+                    },
+                    disabled=['opportunity', 'cluster', 'income', 'staff', 'expenses'],
+                    hide_index=True,
+                    use_container_width=True,
+                    key=table_key
+                )
+                active_mask[edited_opportunities.index.to_numpy()] = edited_opportunities['active'].to_numpy(dtype=bool)
             
-            # Show opportunity names
-            with st.expander("View loaded opportunities"):
-                for _, opp in pipeline_data.iterrows():
-                    status = "✓" if st.session_state.opportunity_toggles.get(opp['opportunity_name'], True) else "✗"
-                    st.write(f"{status} **{opp['opportunity_name']}** ({opp['cluster']})")
+            st.caption(f"{int(active_mask.sum())} of {len(active_mask)} opportunities included")
             
         except Exception as e:
-            st.error(f"Error reading Excel file: {str(e)}")
+            st.error(f"Error reading pipeline file: {str(e)}")
             pipeline_data = pd.DataFrame()
     else:
         pipeline_data = pd.DataFrame()
-        st.info("Upload an Excel file to begin modelling")
+        if pipeline_source == "Upload":
+            st.info("Upload a pipeline file to begin modelling")
+        else:
+            st.info("No snapshot saved on or before that date")
     
     st.markdown("---")
     st.markdown("**Quick Scenarios**")
@@ -629,6 +1335,21 @@ with col2:
             st.session_state.probabilities = scenario_presets['optimistic']
             st.session_state.scenario = 'optimistic'
             st.rerun()
+    
+    # Save the current slider settings for side-by-side comparison
+    save_col1, save_col2 = st.columns([2, 1])
+    with save_col1:
+        custom_scenario_name = st.text_input(
+            "Scenario name",
+            placeholder="e.g. Board case",
+            label_visibility="collapsed"
+        )
+    with save_col2:
+        if st.button("Save scenario", use_container_width=True, disabled=not custom_scenario_name.strip()):
+            st.session_state.custom_scenarios[custom_scenario_name.strip()] = dict(st.session_state.probabilities)
+    
+    if st.session_state.custom_scenarios:
+        st.caption("Saved scenarios: " + ", ".join(st.session_state.custom_scenarios))
 
 # Column 3: Probability Settings
 with col3:
@@ -643,11 +1364,31 @@ with col3:
             format="%d%%"
         )
 
+lap(stopwatch, 'inputs')
+
 # Only proceed if data is uploaded
 if not pipeline_data.empty:
+    # Per-cluster sums follow the include mask incrementally; only a new upload or start month rebuilds them
+    aggregates_key = (pipeline_key, tuple(compiled_pipeline['months']))
+    if st.session_state.get('cluster_aggregates_key') != aggregates_key:
+        st.session_state.cluster_aggregates = build_cluster_aggregates(compiled_pipeline, active_mask)
+        st.session_state.cluster_aggregates_key = aggregates_key
+    else:
+        update_cluster_aggregates(st.session_state.cluster_aggregates, compiled_pipeline, active_mask)
+    cluster_aggregates = st.session_state.cluster_aggregates
+    
+    # Cost, deposit and special project schedules are compiled when those inputs change and shared below
+    schedule_inputs = (MONTH_LIST, cost_changes, reserve_deposits, special_projects_costs,
+                       base_fixed_staff_costs, base_fixed_backoffice_costs)
+    if st.session_state.get('cost_schedules_key') != cost_schedule_key(*schedule_inputs):
+        st.session_state.cost_schedules = build_cost_schedules(*schedule_inputs)
+        st.session_state.cost_schedules_key = cost_schedule_key(*schedule_inputs)
+    cost_schedules = st.session_state.cost_schedules
+    lap(stopwatch, 'aggregates')
+    
     # Calculate forecast
     forecast_df = calculate_forecast(
-        pipeline_data,
+        compiled_pipeline,
         st.session_state.probabilities,
         unrestricted_reserves,
         total_funds,
@@ -655,24 +1396,23 @@ if not pipeline_data.empty:
         base_fixed_backoffice_costs,
         reserve_deposits,
         cost_changes,
-        st.session_state.opportunity_toggles,
-        special_projects_costs
+        active_mask,
+        special_projects_costs,
+        aggregates=cluster_aggregates,
+        schedules=cost_schedules
     )
     
     # Calculate risk metrics
-    min_unrestricted = forecast_df['unrestrictedReserves'].min()
-    months_below_threshold = (forecast_df['unrestrictedReserves'] < threshold).sum()
-    first_breach = forecast_df[forecast_df['unrestrictedReserves'] < threshold]['monthLabel'].iloc[0] if months_below_threshold > 0 else None
-    min_total_funds = forecast_df['totalFunds'].min()
-    max_total_funds = forecast_df['totalFunds'].max()
-    is_at_risk = min_unrestricted < threshold
-    
-    # Calculate average staff recovery rate (excluding month 0)
-    avg_staff_recovery = forecast_df[forecast_df['month'] > 0]['staffRecovery'].mean()
-    
-    # Get average of fixed staff costs across all months
-    avg_fixed_staff = forecast_df[forecast_df['month'] > 0]['fixedStaffCosts'].mean()
-    avg_staff_recovery_pct = (avg_staff_recovery / avg_fixed_staff * 100) if avg_fixed_staff > 0 else 0
+    risk_metrics = calculate_risk_metrics(forecast_df, threshold)
+    min_unrestricted = risk_metrics['min_unrestricted']
+    months_below_threshold = risk_metrics['months_below_threshold']
+    first_breach = risk_metrics['first_breach']
+    min_total_funds = risk_metrics['min_total_funds']
+    max_total_funds = risk_metrics['max_total_funds']
+    is_at_risk = risk_metrics['is_at_risk']
+    avg_staff_recovery = risk_metrics['avg_staff_recovery']
+    avg_staff_recovery_pct = risk_metrics['avg_staff_recovery_pct']
+    lap(stopwatch, 'forecast')
     
     # Risk Metrics Dashboard
     st.markdown("---")
@@ -709,7 +1449,7 @@ if not pipeline_data.empty:
         st.metric(
             "Months Below",
             f"{months_below_threshold}",
-            delta="of 18 months"
+            delta=f"of {len(MONTH_LIST)} months"
         )
     
     with metric_col6:
@@ -718,254 +1458,39 @@ if not pipeline_data.empty:
             first_breach if first_breach else "None"
         )
     
-    # Pipeline Funnel
-    st.markdown("---")
-    st.subheader("Pipeline Funnel Analysis")
-    
-    # Funnel filter
-    funnel_col1, funnel_col2 = st.columns([1, 3])
-    
-    with funnel_col1:
-        funnel_months = st.selectbox(
-            "Time Period",
-            options=[6, 12, 18],
-            format_func=lambda x: f"Next {x} months",
-            index=2  # Default to 18 months
-        )
-    
-    with funnel_col2:
-        st.markdown("*Shows total pipeline value and probability-weighted value at each stage (excludes Secured income)*")
-    
-    # Calculate funnel data
-    funnel_df = calculate_pipeline_funnel(
-        pipeline_data,
-        st.session_state.probabilities,
-        st.session_state.opportunity_toggles,
-        funnel_months
-    )
-    
-    # Create funnel visualization
-    fig_funnel = go.Figure()
-    
-    # Add bars for total value
-    fig_funnel.add_trace(go.Bar(
-        y=funnel_df['stage'],
-        x=funnel_df['total_value'],
-        name='Total Value',
-        orientation='h',
-        marker=dict(color='#93c5fd'),
-        text=funnel_df['total_value'].apply(lambda x: f'£{x:,.0f}'),
-        textposition='inside',
-        textfont=dict(size=12)
-    ))
-    
-    # Add bars for weighted value
-    fig_funnel.add_trace(go.Bar(
-        y=funnel_df['stage'],
-        x=funnel_df['weighted_value'],
-        name='Probability-Weighted Value',
-        orientation='h',
-        marker=dict(color='#2563eb'),
-        text=funnel_df['weighted_value'].apply(lambda x: f'£{x:,.0f}'),
-        textposition='inside',
-        textfont=dict(size=12, color='white')
-    ))
-    
-    fig_funnel.update_layout(
-        barmode='overlay',
-        height=350,
-        xaxis_title="Value (£)",
-        yaxis_title="Pipeline Stage",
-        xaxis=dict(tickformat='£,.0f'),
-        yaxis=dict(autorange='reversed'),  # Top to bottom
-        showlegend=True,
-        legend=dict(
-            orientation="h",
-            yanchor="bottom",
-            y=1.02,
-            xanchor="right",
-            x=1
-        )
-    )
-    
-    st.plotly_chart(fig_funnel, use_container_width=True)
-    
-    # Funnel summary table
-    st.markdown("**Pipeline Funnel Summary**")
-    funnel_display = funnel_df.copy()
-    funnel_display['Conversion Rate'] = (funnel_display['weighted_value'] / funnel_display['total_value'] * 100).apply(lambda x: f"{x:.1f}%")
-    funnel_display['Total Value'] = funnel_display['total_value'].apply(lambda x: f'£{x:,.0f}')
-    funnel_display['Weighted Value'] = funnel_display['weighted_value'].apply(lambda x: f'£{x:,.0f}')
-    funnel_display = funnel_display[['stage', 'Total Value', 'Weighted Value', 'Conversion Rate']]
-    funnel_display.columns = ['Stage', 'Total Value', 'Weighted Value', 'Conversion Rate']
-    
-    st.dataframe(
-        funnel_display,
-        use_container_width=True,
-        hide_index=True
-    )
-    
-    # Reserve Levels Forecast Chart
-    st.markdown("---")
-    st.subheader("Reserve Levels Forecast (18 Months)")
-    
-    fig = go.Figure()
-    
-    # Add unrestricted reserves line
-    fig.add_trace(go.Scatter(
-        x=forecast_df['monthLabel'],
-        y=forecast_df['unrestrictedReserves'],
-        mode='lines+markers',
-        name='Unrestricted Reserves',
-        line=dict(color='#2563eb', width=3),
-        marker=dict(size=6)
-    ))
-    
-    # Add unrestricted after special projects line if enabled
-    if enable_special_projects:
-        fig.add_trace(go.Scatter(
-            x=forecast_df['monthLabel'],
-            y=forecast_df['unrestrictedAfterSpecial'],
-            mode='lines+markers',
-            name='Unrestricted After Special Projects',
-            line=dict(color='#f59e0b', width=2, dash='dot'),
-            marker=dict(size=4)
-        ))
-    
-    # Add total funds line
-    fig.add_trace(go.Scatter(
-        x=forecast_df['monthLabel'],
-        y=forecast_df['totalFunds'],
-        mode='lines+markers',
-        name='Total Funds',
-        line=dict(color='#10b981', width=2, dash='dash'),
-        marker=dict(size=4)
-    ))
-    
-    # Add threshold line
-    fig.add_hline(
-        y=threshold,
-        line_dash="dash",
-        line_color="red",
-        annotation_text="Critical Threshold",
-        annotation_position="right"
-    )
-    
-    fig.update_layout(
-        height=400,
-        xaxis_title="Month",
-        yaxis_title="Amount (£)",
-        hovermode='x unified',
-        yaxis=dict(tickformat='£,.0f')
-    )
-    
-    st.plotly_chart(fig, use_container_width=True)
+    # Shared inputs of the simulation, scenario, sensitivity and goal seek sections
+    analysis_args = (unrestricted_reserves, total_funds, reserve_deposits, cost_changes, active_mask,
+                     special_projects_costs, threshold)
+    analysis_kwargs = {'aggregates': cluster_aggregates, 'schedules': cost_schedules}
+    
+    if upload_changes is not None:
+        changes_section(compiled_pipeline, st.session_state.probabilities, upload_changes, analysis_args,
+                        analysis_kwargs, stopwatch)
+    funnel_section(compiled_pipeline, st.session_state.probabilities, active_mask, cluster_aggregates,
+                   stopwatch=stopwatch)
+    reserve_section(compiled_pipeline, st.session_state.probabilities, forecast_df, analysis_args, analysis_kwargs,
+                    enable_special_projects, stopwatch=stopwatch)
+    scenario_section(compiled_pipeline, st.session_state.probabilities, analysis_args, analysis_kwargs,
+                     stopwatch=stopwatch)
+    slippage_section(compiled_pipeline, st.session_state.probabilities, analysis_args, analysis_kwargs,
+                     stopwatch=stopwatch)
+    sensitivity_section(compiled_pipeline, st.session_state.probabilities, analysis_args, analysis_kwargs,
+                        stopwatch=stopwatch)
+    goal_seek_section(compiled_pipeline, st.session_state.probabilities, analysis_args, analysis_kwargs,
+                      stopwatch=stopwatch)
     
     # Staff Cost Recovery Chart
     st.markdown("---")
     st.subheader("Staff Cost Recovery Analysis")
     
-    fig2 = go.Figure()
-    
-    # Filter out month 0
-    recovery_df = forecast_df[forecast_df['month'] > 0].copy()
-    
-    fig2.add_trace(go.Bar(
-        x=recovery_df['monthLabel'],
-        y=recovery_df['staffRecovery'],
-        name='Recovered from Projects',
-        marker_color='#10b981'
-    ))
-    
-    fig2.add_trace(go.Bar(
-        x=recovery_df['monthLabel'],
-        y=recovery_df['unrecoveredStaffCosts'],
-        name='Unrecovered Staff Costs',
-        marker_color='#ef4444'
-    ))
-    
-    # Add annotations showing when fixed staff costs change
-    prev_staff_cost = None
-    annotations = []
-    for idx, row in recovery_df.iterrows():
-        current_staff_cost = float(row['fixedStaffCosts'])
-        if prev_staff_cost is not None and current_staff_cost != prev_staff_cost:
-            annotations.append({
-                'x': row['monthLabel'],
-                'y': current_staff_cost,
-                'text': f"Cost change to £{current_staff_cost:,.0f}",
-                'showarrow': True,
-                'arrowhead': 2,
-                'ax': 0,
-                'ay': -40,
-                'font': {'color': 'purple', 'size': 10}
-            })
-        prev_staff_cost = current_staff_cost
-    
-    fig2.update_layout(
-        barmode='stack',
-        height=350,
-        xaxis_title="Month",
-        yaxis_title="Amount (£)",
-        hovermode='x unified',
-        yaxis=dict(tickformat='£,.0f'),
-        annotations=annotations
-    )
-    
-    st.plotly_chart(fig2, use_container_width=True)
+    st.plotly_chart(recovery_figure(forecast_df), use_container_width=True)
     
     # Monthly Breakdown Table
     st.markdown("---")
     st.subheader("Detailed Monthly Breakdown")
     
     # Prepare display dataframe
-    display_df = forecast_df[forecast_df['month'] > 0].copy()
-    
-    # Select columns based on whether special projects is enabled
-    if enable_special_projects:
-        display_df = display_df[[
-            'monthLabel', 'totalIncome', 'projectStaffCosts', 'projectExpenses', 
-            'projectContribution', 'staffRecovery', 'unrecoveredStaffCosts',
-            'fixedBackOfficeCosts', 'costsFromContribution', 'netPosition', 'reserveDeposit',
-            'unrestrictedReserves', 'specialProjectsCost', 'unrestrictedAfterSpecial',
-            'restrictedFunds', 'totalFunds'
-        ]].copy()
-        
-        display_df.columns = [
-            'Month', 'Income', 'Project Staff', 'Project Expenses', 
-            'Contribution', 'Staff Recovery', 'Unrecovered Staff',
-            'Back Office', 'Costs from Contrib.', 'Net Position', 'Deposits',
-            'Unrestricted', 'Special Projects', 'Unres. After Special',
-            'Restricted Funds', 'Total Funds'
-        ]
-        
-        currency_cols = ['Income', 'Project Staff', 'Project Expenses', 'Contribution',
-                         'Staff Recovery', 'Unrecovered Staff', 'Back Office', 
-                         'Costs from Contrib.', 'Net Position', 'Deposits', 'Unrestricted',
-                         'Special Projects', 'Unres. After Special', 'Restricted Funds', 'Total Funds']
-    else:
-        display_df = display_df[[
-            'monthLabel', 'totalIncome', 'projectStaffCosts', 'projectExpenses', 
-            'projectContribution', 'staffRecovery', 'unrecoveredStaffCosts',
-            'fixedBackOfficeCosts', 'costsFromContribution', 'netPosition', 'reserveDeposit',
-            'unrestrictedReserves', 'restrictedFunds', 'totalFunds'
-        ]].copy()
-        
-        display_df.columns = [
-            'Month', 'Income', 'Project Staff', 'Project Expenses', 
-            'Contribution', 'Staff Recovery', 'Unrecovered Staff',
-            'Back Office', 'Costs from Contrib.', 'Net Position', 'Deposits',
-            'Unrestricted', 'Restricted Funds', 'Total Funds'
-        ]
-        
-        currency_cols = ['Income', 'Project Staff', 'Project Expenses', 'Contribution',
-                         'Staff Recovery', 'Unrecovered Staff', 'Back Office', 
-                         'Costs from Contrib.', 'Net Position', 'Deposits', 'Unrestricted', 
-                         'Restricted Funds', 'Total Funds']
-    
-    # Format currency columns
-    for col in currency_cols:
-        display_df[col] = display_df[col].apply(lambda x: f"£{x:,.0f}")
+    display_df = format_monthly_breakdown(forecast_df, enable_special_projects)
     
     # Display table
     st.dataframe(
@@ -974,6 +1499,10 @@ if not pipeline_data.empty:
         hide_index=True,
         height=400
     )
+    lap(stopwatch, 'charts')
+    
+    export_section(compiled_pipeline, st.session_state.probabilities, forecast_df, analysis_args, analysis_kwargs,
+                   stopwatch=stopwatch)
 
 # Information Box
 st.markdown("---")
@@ -985,11 +1514,13 @@ Create a multi-sheet Excel (.xlsx) file where each sheet represents one opportun
 **Each sheet structure:**
 - **Cell A1:** Opportunity name (e.g., "Project Alpha")
 - **Cell A2:** Cluster name (e.g., "Secured income")
-- **Row 3, starting Column B:** Month headers matching your pipeline (e.g. Jan_2026, Feb_2026 ... covering 18 months from your selected start month)
+- **Row 3, starting Column B:** Month headers matching your pipeline (e.g. Jan_2026, Feb_2026 ... covering the forecast horizon from your selected start month)
 - **Row 4, starting Column B:** Income values for each month
 - **Row 5, starting Column B:** Staff cost values for each month
 - **Row 6, starting Column B:** Expense values for each month
 
+**Long format (.csv or .parquet):** One row per opportunity and month with columns `opportunity`, `cluster`, `month` (e.g. May_2026), `income`, `staff`, `expenses`. Suited to CRM exports with thousands of opportunities.
+
 **Valid Clusters:** 
 - Secured income (100% - excluded from funnel, already secured)
 - Contracting (100%)
@@ -1007,9 +1538,66 @@ Create a multi-sheet Excel (.xlsx) file where each sheet represents one opportun
 5. **Contracting** - Contracting only
 
 **New Features:**
-- **Toggle Opportunities:** Turn individual projects on/off in the model
-- **Reserve Deposits:** Add up to 4 one-time deposits to unrestricted reserves
-- **Cost Changes:** Specify up to 4 changes to fixed costs throughout the forecast period
+- **Select Opportunities:** Search, filter by cluster and include or exclude projects individually or in bulk
+- **Reserve Deposits:** Add any number of one-time deposits to unrestricted reserves
+- **Cost Changes:** Specify changes to fixed costs throughout the forecast period
+- **Grids:** Cost changes, deposits and special projects are editable tables; add rows or paste them from a spreadsheet
 - **Special Projects:** Enable additional monthly costs that reduce unrestricted reserves
+- **Analytic Risk Bands:** P5-P95 reserve bands and monthly breach probabilities in closed form, updated on every change
+- **Risk Bands:** Monte Carlo bands with 95% confidence intervals on breach probabilities; antithetic, Latin hypercube or breach-focused importance sampling tighten them for the same number of trials
+- **Income Slippage:** Delay clusters' income by up to a chosen number of months and see which combinations of delays breach the threshold
 - **Pipeline Funnel:** Visualize pipeline value at each stage with total and weighted values
+- **Re-uploads:** Uploading a new version of the workbook re-reads only the sheets that changed and shows each changed opportunity's effect on reserves
+- **Saved Snapshots:** Optionally keep each upload in a local database and reopen the pipeline as of an earlier date
+- **Export:** Download the forecast, funnel, per-opportunity contributions and scenario results as Excel, CSV or Parquet
 """)
+
+# Performance diagnostics
+if show_diagnostics:
+    lap(stopwatch, 'layout')
+    finish_stopwatch(stopwatch)
+    timings = stopwatch_summary(stopwatch)
+    history = st.session_state.diagnostics_history
+    history.append(timings)
+    
+    with st.sidebar:
+        st.subheader("Performance Diagnostics")
+        st.caption(f"Rerun {st.session_state.rerun_count} this session · {timings['total'] * 1000:,.0f} ms total")
+        
+        # Last run against the median over the recent runs that had each phase, slowest phase first;
+        # fragment reruns only time their own section
+        history_df = pd.DataFrame(list(history))
+        phases = [phase for phase in timings if phase != 'total']
+        phase_df = pd.DataFrame({
+            'Phase': phases,
+            'Last (ms)': [timings[phase] * 1000 for phase in phases],
+            'Median (ms)': [history_df[phase].median() * 1000 for phase in phases]
+        })
+        phase_df = phase_df.sort_values('Last (ms)', ascending=False)
+        st.dataframe(phase_df.round(1), use_container_width=True, hide_index=True)
+        
+        cache_stats = parse_cache_stats(get_parse_cache())
+        st.caption(
+            f"Parse cache: {cache_stats['hit_rate']:.0%} hit rate "
+            f"({cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['evictions']} evictions)"
+        )
+        if not pipeline_data.empty:
+            memory_mib = pipeline_memory_bytes(pipeline_data, compiled_pipeline) / 2 ** 20
+            st.caption(f"Pipeline memory: {memory_mib:,.2f} MiB for {len(compiled_pipeline['names'])} opportunities")
+        
+        if len(history) > 1:
+            fig_history = go.Figure()
+            for phase in history_df.columns:
+                if phase != 'total':
+                    fig_history.add_trace(go.Bar(x=history_df.index, y=history_df[phase].fillna(0.0) * 1000,
+                                                 name=phase))
+            fig_history.update_layout(
+                barmode='stack',
+                height=300,
+                margin=dict(l=0, r=0, t=30, b=0),
+                title=f"Last {len(history)} reruns",
+                xaxis_title="Rerun",
+                yaxis_title="ms",
+                showlegend=False
+            )
+            st.plotly_chart(fig_history, use_container_width=True)
@@ -0,0 +1,199 @@
+"""Regression tests for workbook ingestion."""
+
+import re
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from pipeline_core import (
+    cached_parse_pipeline,
+    cached_pipeline_changes,
+    compile_pipeline,
+    new_parse_cache,
+    parse_excel_incremental,
+    parse_excel_pipeline,
+    patch_compiled_pipeline,
+    sheet_changes,
+)
+
+MONTHS = ['May_2026', 'Jun_2026', 'Jul_2026']
+
+@pytest.fixture
+def stale_dimension_workbook(tmp_path):
+    """A two-sheet pipeline workbook whose sheets claim a stale <dimension ref="A1:A2"/>"""
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for i in range(2):
+        sheet = workbook.create_sheet(f"Opp{i}")
+        sheet.append([f"Project {i}"])
+        sheet.append(["Secured income"])
+        sheet.append([None] + MONTHS)
+        sheet.append(["Income", 100, 200, 300])
+        sheet.append(["Staff", 10, 20, 30])
+        sheet.append(["Expenses", 1, 2, 3])
+    source = tmp_path / 'fresh.xlsx'
+    workbook.save(source)
+    
+    target = tmp_path / 'stale.xlsx'
+    with zipfile.ZipFile(source) as archive, zipfile.ZipFile(target, 'w') as stale:
+        for info in archive.infolist():
+            data = archive.read(info.filename)
+            if info.filename.startswith('xl/worksheets/'):
+                data = re.sub(rb'<dimension ref="[^"]*"\s*/>', b'<dimension ref="A1:A2"/>', data)
+            stale.writestr(info, data)
+    return target
+
+def test_stale_dimension_reads_every_month(stale_dimension_workbook):
+    pipeline_data = parse_excel_pipeline(stale_dimension_workbook)
+    assert pipeline_data.shape == (2, 2 + 3 * len(MONTHS))
+    assert list(pipeline_data['opportunity_name']) == ['Project 0', 'Project 1']
+    assert list(pipeline_data['cluster']) == ['Secured income', 'Secured income']
+    assert pipeline_data['Jul_2026_income'].tolist() == [300, 300]
+    assert pipeline_data['Jun_2026_staff'].tolist() == [20, 20]
+    assert pipeline_data['May_2026_expenses'].tolist() == [1, 1]
+
+def write_workbook(path, sheets):
+    """Save {sheet name: (opportunity name, cluster, income)} as a pipeline workbook"""
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for sheet_name, (name, cluster, income) in sheets.items():
+        sheet = workbook.create_sheet(sheet_name)
+        sheet.append([name])
+        sheet.append([cluster])
+        sheet.append([None] + MONTHS)
+        sheet.append(["Income"] + list(income))
+        sheet.append(["Staff", 10, 20, 30])
+        sheet.append(["Expenses", 1, 2, 3])
+    workbook.save(path)
+    return path
+
+def shared_strings_copy(source, target, edit=None):
+    """Copy a workbook with every string in a shared strings part, optionally edited in place by `edit`"""
+    with zipfile.ZipFile(source) as archive:
+        parts = {info.filename: archive.read(info.filename) for info in archive.infolist()}
+    existing = parts.pop('xl/sharedStrings.xml', b'').decode()
+    strings = re.findall(r'<si><t[^>]*>(.*?)</t></si>', existing)
+    index = {text: i for i, text in enumerate(strings)}
+    
+    def shared(match):
+        text = match.group(2)
+        if text not in index:
+            index[text] = len(strings)
+            strings.append(text)
+        return f'<c r="{match.group(1)}" t="s"><v>{index[text]}</v></c>'
+    
+    for name in parts:
+        if name.startswith('xl/worksheets/'):
+            parts[name] = re.sub(r'<c r="(\w+)" t="inlineStr"><is><t>(.*?)</t></is></c>', shared,
+                                 parts[name].decode()).encode()
+    if edit is not None:
+        edit(strings)
+    items = ''.join(f'<si><t>{text}</t></si>' for text in strings)
+    parts['xl/sharedStrings.xml'] = (
+        '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        f'count="{len(strings)}" uniqueCount="{len(strings)}">{items}</sst>'
+    ).encode()
+    if not existing:
+        parts['xl/_rels/workbook.xml.rels'] = parts['xl/_rels/workbook.xml.rels'].replace(
+            b'</Relationships>',
+            b'<Relationship Id="rIdStrings" Target="sharedStrings.xml" '
+            b'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"/>'
+            b'</Relationships>'
+        )
+        parts['[Content_Types].xml'] = parts['[Content_Types].xml'].replace(
+            b'</Types>',
+            b'<Override PartName="/xl/sharedStrings.xml" '
+            b'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/></Types>'
+        )
+    with zipfile.ZipFile(target, 'w') as archive:
+        for name, data in parts.items():
+            archive.writestr(name, data)
+    return target
+
+def assert_matches_fresh_parse(previous, result, path):
+    """The incremental parse, and the previous compiled pipeline patched with it, equal a parse from scratch"""
+    fresh = parse_excel_pipeline(path)
+    pd.testing.assert_frame_equal(result['pipeline_data'], fresh)
+    
+    patched = patch_compiled_pipeline(compile_pipeline(previous['pipeline_data'], MONTHS), result['pipeline_data'],
+                                      result['changes']['previous_positions'])
+    compiled = compile_pipeline(fresh, MONTHS)
+    assert list(patched['names']) == list(compiled['names'])
+    assert patched['clusters'] == compiled['clusters']
+    np.testing.assert_array_equal(patched['cluster_codes'], compiled['cluster_codes'])
+    np.testing.assert_array_equal(patched['values'], compiled['values'])
+
+BASE_SHEETS = {
+    'Opp0': ("Project 0", "Secured income", [100, 200, 300]),
+    'Opp1': ("Project 1", "Contracting", [400, 500, 600]),
+    'Opp2': ("Project 2", "Negotiating", [700, 800, 900])
+}
+
+@pytest.mark.parametrize('sheets, changes', [
+    (BASE_SHEETS, {'added': [], 'removed': [], 'changed': [], 'reparsed': 0}),
+    ({**BASE_SHEETS, 'Opp1': ("Project 1", "Contracting", [400, 550, 600])},
+     {'added': [], 'removed': [], 'changed': ['Opp1'], 'reparsed': 1}),
+    ({**BASE_SHEETS, 'Opp3': ("Project 3", "Ideas at development stage", [1, 2, 3])},
+     {'added': ['Opp3'], 'removed': [], 'changed': [], 'reparsed': 1}),
+    ({name: sheet for name, sheet in BASE_SHEETS.items() if name != 'Opp1'},
+     {'added': [], 'removed': ['Opp1'], 'changed': [], 'reparsed': 0}),
+    ({('Renamed' if name == 'Opp0' else name): sheet for name, sheet in BASE_SHEETS.items()},
+     {'added': ['Renamed'], 'removed': ['Opp0'], 'changed': [], 'reparsed': 1}),
+    # Equal values stored differently (here as text) are not a change
+    ({**BASE_SHEETS, 'Opp2': ("Project 2", "Negotiating", ["700", "800", "900.0"])},
+     {'added': [], 'removed': [], 'changed': [], 'reparsed': 1}),
+], ids=['unchanged', 'edited', 'added', 'removed', 'renamed', 'resaved'])
+def test_incremental_reupload_matches_fresh_parse(tmp_path, sheets, changes):
+    previous = parse_excel_incremental(write_workbook(tmp_path / 'before.xlsx', BASE_SHEETS))
+    path = write_workbook(tmp_path / 'after.xlsx', sheets)
+    result = parse_excel_incremental(path, previous['sheets'], previous['shared'])
+    
+    assert {key: result['changes'][key] for key in changes} == changes
+    assert_matches_fresh_parse(previous, result, path)
+    
+    # Worked out again from the parsed sheets alone, as for another session's upload
+    recomputed = sheet_changes(previous['sheets'], result['sheets'], result['changes']['reparsed'])
+    np.testing.assert_array_equal(recomputed.pop('previous_positions'), result['changes']['previous_positions'])
+    assert recomputed == {key: value for key, value in result['changes'].items() if key != 'previous_positions'}
+
+def test_shared_strings_edits(tmp_path):
+    source = write_workbook(tmp_path / 'source.xlsx', BASE_SHEETS)
+    previous = parse_excel_incremental(shared_strings_copy(source, tmp_path / 'before.xlsx'))
+    
+    # New strings appended to the table leave every unchanged sheet as it was
+    appended = shared_strings_copy(source, tmp_path / 'appended.xlsx', lambda strings: strings.append("Unused"))
+    result = parse_excel_incremental(appended, previous['sheets'], previous['shared'])
+    assert result['changes']['reparsed'] == 0
+    assert_matches_fresh_parse(previous, result, appended)
+    
+    # An existing string changing its text re-reads every sheet, and only the sheet using it has changed
+    def rename(strings):
+        strings[strings.index("Project 1")] = "Project One"
+    edited = shared_strings_copy(source, tmp_path / 'edited.xlsx', rename)
+    result = parse_excel_incremental(edited, previous['sheets'], previous['shared'])
+    assert result['changes']['reparsed'] == len(BASE_SHEETS)
+    assert result['changes']['changed'] == ['Opp1']
+    assert_matches_fresh_parse(previous, result, edited)
+
+def test_cached_reupload_patches_compiled_pipeline(tmp_path):
+    cache = new_parse_cache()
+    before = write_workbook(tmp_path / 'before.xlsx', BASE_SHEETS)
+    after = write_workbook(tmp_path / 'after.xlsx', {
+        'Opp3': ("Project 3", "Ideas at development stage", [1, 2, 3]),
+        **{name: sheet for name, sheet in BASE_SHEETS.items() if name != 'Opp0'},
+        'Opp2': ("Project 2", "Contracting", [700, 800, 900])
+    })
+    previous_key, _, _ = cached_parse_pipeline(cache, before.read_bytes(), MONTHS)
+    key, _, compiled = cached_parse_pipeline(cache, after.read_bytes(), MONTHS, previous_key=previous_key)
+    
+    expected = compile_pipeline(parse_excel_pipeline(after), MONTHS)
+    assert list(compiled['names']) == list(expected['names'])
+    assert compiled['clusters'] == expected['clusters']
+    np.testing.assert_array_equal(compiled['values'], expected['values'])
+    
+    changes = cached_pipeline_changes(cache, key, MONTHS, previous_key)
+    assert (changes['added'], changes['removed'], changes['changed']) == (['Opp3'], ['Opp0'], ['Opp2'])
+    assert cached_pipeline_changes(cache, key, MONTHS, None) is None
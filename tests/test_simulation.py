@@ -0,0 +1,99 @@
+"""Regression tests for the chunked Monte Carlo simulation."""
+
+import threading
+
+import numpy as np
+import pytest
+
+from pipeline_core import (
+    SIMULATION_CHUNK_TRIALS,
+    build_cost_schedules,
+    generate_month_list,
+    importance_probabilities,
+    run_simulation,
+)
+
+MONTHS = generate_month_list('May_2026', 12)
+
+TRIALS = 4 * SIMULATION_CHUNK_TRIALS + 123
+
+@pytest.fixture(scope='module')
+def simulation_inputs():
+    """A small random pipeline, its win probabilities and cost schedules"""
+    rng = np.random.default_rng(0)
+    opportunities = 40
+    compiled = {
+        'names': np.array([f"Opp{i}" for i in range(opportunities)], dtype=object),
+        'clusters': ['Contracting', 'Negotiating'],
+        'cluster_codes': rng.integers(0, 2, opportunities).astype(np.intp),
+        'months': MONTHS,
+        'values': rng.uniform(0, 1, (opportunities, len(MONTHS), 3)) * [8000, 2000, 500]
+    }
+    win_probabilities = rng.uniform(0.1, 0.9, opportunities)
+    schedules = build_cost_schedules(MONTHS, [], [], [])
+    return compiled, win_probabilities, schedules, 100000, 50000
+
+# Importance sampling draws its uniforms as 'random' does, from tilted probabilities
+@pytest.mark.parametrize('sampling', ['random', 'antithetic', 'latin_hypercube', 'importance'])
+def test_same_seed_same_paths_for_any_workers_or_backend(simulation_inputs, sampling):
+    compiled, win_probabilities, schedules, unrestricted_start, restricted_funds = simulation_inputs
+    sampling_probabilities = None
+    if sampling == 'importance':
+        sampling, sampling_probabilities = 'random', importance_probabilities(
+            compiled, win_probabilities, schedules, unrestricted_start, restricted_funds, 80000
+        )
+        assert len(sampling_probabilities)
+    
+    runs = [
+        run_simulation(compiled, win_probabilities, schedules, unrestricted_start, restricted_funds, TRIALS,
+                       seed=42, workers=workers, sampling=sampling, sampling_probabilities=sampling_probabilities,
+                       backend=backend)
+        for workers, backend in ((1, 'threads'), (2, 'threads'), (4, 'threads'), (2, 'processes'))
+    ]
+    
+    paths, likelihood_ratios, status = runs[0]
+    assert paths.shape == (TRIALS, len(MONTHS))
+    assert status['completed_trials'] == TRIALS and not status['cancelled'] and not status['timed_out']
+    for other_paths, other_ratios, other_status in runs[1:]:
+        np.testing.assert_array_equal(other_paths, paths)
+        if likelihood_ratios is None:
+            assert other_ratios is None
+        else:
+            np.testing.assert_array_equal(other_ratios, likelihood_ratios)
+        assert other_status == status
+
+@pytest.mark.parametrize('backend', ['threads', 'processes'])
+def test_cancel_returns_no_trials(simulation_inputs, backend):
+    cancel_event = threading.Event()
+    cancel_event.set()
+    paths, _, status = run_simulation(*simulation_inputs, TRIALS, seed=42, workers=2, cancel_event=cancel_event,
+                                      backend=backend)
+    assert paths.shape == (0, len(MONTHS))
+    assert status == {'requested_trials': TRIALS, 'completed_trials': 0, 'cancelled': True, 'timed_out': False}
+
+def test_cancel_during_run_keeps_leading_trials(simulation_inputs):
+    trials = 200 * SIMULATION_CHUNK_TRIALS
+    cancel_event = threading.Event()
+    timer = threading.Timer(0.05, cancel_event.set)
+    timer.start()
+    try:
+        paths, _, status = run_simulation(*simulation_inputs, trials, seed=42, workers=2, cancel_event=cancel_event)
+    finally:
+        timer.cancel()
+    assert status['cancelled'] and not status['timed_out']
+    assert status['completed_trials'] == len(paths) < trials
+    
+    full_paths, _, _ = run_simulation(*simulation_inputs, len(paths), seed=42)
+    np.testing.assert_array_equal(paths, full_paths)
+
+@pytest.mark.parametrize('backend', ['threads', 'processes'])
+def test_time_limit_keeps_leading_trials(simulation_inputs, backend):
+    trials = 40 * SIMULATION_CHUNK_TRIALS
+    paths, _, status = run_simulation(*simulation_inputs, trials, seed=42, workers=2, time_limit=0.0,
+                                      backend=backend)
+    assert status['timed_out'] and not status['cancelled']
+    assert status['completed_trials'] == len(paths) < trials
+    
+    # What was kept is the start of the full run with the same seed
+    full_paths, _, _ = run_simulation(*simulation_inputs, len(paths), seed=42)
+    np.testing.assert_array_equal(paths, full_paths)
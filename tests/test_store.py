@@ -0,0 +1,75 @@
+"""Regression tests for the SQLite pipeline store."""
+
+import sqlite3
+import threading
+
+import pandas as pd
+import pytest
+
+from pipeline_core import LONG_COLUMNS, close_pipeline_store, open_pipeline_store, save_snapshot
+
+PIPELINE = pd.DataFrame(
+    [['Opp1', 'Contracting', 'May_2026', 1000.0, 200.0, 50.0],
+     ['Opp1', 'Contracting', 'Jun_2026', 1100.0, 200.0, 50.0],
+     ['Opp2', 'Negotiating', 'May_2026', 500.0, 100.0, 0.0]],
+    columns=list(LONG_COLUMNS)
+)
+
+@pytest.mark.parametrize('shared_connection', [True, False], ids=['one_store', 'store_per_thread'])
+def test_concurrent_saves_of_same_content_share_one_snapshot(tmp_path, shared_connection):
+    path = tmp_path / 'pipeline.sqlite'
+    if shared_connection:
+        stores = [open_pipeline_store(path)] * 8
+    else:
+        stores = [open_pipeline_store(path) for _ in range(8)]
+    barrier = threading.Barrier(len(stores))
+    snapshot_ids = []
+    
+    def save(store):
+        barrier.wait()
+        snapshot_ids.append(save_snapshot(store, PIPELINE, source='test', content_hash='same-upload'))
+    
+    threads = [threading.Thread(target=save, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(snapshot_ids) == len(stores) and len(set(snapshot_ids)) == 1
+    assert stores[0]['connection'].execute("SELECT COUNT(*) FROM snapshots").fetchone() == (1,)
+    for store in stores:
+        close_pipeline_store(store)
+
+def _add_duplicate_hashes(path):
+    """Turn the store back into one from before content hashes were unique, holding a duplicate"""
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute("DROP INDEX snapshots_unique_content_hash")
+        connection.execute("CREATE INDEX snapshots_content_hash ON snapshots (content_hash)")
+        connection.execute(
+            "INSERT INTO snapshots (created_at, source, content_hash, opportunities, first_month, last_month) "
+            "SELECT created_at, source, content_hash, opportunities, first_month, last_month FROM snapshots"
+        )
+    connection.close()
+
+def test_migration_runs_once_and_keeps_newest_duplicate_hash(tmp_path):
+    path = tmp_path / 'pipeline.sqlite'
+    store = open_pipeline_store(path)
+    first = save_snapshot(store, PIPELINE, source='test', content_hash='upload')
+    close_pipeline_store(store)
+    
+    _add_duplicate_hashes(path)
+    with sqlite3.connect(path) as connection:
+        connection.execute("PRAGMA user_version = 0")
+    store = open_pipeline_store(path)
+    rows = store['connection'].execute("SELECT id, content_hash FROM snapshots ORDER BY id").fetchall()
+    assert rows == [(first, None), (first + 1, 'upload')]
+    assert save_snapshot(store, PIPELINE, source='test', content_hash='upload') == first + 1
+    close_pipeline_store(store)
+    
+    # A migrated store is not rewritten on later opens
+    _add_duplicate_hashes(path)
+    store = open_pipeline_store(path)
+    hashes = store['connection'].execute("SELECT content_hash FROM snapshots ORDER BY id").fetchall()
+    assert hashes == [(None,), ('upload',), (None,), ('upload',)]
+    close_pipeline_store(store)